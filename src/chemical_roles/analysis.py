@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""Analyze the relations as sparse chemical by target matrices.
+
+Each chemical is a row and each target is a column of a binary CSR matrix, so
+the number of targets shared by every pair of chemicals is the sparse product
+:math:`M M^T` and the number of chemicals shared by every pair of targets is
+:math:`M^T M`. Similarities are computed from these products in batches of
+rows so memory stays bounded::
+
+    from chemical_roles.analysis import get_matrix, get_neighbors
+    from chemical_roles.query import load_relations_df
+
+    matrix = get_matrix(load_relations_df(), modulation="inhibitor")
+    neighbors_df = get_neighbors(matrix, k=10, metric="jaccard")
+"""
+
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import click
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from more_click import verbose_option
+from tqdm import tqdm
+
+from .constants import RELATIONS_OUTPUT_PATH
+from .utils import normalize_curie
+
+__all__ = [
+    "ChemicalTargetMatrix",
+    "METRICS",
+    "get_matrix",
+    "get_matrices",
+    "get_cooccurrence_df",
+    "iter_similarities",
+    "get_neighbors",
+    "analyze",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The similarity metrics over shared targets
+METRICS = {"jaccard", "cosine"}
+
+
+class ChemicalTargetMatrix(NamedTuple):
+    """A binary matrix of which chemicals modulate which targets."""
+
+    #: The CURIEs of the chemicals, for each row
+    chemicals: List[str]
+    #: The CURIEs of the targets, for each column
+    targets: List[str]
+    #: The chemical by target matrix
+    matrix: sp.csr_matrix
+
+
+def _get_curies(df: pd.DataFrame, side: str) -> np.ndarray:
+    return np.array(
+        [
+            ":".join(normalize_curie(prefix, identifier))
+            for prefix, identifier in zip(df[f"{side}_db"].values, df[f"{side}_id"].values)
+        ],
+        dtype=object,
+    )
+
+
+def get_matrix(
+    df: pd.DataFrame,
+    modulation: Optional[str] = None,
+    target_type: Optional[str] = None,
+) -> ChemicalTargetMatrix:
+    """Build a chemical by target matrix from a relations dataframe.
+
+    :param df: A relations dataframe
+    :param modulation: If given, only use relations with this modulation
+    :param target_type: If given, only use relations to targets of this type
+    :returns: The matrix, with its rows and columns sorted by CURIE
+    """
+    df = df.rename(columns={"type": "target_type"})
+    df = df.dropna(subset=["source_db", "source_id", "target_db", "target_id"])
+    if modulation is not None:
+        df = df[df["modulation"] == modulation]
+    if target_type is not None:
+        df = df[df["target_type"] == target_type]
+
+    rows, chemicals = pd.factorize(_get_curies(df, "source"), sort=True)
+    columns, targets = pd.factorize(_get_curies(df, "target"), sort=True)
+    matrix = sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(chemicals), len(targets)),
+    )
+    # Relations that differ only in their names are counted once
+    matrix.data[:] = 1.0
+    return ChemicalTargetMatrix(list(chemicals), list(targets), matrix)
+
+
+def get_matrices(
+    df: pd.DataFrame, target_type: Optional[str] = None
+) -> Dict[str, ChemicalTargetMatrix]:
+    """Build a chemical by target matrix for each modulation.
+
+    :param df: A relations dataframe
+    :param target_type: If given, only use relations to targets of this type
+    :returns: A dictionary from each modulation to its matrix
+    """
+    return {
+        modulation: get_matrix(df, modulation=modulation, target_type=target_type)
+        for modulation in sorted(df["modulation"].dropna().unique())
+    }
+
+
+def get_cooccurrence_df(matrix: ChemicalTargetMatrix, axis: str = "target") -> pd.DataFrame:
+    """Count how often each pair of targets (or chemicals) co-occur.
+
+    :param matrix: A chemical by target matrix
+    :param axis: Either ``target``, to count the chemicals shared by each pair of targets,
+        or ``chemical``, to count the targets shared by each pair of chemicals
+    :returns: A dataframe with a row for each pair with a non-zero count, sorted by descending count
+    """
+    if axis == "target":
+        labels, m = matrix.targets, matrix.matrix.T.tocsr()
+    elif axis == "chemical":
+        labels, m = matrix.chemicals, matrix.matrix
+    else:
+        raise ValueError(f"invalid axis: {axis}")
+
+    counts = sp.triu(m @ m.T, k=1).tocoo()
+    labels = np.asarray(labels, dtype=object)
+    rv = pd.DataFrame(
+        {
+            "left": labels[counts.row],
+            "right": labels[counts.col],
+            "count": counts.data.astype(np.int64),
+        }
+    )
+    return rv.sort_values(["count", "left", "right"], ascending=[False, True, True]).reset_index(
+        drop=True
+    )
+
+
+def iter_similarities(
+    matrix: ChemicalTargetMatrix,
+    metric: str = "jaccard",
+    batch_size: int = 1024,
+) -> Iterable[Tuple[int, sp.csr_matrix]]:
+    """Calculate the similarities between chemicals based on their shared targets, in batches.
+
+    :param matrix: A chemical by target matrix
+    :param metric: Either ``jaccard`` or ``cosine``
+    :param batch_size: The number of chemicals in each batch
+    :yields: The position of each batch's first chemical and a sparse matrix of
+        the similarities between the batch's chemicals and all chemicals. Pairs
+        that share no targets are left out.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"invalid metric: {metric}. Should be one of {sorted(METRICS)}")
+    m = matrix.matrix
+    m_t = m.T.tocsc()
+    sizes = np.asarray(m.sum(axis=1)).ravel()
+
+    for start in range(0, m.shape[0], batch_size):
+        shared = (m[start : start + batch_size] @ m_t).tocoo()
+        left, right = sizes[shared.row + start], sizes[shared.col]
+        if metric == "jaccard":
+            data = shared.data / (left + right - shared.data)
+        else:
+            data = shared.data / np.sqrt(left * right)
+        yield start, sp.csr_matrix((data, (shared.row, shared.col)), shape=shared.shape)
+
+
+def get_neighbors(
+    matrix: ChemicalTargetMatrix,
+    k: int = 10,
+    metric: str = "jaccard",
+    batch_size: int = 1024,
+) -> pd.DataFrame:
+    """Get the most similar chemicals for each chemical.
+
+    :param matrix: A chemical by target matrix
+    :param k: The number of neighbors for each chemical
+    :param metric: Either ``jaccard`` or ``cosine``
+    :param batch_size: The number of chemicals whose similarities are calculated at once
+    :returns: A dataframe with the chemical, its neighbor, and their similarity, with up
+        to ``k`` rows for each chemical, ordered by descending similarity
+    """
+    chemicals = np.asarray(matrix.chemicals, dtype=object)
+    lefts, rights, similarities = [], [], []
+    it = tqdm(
+        iter_similarities(matrix, metric=metric, batch_size=batch_size),
+        total=-(-matrix.matrix.shape[0] // batch_size),
+        desc=f"{metric} neighbors",
+        unit="batch",
+    )
+    for start, batch in it:
+        for row in range(batch.shape[0]):
+            lo, hi = batch.indptr[row], batch.indptr[row + 1]
+            data, indices = batch.data[lo:hi], batch.indices[lo:hi]
+            # A chemical isn't its own neighbor
+            keep = indices != start + row
+            data, indices = data[keep], indices[keep]
+            if not len(data):
+                continue
+            # Break ties by the neighbor's position so the output is deterministic
+            order = np.lexsort((indices, -data))[:k]
+            lefts.append(np.full(len(order), start + row))
+            rights.append(indices[order])
+            similarities.append(data[order])
+
+    if not lefts:
+        return pd.DataFrame(columns=["chemical", "neighbor", "similarity"])
+    return pd.DataFrame(
+        {
+            "chemical": chemicals[np.concatenate(lefts)],
+            "neighbor": chemicals[np.concatenate(rights)],
+            "similarity": np.concatenate(similarities),
+        }
+    )
+
+
+@click.group()
+def analyze():
+    """Analyze the relations as sparse chemical by target matrices."""
+
+
+relations_option = click.option(
+    "--relations",
+    type=click.Path(dir_okay=False),
+    default=RELATIONS_OUTPUT_PATH,
+    show_default=True,
+    help="A relations TSV. If it doesn't exist, the relations are assembled from scratch instead.",
+)
+modulation_option = click.option("--modulation", help="Only use relations with this modulation")
+target_type_option = click.option(
+    "--target-type", help="Only use relations to targets of this type"
+)
+
+
+@analyze.command()
+@relations_option
+@modulation_option
+@target_type_option
+@click.option("--metric", type=click.Choice(["jaccard", "cosine"]), default="jaccard")
+@click.option("-k", type=int, default=10, show_default=True, help="The number of neighbors")
+@click.option("--batch-size", type=int, default=1024, show_default=True)
+@click.option("--output", type=click.File("w"), default="-", help="Defaults to stdout")
+@verbose_option
+def neighbors(relations, modulation, target_type, metric, k, batch_size, output):
+    """Write the most similar chemicals for each chemical based on their shared targets."""
+    from .query import load_relations_df
+
+    matrix = get_matrix(
+        load_relations_df(relations), modulation=modulation, target_type=target_type
+    )
+    df = get_neighbors(matrix, k=k, metric=metric, batch_size=batch_size)
+    df.to_csv(output, sep="\t", index=False)
+
+
+@analyze.command()
+@relations_option
+@modulation_option
+@target_type_option
+@click.option("--axis", type=click.Choice(["target", "chemical"]), default="target")
+@click.option("--output", type=click.File("w"), default="-", help="Defaults to stdout")
+@verbose_option
+def cooccurrence(relations, modulation, target_type, axis, output):
+    """Write how many chemicals each pair of targets share, or vice versa."""
+    from .query import load_relations_df
+
+    matrix = get_matrix(
+        load_relations_df(relations), modulation=modulation, target_type=target_type
+    )
+    get_cooccurrence_df(matrix, axis=axis).to_csv(output, sep="\t", index=False)
+
+
+if __name__ == "__main__":
+    analyze()
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the hot paths on synthetic data, offline.
+
+The curated ``xrefs.tsv`` is scaled up by copying its rows with fresh ChEBI and
+HGNC identifiers, and the upstream resources used during inference (the ChEBI
+role hierarchy, the ExPASy closure and ec2go, the HGNC to UniProt mappings, and
+FamPlex) are replaced by small fixtures generated from it, so nothing is
+downloaded. Each stage is timed over several runs and its peak memory is traced
+on one more run::
+
+    from chemical_roles.benchmark import run_benchmarks
+
+    results = run_benchmarks(scale=10)
+
+Results can be saved as JSON with ``chemical_roles benchmark --save`` and compared
+against a baseline from another commit with ``chemical_roles benchmark --compare``.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Sequence
+from unittest import mock
+
+import click
+import numpy as np
+import pandas as pd
+from more_click import verbose_option
+
+from .closure import ClosureIndex
+from .constants import ROOT
+from .resources import get_xrefs_df
+
+__all__ = [
+    "STAGES",
+    "generate_xrefs_df",
+    "offline_fixtures",
+    "run_benchmarks",
+    "compare_benchmarks",
+    "benchmark",
+]
+
+logger = logging.getLogger(__name__)
+
+#: Added to the ChEBI identifiers of each copy of the curated roles
+CHEBI_OFFSET = 1_000_000
+#: Added to the HGNC identifiers of each copy of the curated targets
+HGNC_OFFSET = 100_000
+
+
+def generate_xrefs_df(scale: int = 1, seed: int = 0) -> pd.DataFrame:
+    """Generate a synthetic version of ``xrefs.tsv``.
+
+    :param scale: The number of copies of the curated relations. The first copy is
+        the curated relations themselves, and the others get new ChEBI role and
+        HGNC gene identifiers so the roles and genes are distinct.
+    :param seed: The seed for shuffling the rows
+    :returns: A dataframe like :func:`chemical_roles.resources.get_xrefs_df` with
+        ``scale`` times as many rows
+    """
+    xrefs_df = get_xrefs_df()
+    chebi = xrefs_df["source_db"] == "chebi"
+    source_numbers = xrefs_df.loc[chebi, "source_id"].str.split(":").str[-1].astype(int)
+    hgnc = xrefs_df["target_db"] == "hgnc"
+    target_numbers = xrefs_df.loc[hgnc, "target_id"].astype(int)
+
+    dfs = []
+    for copy in range(scale):
+        df = xrefs_df.copy()
+        if copy:
+            df.loc[chebi, "source_id"] = [
+                f"CHEBI:{n + copy * CHEBI_OFFSET}" for n in source_numbers
+            ]
+            df.loc[chebi, "source_name"] = df.loc[chebi, "source_name"] + f" {copy}"
+            df.loc[hgnc, "target_id"] = (target_numbers + copy * HGNC_OFFSET).astype(str)
+        dfs.append(df)
+    rv = pd.concat(dfs, ignore_index=True)
+    return rv.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def _strip(prefix: str, identifier: str) -> str:
+    if identifier.startswith(f"{prefix.upper()}:"):
+        return identifier[len(prefix) + 1 :]
+    return identifier
+
+
+@contextlib.contextmanager
+def offline_fixtures(
+    xrefs_df: pd.DataFrame,
+    seed: int = 0,
+    chemicals_per_role: int = 5,
+    members_per_family: int = 3,
+):
+    """Replace ``xrefs.tsv`` and the upstream resources with fixtures generated from it.
+
+    :param xrefs_df: The relations to use instead of ``xrefs.tsv``, e.g., from
+        :func:`generate_xrefs_df`
+    :param seed: The seed for assigning chemicals to roles
+    :param chemicals_per_role: The number of chemicals that have each role. Chemicals are
+        drawn from a pool half as large as needed, so many of them have several roles.
+    :param members_per_family: The number of HGNC genes in each FamPlex entity
+    """
+    from .export.utils import get_relations_df
+
+    rng = np.random.default_rng(seed)
+    role_ids = sorted(
+        {
+            _strip("chebi", source_id)
+            for source_db, source_id in xrefs_df[["source_db", "source_id"]].values
+            if source_db == "chebi"
+        }
+    )
+    pool = max(1, len(role_ids) * chemicals_per_role // 2)
+    role_to_children = {
+        role_id: {
+            ("chebi", str(10 * CHEBI_OFFSET + int(i)))
+            for i in rng.choice(pool, size=min(chemicals_per_role, pool), replace=False)
+        }
+        for role_id in role_ids
+    }
+
+    def _get_targets(target_db: str) -> Sequence[str]:
+        return sorted(set(xrefs_df.loc[xrefs_df["target_db"] == target_db, "target_id"]))
+
+    ec_codes = _get_targets("eccode")
+    ec_code_to_children = {
+        ec_code: [
+            ("eccode", f"{ec_code}.{i}", f"{ec_code}.{i}")
+            for i in range(1, 3)
+            if ec_code.count(".") < 3
+        ]
+        + [("uniprot", f"P{i:05d}", f"P{i:05d}_HUMAN"), ("prosite", f"PS{i:05d}", f"PS{i:05d}")]
+        # About one in twenty codes has no children, like in the real closure
+        for i, ec_code in enumerate(ec_codes)
+        if i % 20
+    }
+    ec2go = {ec_code: [(f"GO:{i:07d}", f"activity {i}")] for i, ec_code in enumerate(ec_codes)}
+    # Every other family is nested in the one before it, so the closure is exercised
+    famplex_targets = _get_targets("fplx")
+    famplex_id_to_members = ClosureIndex.from_edges(
+        [
+            (
+                ("hgnc", str(2 * HGNC_OFFSET + members_per_family * i + j), f"GENE{i}_{j}"),
+                ("fplx", fplx_id, fplx_id),
+            )
+            for i, fplx_id in enumerate(famplex_targets)
+            for j in range(members_per_family)
+        ]
+        + [
+            (("fplx", child, child), ("fplx", parent, parent))
+            for parent, child in zip(famplex_targets[::2], famplex_targets[1::2])
+        ]
+    )
+
+    def _get_uniprot_id_names(hgnc_id: str):
+        yield f"Q{int(hgnc_id):07d}", f"Q{int(hgnc_id):07d}_HUMAN"
+
+    def _get_name(prefix: str, identifier: str) -> str:
+        return f"{prefix} {identifier}"
+
+    patches = [
+        mock.patch("chemical_roles.export.utils.get_xrefs_df", lambda: xrefs_df.copy()),
+        mock.patch("chemical_roles.lint.get_xrefs_df", lambda: xrefs_df.copy()),
+        # A bundle would take precedence over the fixtures
+        mock.patch("chemical_roles.bundle.get_bundle", lambda: None),
+        mock.patch("chemical_roles.export.utils._get_famplex", lambda: famplex_id_to_members),
+        mock.patch(
+            "chemical_roles.export.utils.get_expasy_closure", lambda: (None, ec_code_to_children)
+        ),
+        mock.patch("chemical_roles.export.utils.get_uniprot_id_names", _get_uniprot_id_names),
+        mock.patch("pyobo.sources.expasy.get_ec2go", lambda: ec2go),
+        mock.patch("pyobo.sources.chebi.get_chebi_role_to_children", lambda: role_to_children),
+        mock.patch("pyobo.get_name", _get_name),
+    ]
+    with contextlib.ExitStack() as stack:
+        for patch in patches:
+            stack.enter_context(patch)
+        get_relations_df.cache_clear()
+        try:
+            yield
+        finally:
+            get_relations_df.cache_clear()
+
+
+def _relations() -> None:
+    from .export.utils import get_relations_df
+
+    get_relations_df.cache_clear()
+    get_relations_df()
+
+
+def _bel() -> None:
+    from .export.bel import get_bel
+
+    get_bel()
+
+
+def _obo() -> None:
+    from .export.obo import iter_terms
+
+    for _ in iter_terms():
+        pass
+
+
+def _export(directory: str) -> None:
+    from .export import build
+    from .export.plots import submit_summary_plot
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(build, "DOCS", directory))
+        stack.enter_context(
+            mock.patch.object(
+                build,
+                "submit_summary_plot",
+                partial(
+                    submit_summary_plot,
+                    directory=directory,
+                    cache_path=os.path.join(directory, "plots.json"),
+                ),
+            )
+        )
+        build.write_export(directory=directory)
+
+
+def _validate() -> None:
+    from .lint import validate
+
+    validate.callback()
+
+
+#: The benchmarked stages, in order
+STAGES: Mapping[str, Callable[..., None]] = {
+    "relations": _relations,
+    "bel": _bel,
+    "obo": _obo,
+    "export": _export,
+    "validate": _validate,
+}
+
+
+def _measure(func: Callable[[], None], repeat: int) -> Dict[str, Any]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "times": times,
+        "min": min(times),
+        "median": statistics.median(times),
+        "peak_memory": peak,
+    }
+
+
+def run_benchmarks(
+    scale: int = 1,
+    stages: Optional[Iterable[str]] = None,
+    repeat: int = 3,
+    seed: int = 0,
+) -> Dict[str, Dict[str, Any]]:
+    """Benchmark the stages on synthetic data.
+
+    :param scale: The size of the synthetic data, as a multiple of ``xrefs.tsv``
+    :param stages: The stages to run. Defaults to all of :data:`STAGES`.
+    :param repeat: The number of timed runs of each stage
+    :param seed: The seed for the synthetic data
+    :returns: A dictionary from each stage to its wall times and peak memory in bytes,
+        or to the error it raised
+    """
+    from .export.utils import get_relations_df
+
+    stages = list(STAGES) if stages is None else list(stages)
+    xrefs_df = generate_xrefs_df(scale=scale, seed=seed)
+    rv = {}
+    with offline_fixtures(xrefs_df, seed=seed), tempfile.TemporaryDirectory() as directory:
+        # The relations are shared by the later stages, so they're only built once for them
+        get_relations_df()
+        for stage in stages:
+            func = STAGES[stage]
+            if stage == "export":
+                func = partial(func, directory)
+            logger.info("benchmarking %s at scale %d", stage, scale)
+            try:
+                rv[stage] = _measure(func, repeat=repeat)
+            except Exception as e:  # noqa:B902
+                logger.exception("could not benchmark %s", stage)
+                rv[stage] = {"error": f"{type(e).__name__}: {e}"}
+    return rv
+
+
+def _get_metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+    }
+
+
+def compare_benchmarks(
+    results: Mapping[str, Mapping[str, Mapping[str, Any]]],
+    baseline: Mapping[str, Mapping[str, Mapping[str, Any]]],
+    tolerance: float = 0.2,
+) -> pd.DataFrame:
+    """Compare benchmark results against a baseline.
+
+    :param results: A dictionary from each scale to the results of :func:`run_benchmarks`
+    :param baseline: Results in the same shape, e.g., from another commit
+    :param tolerance: The relative increase in median time or peak memory that counts as
+        a regression
+    :returns: A dataframe with a row for each scale and stage in both, with the ratios
+        of the current to the baseline median time and peak memory
+    """
+    rows = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            if base is None or "error" in base or "error" in result:
+                continue
+            time_ratio = result["median"] / base["median"]
+            memory_ratio = result["peak_memory"] / max(base["peak_memory"], 1)
+            rows.append(
+                (
+                    scale,
+                    stage,
+                    base["median"],
+                    result["median"],
+                    time_ratio,
+                    memory_ratio,
+                    max(time_ratio, memory_ratio) > 1 + tolerance,
+                )
+            )
+    columns = ["scale", "stage", "baseline", "median", "time_ratio", "memory_ratio", "regression"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+@click.command()
+@click.option(
+    "--scale",
+    "scales",
+    type=int,
+    multiple=True,
+    default=[1],
+    show_default=True,
+    help="The size of the synthetic xrefs, as a multiple of xrefs.tsv. Can be repeated.",
+)
+@click.option("--stage", "stages", type=click.Choice(list(STAGES)), multiple=True)
+@click.option("--repeat", type=int, default=3, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--save", type=click.Path(dir_okay=False), help="Save the results as JSON")
+@click.option(
+    "--compare",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare the results against a baseline saved with --save",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="The relative slowdown or memory increase that counts as a regression",
+)
+@verbose_option
+def benchmark(scales, stages, repeat, seed, save, compare, tolerance):
+    """Benchmark the export on synthetic data, offline."""
+    results = {
+        str(scale): run_benchmarks(scale=scale, stages=stages or None, repeat=repeat, seed=seed)
+        for scale in scales
+    }
+    for scale, stage_results in results.items():
+        for stage, result in stage_results.items():
+            if "error" in result:
+                click.secho(f"[{scale}x] {stage}: {result['error']}", fg="red")
+            else:
+                click.echo(
+                    f"[{scale}x] {stage}: median {result['median']:.3f}s, "
+                    f"min {result['min']:.3f}s, peak {result['peak_memory'] / 2 ** 20:.1f} MiB"
+                )
+
+    if save:
+        with open(save, "w") as file:
+            json.dump(
+                {"metadata": {**_get_metadata(), "seed": seed}, "results": results}, file, indent=2
+            )
+
+    if compare:
+        with open(compare) as file:
+            baseline = json.load(file)
+        comparison_df = compare_benchmarks(results, baseline["results"], tolerance=tolerance)
+        click.echo(f"\nCompared to {baseline['metadata'].get('commit')}:")
+        click.echo(comparison_df.to_string(index=False, float_format="{:.3f}".format))
+        if comparison_df["regression"].any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    benchmark()
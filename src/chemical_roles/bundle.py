@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+
+"""A pinned bundle of the lookups derived from the upstream resources.
+
+The export and the curation look up names, the ChEBI hierarchy and roles, the
+ExPASy closure, ec2go, HGNC to UniProt mappings, and the FamPlex closure, which are
+otherwise rebuilt from their upstream formats by PyOBO and protmapper in every
+process. ``chemical_roles bundle build`` writes all of them to a bundle directory
+with a ``manifest.json`` of the upstream versions and the hashes of the tables.
+
+Each table is an uncompressed Arrow IPC file with its rows sorted by a key, like
+an EC code, next to an index of the unique keys as fixed-width binary with the
+range of rows of each. Both are memory-mapped when they're read, so opening a
+bundle doesn't parse anything. A lookup is a binary search over the keys with
+:func:`numpy.searchsorted`, and only the rows of the keys that are looked up are
+converted to Python objects.
+
+The bundle is read from the directory in the ``CHEMICAL_ROLES_BUNDLE`` environment
+variable, or from :data:`DEFAULT_BUNDLE_DIRECTORY` under the PyStow directory. When
+there's no bundle, the functions in this module fall back to PyOBO, so copying a
+bundle to another machine pins its builds to the same upstream state.
+"""
+
+import itertools as itt
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import click
+from more_click import verbose_option
+
+__all__ = [
+    "Bundle",
+    "get_bundle",
+    "build_bundle",
+    "get_name",
+    "get_id_name_mapping",
+    "get_descendants",
+    "get_role_to_children",
+    "get_ec2go",
+    "bundle",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The version of the bundle's layout, which is bumped when the tables change
+FORMAT_VERSION = 3
+#: The environment variable with the bundle's directory
+BUNDLE_ENVIRONMENT_VARIABLE = "CHEMICAL_ROLES_BUNDLE"
+#: The name of the bundle's directory under the PyStow directory
+DEFAULT_BUNDLE_DIRECTORY = "bundle"
+MANIFEST_NAME = "manifest.json"
+
+#: The prefixes whose names are bundled
+NAME_PREFIXES = ["chebi", "eccode", "mesh"]
+#: The prefixes whose hierarchies are bundled
+HIERARCHY_PREFIXES = ["chebi"]
+#: The upstream resources whose versions are recorded in the manifest
+VERSION_PREFIXES = ["chebi", "expasy", "go", "hgnc", "mesh"]
+
+
+def get_bundle_directory() -> str:
+    """Get the directory the bundle is read from and written to."""
+    directory = os.environ.get(BUNDLE_ENVIRONMENT_VARIABLE)
+    if directory:
+        return directory
+    import pystow
+
+    return str(pystow.join("chemical_roles", DEFAULT_BUNDLE_DIRECTORY, ensure_exists=False))
+
+
+def _get_array(table, column: str):
+    """Get a column as one array, which doesn't copy the column if it's in one chunk."""
+    chunked = table.column(column)
+    if chunked.num_chunks == 1:
+        return chunked.chunk(0)
+    return chunked.combine_chunks()
+
+
+class _KeyIndex:
+    """The sorted keys of a table and the range of rows of each, memory-mapped.
+
+    The keys are stored as fixed-width binary, so they can be viewed as a NumPy
+    bytes array without copying and searched with :func:`numpy.searchsorted`.
+    """
+
+    def __init__(self, table):
+        """Wrap an index table with ``key``, ``start``, and ``stop`` columns.
+
+        :param table: The index table
+        :type table: pyarrow.Table
+        """
+        import numpy as np
+
+        key = _get_array(table, "key")
+        self.width = key.type.byte_width
+        self.keys = np.frombuffer(
+            key.buffers()[1],
+            dtype=f"S{self.width}",
+            count=len(key),
+            offset=key.offset * self.width,
+        )
+        self.starts = _get_array(table, "start").to_numpy()
+        self.stops = _get_array(table, "stop").to_numpy()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find(self, key: str) -> Optional[Tuple[int, int]]:
+        """Get the range of rows of a key, or None if it's missing."""
+        import numpy as np
+
+        encoded = key.encode("utf-8")
+        if len(encoded) > self.width:
+            return None
+        i = int(np.searchsorted(self.keys, encoded))
+        if i == len(self.keys) or self.keys[i] != encoded:
+            return None
+        return int(self.starts[i]), int(self.stops[i])
+
+    def find_prefix(self, prefix: str) -> Tuple[int, int]:
+        """Get the range of positions of the keys that start with a prefix."""
+        import numpy as np
+
+        encoded = prefix.encode("utf-8")
+        lo, hi = np.searchsorted(self.keys, [encoded, encoded + b"\xff"])
+        return int(lo), int(hi)
+
+    def get_key(self, i: int) -> str:
+        """Get the key at a position."""
+        return self.keys[i].decode("utf-8")
+
+
+class BundledLookup(Mapping[str, Any]):
+    """A read-only mapping from the keys of a bundled table to their rows.
+
+    Keys are found with a binary search over the memory-mapped index, and only
+    the rows of the keys that are looked up are converted to Python objects.
+    """
+
+    def __init__(
+        self,
+        index: _KeyIndex,
+        columns: Sequence[Any],
+        *,
+        prefix: str = "",
+        scalar: bool = False,
+        factory: Callable[[List[Tuple]], Any] = list,
+    ):
+        """Initialize the lookup.
+
+        :param index: The index of the table's keys
+        :param columns: The value columns, as Arrow arrays
+        :param prefix: The prefix of the keys in this lookup, which is left out of its keys
+        :param scalar: Does each key have a single row with a single value, which is given as is?
+        :param factory: A function that makes the value from the rows of a key
+        """
+        self._index = index
+        self._columns = list(columns)
+        self._prefix = prefix
+        self._scalar = scalar
+        self._factory = factory
+        self._lo, self._hi = index.find_prefix(prefix) if prefix else (0, len(index))
+
+    def _get_rows(self, start: int, stop: int) -> List[Tuple]:
+        return list(
+            zip(*(column.slice(start, stop - start).to_pylist() for column in self._columns))
+        )
+
+    def __getitem__(self, key: str):  # noqa:D105
+        span = self._index.find(self._prefix + key)
+        if span is None:
+            raise KeyError(key)
+        if self._scalar:
+            return self._columns[0][span[0]].as_py()
+        return self._factory(self._get_rows(*span))
+
+    def __iter__(self) -> Iterator[str]:  # noqa:D105
+        n = len(self._prefix)
+        for i in range(self._lo, self._hi):
+            yield self._index.get_key(i)[n:]
+
+    def __len__(self) -> int:  # noqa:D105
+        return self._hi - self._lo
+
+    def get_labels(self, key: str, prefixes: Optional[Iterable[str]] = None) -> List[Tuple]:
+        """Get the rows of a key, like :meth:`chemical_roles.closure.ClosureIndex.get_labels`.
+
+        :param key: The key
+        :param prefixes: If given, only get the rows whose first value is one of these
+        :returns: The rows, or an empty list if there are none
+        """
+        span = self._index.find(self._prefix + key)
+        if span is None:
+            return []
+        rows = self._get_rows(*span)
+        if prefixes is None:
+            return rows
+        prefixes = set(prefixes)
+        return [row for row in rows if row[0] in prefixes]
+
+
+class Bundle:
+    """The lookups in a bundle directory, searched in memory-mapped Arrow tables."""
+
+    def __init__(self, directory: str):
+        """Open a bundle.
+
+        :param directory: The bundle's directory
+        :raises ValueError: If the bundle was written with a different layout
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME)) as file:
+            self.manifest = json.load(file)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"bundle in {directory} has format version {self.manifest.get('format_version')}"
+                f" instead of {FORMAT_VERSION}. Rebuild it with `chemical_roles bundle build`"
+            )
+        self._cache: Dict[Any, Any] = {}
+
+    @property
+    def versions(self) -> Mapping[str, Optional[str]]:
+        """Get the upstream versions the bundle was built from."""
+        return self.manifest["versions"]
+
+    def _read(self, path: str):
+        import pyarrow as pa
+
+        # The table's buffers keep the memory map alive after the file is closed
+        with pa.memory_map(os.path.join(self.directory, path)) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def get_table(self, name: str):
+        """Get a table, memory-mapped from its Arrow IPC file.
+
+        :param name: The name of the table, e.g., ``names``
+        :rtype: pyarrow.Table
+        """
+        return self._read(self.manifest["tables"][name]["path"])
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def _get_lookup(self, name: str, *columns: str, **kwargs) -> BundledLookup:
+        def _get_index() -> _KeyIndex:
+            return _KeyIndex(self._read(self.manifest["tables"][name]["index_path"]))
+
+        def _get():
+            table = self.get_table(name)
+            return BundledLookup(
+                self._cached(("index", name), _get_index),
+                [_get_array(table, column) for column in columns],
+                **kwargs,
+            )
+
+        return self._cached((name, kwargs.get("prefix")), _get)
+
+    def get_id_name_mapping(self, prefix: str) -> Mapping[str, str]:
+        """Get the names of the entities in a namespace.
+
+        :raises KeyError: If the namespace isn't bundled
+        """
+        if prefix not in self.manifest["name_prefixes"]:
+            raise KeyError(prefix)
+        return self._get_lookup("names", "name", prefix=f"{prefix}:", scalar=True)
+
+    def get_descendants(self, prefix: str, identifier: str) -> Set[str]:
+        """Get the CURIEs of the descendants of an entity.
+
+        :raises KeyError: If the namespace's hierarchy isn't bundled
+        """
+        if prefix not in self.manifest["hierarchy_prefixes"]:
+            raise KeyError(prefix)
+        parent_to_children = self._get_lookup("hierarchy", "child", prefix=f"{prefix}:")
+        rv, stack = set(), [identifier]
+        while stack:
+            for (child,) in parent_to_children.get(stack.pop(), []):
+                if child not in rv:
+                    rv.add(child)
+                    stack.append(child)
+        return {f"{prefix}:{child}" for child in rv}
+
+    def get_role_to_children(self) -> Mapping[str, Set[Tuple[str, str]]]:
+        """Get the chemicals that have each ChEBI role."""
+        return self._get_lookup("role_children", "prefix", "identifier", factory=set)
+
+    def get_expasy_closure(self) -> Mapping[str, List[Tuple[str, str, str]]]:
+        """Get the descendants and members of each EC code."""
+        return self._get_lookup("expasy_closure", "prefix", "identifier", "name")
+
+    def get_ec2go(self) -> Mapping[str, List[Tuple[str, str]]]:
+        """Get the GO molecular functions for each EC code."""
+        return self._get_lookup("ec2go", "go_id", "go_name")
+
+    def get_hgnc_to_uniprot(self) -> Mapping[str, List[Tuple[str, str]]]:
+        """Get the UniProt identifiers and mnemonics for each HGNC gene."""
+        return self._get_lookup("hgnc_uniprot", "uniprot_id", "uniprot_name")
+
+    def get_famplex(self) -> BundledLookup:
+        """Get the labels of the HGNC genes and FamPlex entities below each FamPlex entity.
+
+        It has the same :meth:`BundledLookup.get_labels` lookup as the
+        :class:`chemical_roles.closure.ClosureIndex` built from FamPlex itself.
+        """
+        return self._get_lookup("famplex", "prefix", "identifier", "name")
+
+
+@lru_cache(maxsize=1)
+def get_bundle() -> Optional[Bundle]:
+    """Get the bundle, if one has been built."""
+    directory = get_bundle_directory()
+    if not os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+        return None
+    logger.info("using the upstream bundle in %s", directory)
+    return Bundle(directory)
+
+
+def get_name(prefix: str, identifier: str) -> Optional[str]:
+    """Get the name of an entity, from the bundle if possible."""
+    b = get_bundle()
+    if b is not None and prefix in b.manifest["name_prefixes"]:
+        return b.get_id_name_mapping(prefix).get(identifier)
+    import pyobo
+
+    return pyobo.get_name(prefix, identifier)
+
+
+def get_id_name_mapping(prefix: str) -> Mapping[str, str]:
+    """Get the names of the entities in a namespace, from the bundle if possible."""
+    b = get_bundle()
+    if b is not None and prefix in b.manifest["name_prefixes"]:
+        return b.get_id_name_mapping(prefix)
+    import pyobo
+
+    return pyobo.get_id_name_mapping(prefix)
+
+
+def get_descendants(prefix: str, identifier: str) -> Set[str]:
+    """Get the CURIEs of the descendants of an entity, from the bundle if possible."""
+    b = get_bundle()
+    if b is not None and prefix in b.manifest["hierarchy_prefixes"]:
+        return b.get_descendants(prefix, identifier)
+    import pyobo
+
+    return pyobo.get_descendants(prefix, identifier) or set()
+
+
+def get_role_to_children() -> Mapping[str, Set[Tuple[str, str]]]:
+    """Get the chemicals that have each ChEBI role, from the bundle if possible."""
+    b = get_bundle()
+    if b is not None:
+        return b.get_role_to_children()
+    from pyobo.sources.chebi import get_chebi_role_to_children
+
+    return get_chebi_role_to_children()
+
+
+def get_ec2go() -> Mapping[str, List[Tuple[str, str]]]:
+    """Get the GO molecular functions for each EC code, from the bundle if possible."""
+    b = get_bundle()
+    if b is not None:
+        return b.get_ec2go()
+    from pyobo.sources.expasy import get_ec2go as _get_ec2go
+
+    return _get_ec2go()
+
+
+def _iter_tables() -> Iterable[Tuple[str, List[str], Dict[str, List]]]:
+    """Build each of the tables from the upstream resources.
+
+    :yields: The name of each table, the key of each row, and the value columns
+    """
+    import pyobo
+    from protmapper import uniprot_client
+    from protmapper.api import hgnc_id_to_up
+    from pyobo.sources.chebi import get_chebi_role_to_children
+    from pyobo.sources.expasy import get_ec2go as _get_ec2go
+
+    from .export.utils import build_expasy_closure, build_famplex
+
+    names = []
+    for prefix in NAME_PREFIXES:
+        logger.info("bundling %s names", prefix)
+        for identifier, name in pyobo.get_id_name_mapping(prefix).items():
+            names.append((f"{prefix}:{identifier}", name))
+    yield "names", *_flatten(names, ["name"])
+
+    hierarchy = []
+    for prefix in HIERARCHY_PREFIXES:
+        logger.info("bundling %s hierarchy", prefix)
+        for child, parent in pyobo.get_hierarchy(prefix).edges():
+            child_prefix, child_id = pyobo.normalize_curie(child)
+            parent_prefix, parent_id = pyobo.normalize_curie(parent)
+            if child_prefix == parent_prefix == prefix:
+                hierarchy.append((f"{prefix}:{parent_id}", child_id))
+    yield "hierarchy", *_flatten(hierarchy, ["child"])
+
+    yield "role_children", *_flatten(
+        _iter_pairs(get_chebi_role_to_children()), ["prefix", "identifier"]
+    )
+    _, ec_code_to_children = build_expasy_closure()
+    yield "expasy_closure", *_flatten(
+        _iter_pairs(ec_code_to_children), ["prefix", "identifier", "name"]
+    )
+    yield "ec2go", *_flatten(_iter_pairs(_get_ec2go()), ["go_id", "go_name"])
+    yield "hgnc_uniprot", *_flatten(
+        (
+            (hgnc_id, uniprot_id, uniprot_client.get_mnemonic(uniprot_id))
+            for hgnc_id, uniprot_ids in hgnc_id_to_up.items()
+            for uniprot_id in uniprot_ids.split(", ")
+        ),
+        ["uniprot_id", "uniprot_name"],
+    )
+    yield "famplex", *_flatten(
+        build_famplex(refresh=True).iter_rows(), ["prefix", "identifier", "name"]
+    )
+
+
+def _iter_pairs(mapping: Mapping[str, Iterable[Tuple]]) -> Iterable[Tuple]:
+    for key, values in mapping.items():
+        for value in values:
+            yield (key, *value)
+
+
+def _flatten(rows: Iterable[Tuple], columns: List[str]) -> Tuple[List[str], Dict[str, List]]:
+    """Sort rows of a key and values by the key's UTF-8 bytes, then split them into columns."""
+    rows = sorted(
+        rows, key=lambda row: (row[0].encode("utf-8"), tuple(value or "" for value in row[1:]))
+    )
+    rv: Dict[str, List] = {column: [row[i] for row in rows] for i, column in enumerate(columns, 1)}
+    return [row[0] for row in rows], rv
+
+
+def _get_index(keys: List[str]) -> Dict[str, List]:
+    """Get the unique keys of sorted rows and the range of rows of each."""
+    rv: Dict[str, List] = {"key": [], "start": [], "stop": []}
+    start = 0
+    for key, group in itt.groupby(keys):
+        stop = start + sum(1 for _ in group)
+        rv["key"].append(key.encode("utf-8"))
+        rv["start"].append(start)
+        rv["stop"].append(stop)
+        start = stop
+    return rv
+
+
+def _write_table(table, path: str) -> None:
+    import pyarrow as pa
+
+    # Uncompressed and in one record batch, so the columns can be memory-mapped without copying
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(1, table.num_rows))
+
+
+def build_bundle(directory: Optional[str] = None) -> Mapping[str, Any]:
+    """Build the bundle from the upstream resources.
+
+    The bundle is written to a temporary directory first, then moved into place,
+    so a bundle that's being read is never half-written.
+
+    :param directory: The bundle's directory. Defaults to :func:`get_bundle_directory`.
+    :returns: The manifest
+    """
+    import pyarrow as pa
+
+    from .export.utils import get_upstream_versions
+    from .utils import hash_file
+
+    if directory is None:
+        directory = get_bundle_directory()
+    directory = os.path.abspath(directory)
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+
+    manifest: Dict[str, Any] = {
+        "format_version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        # The versions of a bundle that's already in use would be the old ones
+        "versions": dict(get_upstream_versions(VERSION_PREFIXES, use_bundle=False)),
+        "name_prefixes": NAME_PREFIXES,
+        "hierarchy_prefixes": HIERARCHY_PREFIXES,
+        "tables": {},
+    }
+    tmp = tempfile.mkdtemp(prefix=".bundle-", dir=parent)
+    try:
+        for name, keys, columns in _iter_tables():
+            table = pa.table(
+                {column: pa.array(values, pa.string()) for column, values in columns.items()}
+            )
+            path = os.path.join(tmp, f"{name}.arrow")
+            _write_table(table, path)
+
+            index = _get_index(keys)
+            # Fixed-width keys can be searched in place, and NumPy ignores their padding
+            width = max(1, max(map(len, index["key"]), default=0))
+            index_table = pa.table(
+                {
+                    "key": pa.array(
+                        [key.ljust(width, b"\0") for key in index["key"]], pa.binary(width)
+                    ),
+                    "start": pa.array(index["start"], pa.int64()),
+                    "stop": pa.array(index["stop"], pa.int64()),
+                }
+            )
+            index_path = os.path.join(tmp, f"{name}.index.arrow")
+            _write_table(index_table, index_path)
+            manifest["tables"][name] = {
+                "path": f"{name}.arrow",
+                "index_path": f"{name}.index.arrow",
+                "rows": table.num_rows,
+                "keys": index_table.num_rows,
+                "sha256": hash_file(path),
+                "index_sha256": hash_file(index_path),
+            }
+            logger.info("bundled %d rows in %s", table.num_rows, name)
+        with open(os.path.join(tmp, MANIFEST_NAME), "w") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+
+        if os.path.exists(directory):
+            old = tempfile.mkdtemp(prefix=".bundle-old-", dir=parent)
+            os.replace(directory, os.path.join(old, "bundle"))
+            os.replace(tmp, directory)
+            shutil.rmtree(old)
+        else:
+            os.replace(tmp, directory)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    get_bundle.cache_clear()
+    return manifest
+
+
+@click.group()
+def bundle():
+    """Manage the bundle of upstream lookups."""
+
+
+@bundle.command()
+@click.option("--directory", help="Defaults to $CHEMICAL_ROLES_BUNDLE or the PyStow directory")
+@verbose_option
+def build(directory: Optional[str]):
+    """Build the bundle from the upstream resources."""
+    manifest = build_bundle(directory)
+    for name, table in manifest["tables"].items():
+        click.echo(f"{name}: {table['rows']:,} rows, {table['keys']:,} keys")
+    for prefix, version in manifest["versions"].items():
+        click.echo(f"{prefix} version: {version or 'unknown'}")
+
+
+@bundle.command()
+@click.option("--directory", help="Defaults to $CHEMICAL_ROLES_BUNDLE or the PyStow directory")
+def info(directory: Optional[str]):
+    """Show the upstream versions and tables in the bundle."""
+    directory = directory or get_bundle_directory()
+    if not os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+        click.secho(f"no bundle in {directory}", fg="red")
+        raise SystemExit(1)
+    b = Bundle(directory)
+    click.echo(f"Bundle in {directory}, built {b.manifest['created']}")
+    for prefix, version in b.versions.items():
+        click.echo(f"{prefix} version: {version or 'unknown'}")
+    for name, table in b.manifest["tables"].items():
+        click.echo(f"{name}: {table['rows']:,} rows, {table['keys']:,} keys")
+
+
+if __name__ == "__main__":
+    bundle()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""Prefetch the upstream resources used by the export and the curation.
+
+The resources are downloaded and parsed by PyOBO, protmapper, and PyStow the
+first time they're used, which otherwise happens one after another inside
+:func:`chemical_roles.export.utils.get_relations_df` and the curation commands.
+``chemical_roles cache warm`` loads all of them at once in worker processes
+instead, so later runs only read the caches.
+
+All of the caches live under the PyStow directory, which defaults to ``~/.data``
+and can be set with the ``PYSTOW_HOME`` environment variable or the ``--mirror``
+option. A mirror that was warmed on a machine with internet access can be copied
+to an air-gapped machine and used with ``--mirror`` there.
+
+FamPlex's relations are read from its default branch rather than a release, so
+warming always downloads them again. If that fails, e.g., on an air-gapped
+machine, the copy in the cache is kept and used.
+"""
+
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import click
+from more_click import verbose_option
+
+__all__ = [
+    "Resource",
+    "RESOURCES",
+    "get_resources",
+    "warm_resources",
+    "cache",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _load_chebi() -> int:
+    import pyobo
+    from pyobo.sources.chebi import get_chebi_role_to_children
+
+    # The names and the hierarchy are cached separately
+    pyobo.get_descendants("chebi", "50906")
+    get_chebi_role_to_children()
+    return len(pyobo.get_id_name_mapping("chebi"))
+
+
+def _load_mesh() -> int:
+    import pyobo
+
+    return len(pyobo.get_id_name_mapping("mesh"))
+
+
+def _load_expasy() -> int:
+    import pyobo
+
+    from .export.utils import build_expasy_closure
+
+    pyobo.get_id_name_mapping("eccode")
+    _, ec_code_to_children = build_expasy_closure()
+    return len(ec_code_to_children)
+
+
+def _load_ec2go() -> int:
+    from pyobo.sources.expasy import get_ec2go
+
+    return len(get_ec2go())
+
+
+def _load_protmapper() -> int:
+    # The HGNC and UniProt tables are downloaded when protmapper is imported
+    from protmapper.api import hgnc_id_to_up
+
+    return len(hgnc_id_to_up)
+
+
+def _load_famplex() -> int:
+    from .export.utils import build_famplex
+
+    # FamPlex is read from its default branch, so it's always downloaded again
+    return len(build_famplex(refresh=True))
+
+
+class Resource(NamedTuple):
+    """An upstream resource that can be prefetched."""
+
+    #: The name of the resource
+    name: str
+    #: A function that downloads and parses the resource, returning its number of entries
+    func: Callable[[], int]
+    #: The prefix whose version is reported, if any
+    prefix: Optional[str]
+    #: The commands that use this resource
+    used_by: Tuple[str, ...]
+    #: The names of resources that must be loaded first, e.g., because they share files
+    requires: Tuple[str, ...] = ()
+
+
+#: The upstream resources, in the order they're reported
+RESOURCES: Sequence[Resource] = [
+    Resource("chebi", _load_chebi, "chebi", ("export", "curate")),
+    Resource("mesh", _load_mesh, "mesh", ("curate",)),
+    Resource("expasy", _load_expasy, "expasy", ("export", "curate")),
+    Resource("ec2go", _load_ec2go, "go", ("export", "curate")),
+    Resource("protmapper", _load_protmapper, "hgnc", ("export",)),
+    # FamPlex maps symbols with protmapper's tables, which shouldn't be downloaded twice at once
+    Resource("famplex", _load_famplex, None, ("export",), requires=("protmapper",)),
+]
+
+
+def get_resources(
+    names: Optional[Collection[str]] = None, used_by: Optional[str] = None
+) -> List[Resource]:
+    """Get the resources to prefetch.
+
+    :param names: If given, only get these resources and the ones they require
+    :param used_by: If given, only get the resources used by this command, like ``export``
+    :returns: The resources, in the order of :data:`RESOURCES`
+    """
+    if names is None:
+        names = {
+            resource.name
+            for resource in RESOURCES
+            if used_by is None or used_by in resource.used_by
+        }
+    names = set(names)
+    for resource in reversed(RESOURCES):
+        if resource.name in names:
+            names.update(resource.requires)
+    return [resource for resource in RESOURCES if resource.name in names]
+
+
+def _get_version(prefix: Optional[str]) -> Optional[str]:
+    if prefix is None:
+        return None
+    try:
+        import bioversions
+
+        return bioversions.get_version(prefix)
+    except Exception:  # noqa:B902
+        logger.warning("could not look up version for %s", prefix)
+        return None
+
+
+def _warm(resource: Resource) -> Dict:
+    """Load a resource in a worker process."""
+    start = time.perf_counter()
+    try:
+        size = resource.func()
+        # Some loaders log failed downloads and return nothing instead of raising
+        error = None if size else "no entries were loaded"
+    except Exception as e:  # noqa:B902
+        logger.exception("could not load %s", resource.name)
+        size, error = None, f"{type(e).__name__}: {e}"
+    return {
+        "name": resource.name,
+        "version": _get_version(resource.prefix),
+        "size": size,
+        "time": time.perf_counter() - start,
+        "error": error,
+    }
+
+
+def warm_resources(resources: Sequence[Resource], max_workers: Optional[int] = None) -> List[Dict]:
+    """Download and parse resources in parallel worker processes.
+
+    A resource is only started once the resources it requires finished loading.
+
+    :param resources: The resources to load, e.g., from :func:`get_resources`
+    :param max_workers: The number of worker processes. Defaults to one for each resource.
+    :returns: The name, version, number of entries, time in seconds, and error (if any)
+        of each resource, in the same order as the resources
+    """
+    pending = list(resources)
+    names = {resource.name for resource in resources}
+    done: Dict[str, Dict] = {}
+    with ProcessPoolExecutor(max_workers=max_workers or max(1, len(pending))) as executor:
+        running = {}
+        while pending or running:
+            for resource in list(pending):
+                if all(name in done for name in resource.requires if name in names):
+                    pending.remove(resource)
+                    logger.info("loading %s", resource.name)
+                    running[executor.submit(_warm, resource)] = resource.name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                done[running.pop(future)] = result
+                logger.info("loaded %s in %.2fs", result["name"], result["time"])
+    return [done[resource.name] for resource in resources]
+
+
+@click.group()
+def cache():
+    """Manage the cache of upstream resources."""
+
+
+@cache.command()
+@click.option(
+    "--resource",
+    "names",
+    type=click.Choice([resource.name for resource in RESOURCES]),
+    multiple=True,
+    help="Only load these resources. Defaults to all of them.",
+)
+@click.option(
+    "--for",
+    "used_by",
+    type=click.Choice(["export", "curate"]),
+    help="Only load the resources used by these commands",
+)
+@click.option(
+    "--mirror",
+    type=click.Path(file_okay=False),
+    help="A directory to use as the cache instead of the PyStow directory, e.g., a copy "
+    "of one that was warmed elsewhere",
+)
+@click.option("--workers", type=int, help="The number of worker processes")
+@verbose_option
+def warm(names, used_by: Optional[str], mirror: Optional[str], workers: Optional[int]):
+    """Download and parse the upstream resources in parallel."""
+    if mirror is not None:
+        # Set before the workers start, so PyOBO, protmapper, and PyStow all use it
+        os.environ["PYSTOW_HOME"] = os.path.abspath(mirror)
+    resources = get_resources(names or None, used_by=used_by)
+    results = warm_resources(resources, max_workers=workers)
+
+    width = max(len(result["name"]) for result in results)
+    for result in results:
+        if result["error"] is None:
+            click.echo(
+                f"{result['name']:<{width}}  {result['time']:8.2f}s  "
+                f"{result['size']:>9,} entries  version {result['version'] or 'unknown'}"
+            )
+        else:
+            click.secho(
+                f"{result['name']:<{width}}  {result['time']:8.2f}s  {result['error']}", fg="red"
+            )
+    if any(result["error"] is not None for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cache()
@@ -4,19 +4,35 @@
 
 import click
 
-from .curate.cli import curate
-from .export.cli import export
-from .lint import lint
-
-
-@click.group()
+from .lazy import LazyGroup
+
+
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "analyze": (
+            "chemical_roles.analysis:analyze",
+            "Analyze the relations as sparse chemical by target matrices.",
+        ),
+        "benchmark": (
+            "chemical_roles.benchmark:benchmark",
+            "Benchmark the export on synthetic data, offline.",
+        ),
+        "bundle": ("chemical_roles.bundle:bundle", "Manage the bundle of upstream lookups."),
+        "cache": ("chemical_roles.cache:cache", "Manage the cache of upstream resources."),
+        "curate": ("chemical_roles.curate.cli:curate", "Run the curation CLI."),
+        "export": ("chemical_roles.export.cli:export", "Export the database."),
+        "import": (
+            "chemical_roles.imports.cli:import_",
+            "Import mappings and relations from other resources.",
+        ),
+        "lint": ("chemical_roles.lint:lint", "Run linters."),
+        "serve": ("chemical_roles.serve:serve", "Serve lookups over the relations as JSON."),
+    },
+)
 def main():
     """Run the Chemical-Roles CLI."""
 
 
-main.add_command(curate)
-main.add_command(export)
-main.add_command(lint)
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""Precomputed transitive closures of hierarchies, stored as CSR indexes.
+
+A :class:`ClosureIndex` maps each entity in a hierarchy to all of its
+descendants. It's stored like a compressed sparse row (CSR) matrix: the
+descendants of every entity are concatenated in one integer array of positions
+in a table of labels, and an array of offsets gives where each entity's run
+starts and ends. Looking up an entity's descendants is one dictionary lookup
+and one slice, no matter how deeply they're nested::
+
+    from chemical_roles.closure import ClosureIndex
+
+    index = ClosureIndex.from_edges(
+        [
+            (("hgnc", "6407", "KRAS"), ("fplx", "RAS", "RAS")),
+            (("fplx", "RAS", "RAS"), ("fplx", "Ras_family", "Ras_family")),
+        ]
+    )
+    index["Ras_family"]  # [("hgnc", "6407", "KRAS"), ("fplx", "RAS", "RAS")]
+
+Each label is a tuple of a prefix, an identifier, and a name, and entities are
+keyed by their identifiers.
+"""
+
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+__all__ = [
+    "Label",
+    "ClosureIndex",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The prefix, identifier, and name of an entity
+Label = Tuple[str, str, str]
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class ClosureIndex(Mapping[str, List[Label]]):
+    """A mapping from each entity's identifier to the labels of all of its descendants."""
+
+    def __init__(
+        self,
+        keys: Sequence[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        labels: Sequence[Label],
+    ):
+        """Initialize the index.
+
+        :param keys: The identifiers of the entities that have descendants
+        :param indptr: The offsets of each key's descendants in ``indices``, with one
+            more element than there are keys
+        :param indices: The positions of the descendants in ``labels``, sorted within each key
+        :param labels: The labels of the descendants
+        """
+        if len(indptr) != len(keys) + 1:
+            raise ValueError("indptr should have one more element than there are keys")
+        self.keys_ = list(keys)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.labels = list(labels)
+        self._positions: Dict[str, int] = {key: i for i, key in enumerate(self.keys_)}
+
+    def get_indices(self, key: str) -> np.ndarray:
+        """Get the positions of an entity's descendants in :attr:`labels`."""
+        i = self._positions.get(key)
+        if i is None:
+            return _EMPTY
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def get_labels(self, key: str, prefixes: Optional[Iterable[str]] = None) -> List[Label]:
+        """Get the labels of an entity's descendants.
+
+        :param key: The identifier of the entity
+        :param prefixes: If given, only get the descendants in these namespaces, e.g.,
+            only the leaf HGNC genes and not the intermediate FamPlex families
+        :returns: The labels of the descendants, or an empty list if there are none
+        """
+        labels = [self.labels[i] for i in self.get_indices(key)]
+        if prefixes is None:
+            return labels
+        prefixes = set(prefixes)
+        return [label for label in labels if label[0] in prefixes]
+
+    def __getitem__(self, key: str) -> List[Label]:  # noqa:D105
+        if key not in self._positions:
+            raise KeyError(key)
+        return self.get_labels(key)
+
+    def __contains__(self, key) -> bool:  # noqa:D105
+        return key in self._positions
+
+    def __iter__(self) -> Iterator[str]:  # noqa:D105
+        return iter(self.keys_)
+
+    def __len__(self) -> int:  # noqa:D105
+        return len(self.keys_)
+
+    @property
+    def nnz(self) -> int:
+        """Get the number of pairs of an entity and a descendant."""
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Tuple[Label, Label]]) -> "ClosureIndex":
+        """Compute the transitive closure of a hierarchy.
+
+        The descendants of each entity are computed once, after the descendants of
+        all of its children, as the sorted union of their arrays.
+
+        :param edges: Pairs of a child's label and its parent's label
+        :returns: An index from each entity with children to all of its descendants
+        :raises ValueError: If the hierarchy has a cycle
+        """
+        positions: Dict[Label, int] = {}
+        labels: List[Label] = []
+
+        def _get_position(label: Label) -> int:
+            i = positions.get(label)
+            if i is None:
+                i = positions[label] = len(labels)
+                labels.append(label)
+            return i
+
+        children: Dict[int, set] = defaultdict(set)
+        for child, parent in edges:
+            children[_get_position(parent)].add(_get_position(child))
+
+        # Visit the children before their parents, like in a reversed topological sort
+        n_parents = np.zeros(len(labels), dtype=np.int64)
+        for child_positions in children.values():
+            for child in child_positions:
+                n_parents[child] += 1
+        stack = [i for i in range(len(labels)) if n_parents[i] == 0]
+        order = []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for child in children.get(node, ()):
+                n_parents[child] -= 1
+                if n_parents[child] == 0:
+                    stack.append(child)
+        if len(order) != len(labels):
+            raise ValueError(f"hierarchy has a cycle through {len(labels) - len(order)} entities")
+
+        descendants: Dict[int, np.ndarray] = {}
+        for node in reversed(order):
+            child_positions = children.get(node)
+            if not child_positions:
+                continue
+            arrays = [np.fromiter(child_positions, dtype=np.int32, count=len(child_positions))]
+            arrays.extend(descendants[child] for child in child_positions if child in descendants)
+            descendants[node] = np.unique(np.concatenate(arrays))
+
+        return cls._from_descendants(
+            {labels[node][1]: array for node, array in descendants.items()}, labels
+        )
+
+    @classmethod
+    def _from_descendants(
+        cls, descendants: Mapping[str, np.ndarray], labels: Sequence[Label]
+    ) -> "ClosureIndex":
+        keys = sorted(descendants)
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(descendants[key]) for key in keys])
+        indices = np.concatenate([descendants[key] for key in keys]) if keys else _EMPTY
+        return cls(keys, indptr, indices, labels)
+
+    @classmethod
+    def from_rows(
+        cls,
+        keys: Sequence[str],
+        prefixes: Sequence[str],
+        identifiers: Sequence[str],
+        names: Sequence[str],
+    ) -> "ClosureIndex":
+        """Load an index from the columns of its rows, e.g., from :meth:`iter_rows`.
+
+        :param keys: The identifier of the entity in each row, with each entity's rows
+            next to each other
+        :param prefixes: The prefix of the descendant in each row
+        :param identifiers: The identifier of the descendant in each row
+        :param names: The name of the descendant in each row
+        :returns: The index
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(
+            {"key": keys, "prefix": prefixes, "identifier": identifiers, "name": names}
+        )
+        label_codes, unique_labels = pd.factorize(
+            pd.MultiIndex.from_frame(df[["prefix", "identifier", "name"]])
+        )
+        key_codes, unique_keys = pd.factorize(df["key"])
+        if len(key_codes) and (np.diff(key_codes) < 0).any():
+            raise ValueError("the rows of each key should be next to each other")
+        indptr = np.zeros(len(unique_keys) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(key_codes, minlength=len(unique_keys)))
+        return cls(list(unique_keys), indptr, label_codes.astype(np.int32), list(unique_labels))
+
+    def iter_rows(self) -> Iterator[Tuple[str, str, str, str]]:
+        """Iterate over the identifier of each entity and the label of each of its descendants."""
+        for i, key in enumerate(self.keys_):
+            for j in self.indices[self.indptr[i] : self.indptr[i + 1]]:
+                yield (key, *self.labels[j])
+
+    def save(self, path: str) -> None:
+        """Save the index as a NumPy archive of integer, string, and boolean arrays.
+
+        Missing values in the labels, like entities without names, are saved as
+        empty strings with a mask, so they're loaded as None again.
+        The archive is written to a temporary file first, then moved into place.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(prefix=".", suffix=".npz", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez(
+                    file,
+                    keys=np.array(self.keys_, dtype=str),
+                    indptr=self.indptr,
+                    indices=self.indices,
+                    labels=np.array(
+                        [[value or "" for value in label] for label in self.labels], dtype=str
+                    ).reshape(-1, 3),
+                    missing=np.array(
+                        [[value is None for value in label] for label in self.labels], dtype=bool
+                    ).reshape(-1, 3),
+                )
+        except BaseException:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ClosureIndex":
+        """Load an index saved with :meth:`save`."""
+        with np.load(path, allow_pickle=False) as data:
+            labels = data["labels"].tolist()
+            if "missing" in data:
+                missing = data["missing"].tolist()
+            else:
+                # Archives without a mask saved missing names as empty strings
+                missing = [[False, False, not name] for _, _, name in labels]
+            return cls(
+                data["keys"].tolist(),
+                data["indptr"],
+                data["indices"],
+                [
+                    tuple(None if is_missing else value for value, is_missing in zip(*pair))
+                    for pair in zip(labels, missing)
+                ],
+            )
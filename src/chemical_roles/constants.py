@@ -10,6 +10,14 @@ DOCS = os.path.join(ROOT, "docs")
 DATA = os.path.join(DOCS, "_data")
 IMG = os.path.join(DOCS, "img")
 
-RELATIONS_OUTPUT_PATH = os.path.join(DATA, "relations.tsv")
-RELATIONS_SLIM_OUTPUT_PATH = os.path.join(DATA, "relations_slim.tsv")
+RELATIONS_OUTPUT_NAME = "relations.tsv"
+RELATIONS_OUTPUT_PATH = os.path.join(DATA, RELATIONS_OUTPUT_NAME)
+RELATIONS_SLIM_OUTPUT_NAME = "relations_slim.tsv"
+RELATIONS_SLIM_OUTPUT_PATH = os.path.join(DATA, RELATIONS_SLIM_OUTPUT_NAME)
 EXPORT_BEL_PATH = os.path.join(DATA, "export.bel.nodelink.json.gz")
+EXPORT_MANIFEST_PATH = os.path.join(DATA, "manifest.json")
+PLOT_CACHE_PATH = os.path.join(IMG, "plots.json")
+
+#: The default maximum number of GO terms that one relation is propagated to. Relations
+#: to terms with more descendants or ancestors than this aren't propagated at all.
+MAX_GO_FANOUT = 100
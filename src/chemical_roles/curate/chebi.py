@@ -12,9 +12,9 @@ import click
 import pandas as pd
 import pyobo
 from more_click import verbose_option
-from pyobo.sources.expasy import get_ec2go
 from tqdm import tqdm
 
+from ..bundle import get_descendants, get_ec2go, get_id_name_mapping, get_name
 from ..resources import (
     RECLASSIFICATION_PATH,
     UNCURATED_CHEBI_PATH,
@@ -66,7 +66,7 @@ def _get_ids(curies: Iterable[str]) -> Iterable[str]:
 def _get_irrelevant_role_chebi_ids() -> Set[str]:
     rv = set(
         itt.chain.from_iterable(
-            _get_ids(pyobo.get_descendants("chebi", chebi_id))
+            _get_ids(get_descendants("chebi", chebi_id))
             for chebi_id in get_irrelevant_roles_df().identifier
         )
     )
@@ -90,7 +90,7 @@ def propose_enzyme_modulators() -> pd.DataFrame:
     ec2go = get_ec2go()
     rv = []
 
-    for identifier, name in pyobo.get_id_name_mapping("chebi").items():
+    for identifier, name in get_id_name_mapping("chebi").items():
         # Do this as a loop since there is at least one entry that corresponds to several EC codes
         ec_codes = []
 
@@ -146,7 +146,7 @@ def propose_enzyme_modulators() -> pd.DataFrame:
                     "protein family",
                     "ec-code",
                     ec_code,
-                    pyobo.get_name("eccode", ec_code) or ec_code,
+                    get_name("eccode", ec_code) or ec_code,
                 )
             )
 
@@ -173,9 +173,9 @@ def suggest_pathway_inhibitor_curation() -> None:
     reclassify_chebi_ids = set(reclassify_df.chebi_id)
 
     print(
-        f'Children of {PATHWAY_INHIBITOR_CHEBI_ID} ({pyobo.get_name("chebi", PATHWAY_INHIBITOR_CHEBI_ID)})'
+        f'Children of {PATHWAY_INHIBITOR_CHEBI_ID} ({get_name("chebi", PATHWAY_INHIBITOR_CHEBI_ID)})'
     )
-    for chebi_id in _get_ids(pyobo.get_descendants("chebi", PATHWAY_INHIBITOR_CHEBI_ID)):
+    for chebi_id in _get_ids(get_descendants("chebi", PATHWAY_INHIBITOR_CHEBI_ID)):
         if any(
             chebi_id in group
             for group in (
@@ -185,7 +185,7 @@ def suggest_pathway_inhibitor_curation() -> None:
             )
         ):
             continue  # we already curated this!
-        name = pyobo.get_name("chebi", chebi_id)
+        name = get_name("chebi", chebi_id)
         if name is None:
             logger.warning("could not find chebi:%s", chebi_id)
             raise KeyError(f"chebi:{chebi_id}")
@@ -199,9 +199,9 @@ def suggest_pathway_inhibitor_curation() -> None:
 def suggest_inhibitor_curation() -> None:
     """Suggest inhibitors for curation."""
     chebi_curies = (
-        pyobo.get_descendants("chebi", INHIBITOR_CHEBI_ID)
-        - pyobo.get_descendants("chebi", PATHWAY_INHIBITOR_CHEBI_ID)
-        - pyobo.get_descendants("chebi", ENZYME_INHIBITOR_CHEBI_ID)
+        get_descendants("chebi", INHIBITOR_CHEBI_ID)
+        - get_descendants("chebi", PATHWAY_INHIBITOR_CHEBI_ID)
+        - get_descendants("chebi", ENZYME_INHIBITOR_CHEBI_ID)
     )
     chebi_ids = _get_ids(chebi_curies)
     for t in _suggest_xrefs_curation(chebi_ids=chebi_ids, suffix="inhibitor"):
@@ -233,7 +233,7 @@ def suggest_all_roles(show_ungrounded: bool = False, file: Optional[TextIO] = No
     logger.info(
         "Getting descendants of chebi:%s and chebi:%s", BIOLOGICAL_ROLE_ID, APPLICATION_ROLE_ID
     )
-    chebi_curies = pyobo.get_descendants("chebi", BIOLOGICAL_ROLE_ID) | pyobo.get_descendants(
+    chebi_curies = get_descendants("chebi", BIOLOGICAL_ROLE_ID) | get_descendants(
         "chebi", APPLICATION_ROLE_ID
     )
     chebi_ids = _get_ids(chebi_curies)
@@ -243,12 +243,12 @@ def suggest_all_roles(show_ungrounded: bool = False, file: Optional[TextIO] = No
 
 
 def _single_suggest(chebi_id: str, suffix, file=None, show_missing: bool = False) -> None:
-    descendant_curies = pyobo.get_descendants("chebi", chebi_id)
+    descendant_curies = get_descendants("chebi", chebi_id)
     logger.info(
         "Suggesting for %d descendants of chebi:%s ! %s",
         len(descendant_curies),
         chebi_id,
-        pyobo.get_name("chebi", chebi_id),
+        get_name("chebi", chebi_id),
     )
     descendant_ids = _get_ids(descendant_curies)
     for t in _suggest_xrefs_curation(
@@ -270,7 +270,7 @@ def _suggest_xrefs_curation(
     chebi_ids = (
         chebi_id
         for chebi_id in chebi_ids
-        if pyobo.get_name("chebi", chebi_id).casefold().endswith(suffix.casefold())
+        if get_name("chebi", chebi_id).casefold().endswith(suffix.casefold())
     )
     yield from _iter_gilda(chebi_ids, suffix=suffix, show_missing=show_missing)
 
@@ -284,7 +284,7 @@ def _iter_gilda(
     for chebi_id in tqdm(list(chebi_ids), desc="making ChEBI curation sheet"):
         if chebi_id in get_curated_role_chebi_ids() or chebi_id in _get_irrelevant_role_chebi_ids():
             continue  # already curated, skip
-        name = pyobo.get_name("chebi", chebi_id)
+        name = get_name("chebi", chebi_id)
         if name is None:
             logger.warning("could not look up chebi:%s (%s)", chebi_id)
             continue
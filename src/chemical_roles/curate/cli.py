@@ -4,17 +4,19 @@
 
 import click
 
-from .chebi import curate_chebi
-from .mesh import curate_mesh
+from ..lazy import LazyGroup
 
 
-@click.group()
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "chebi": ("chemical_roles.curate.chebi:curate_chebi", "Run the ChEBI curation pipeline."),
+        "mesh": ("chemical_roles.curate.mesh:curate_mesh", "Run the MeSH curation pipeline."),
+    },
+)
 def curate():
     """Run the curation CLI."""
 
 
-curate.add_command(curate_chebi)
-curate.add_command(curate_mesh)
-
 if __name__ == "__main__":
     curate()
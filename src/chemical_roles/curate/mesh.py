@@ -5,10 +5,10 @@
 from typing import Optional, TextIO
 
 import click
-import pyobo
 from more_click import verbose_option
 from tqdm import tqdm
 
+from ..bundle import get_id_name_mapping
 from ..resources import UNCURATED_MESH_PATH, get_xrefs_df
 from ..utils import SUFFIXES, yield_gilda
 
@@ -44,7 +44,7 @@ def curate_mesh(show_ungrounded: bool, output: Optional[TextIO]):
 
     terms = {
         identifier: (name, name[: -len(suffix)], suffix.strip("s"))
-        for identifier, name in pyobo.get_id_name_mapping("mesh").items()
+        for identifier, name in get_id_name_mapping("mesh").items()
         if identifier not in curated_mesh_ids and identifier not in MESH_BLACKLIST
         for suffix in SUFFIXES
         if name.lower().endswith(suffix)
@@ -2,14 +2,35 @@
 
 """Export to BEL."""
 
-import pybel
-from pybel import BELGraph, dsl
+import gzip
+import json
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pybel import BELGraph, dsl, to_nodelink
+from pybel.constants import (
+    CITATION,
+    DIRECTLY_DECREASES,
+    DIRECTLY_INCREASES,
+    DIRECTLY_REGULATES,
+    EVIDENCE,
+    RELATION,
+    TARGET_MODIFIER,
+)
+from pybel.language import citation_dict
+from pybel.utils import hash_edge
 from tqdm import tqdm
 
 from .utils import get_relations_df
 
 __all__ = [
+    "BELSpec",
     "get_bel",
+    "get_bel_graphs",
+    "write_bel_nodelink_gz",
+    "write_indra_statements_json",
+    "write_bel_and_indra",
 ]
 
 _type_map = {
@@ -21,50 +42,365 @@ _type_map = {
     "protein family": dsl.Protein,
     "protein complex": dsl.NamedComplexAbundance,
 }
-_adders = {
-    "activator": BELGraph.add_directly_activates,
-    "agonist": BELGraph.add_directly_activates,
-    "antagonist": BELGraph.add_directly_inhibits,
-    "inhibitor": BELGraph.add_directly_inhibits,
-    "inverse agonist": BELGraph.add_directly_activates,
-    "modulator": BELGraph.add_directly_regulates,
+#: Relations and whether the target's activity is modified, matching the
+#: ``add_directly_activates``, ``add_directly_inhibits``, and ``add_directly_regulates``
+#: methods of :class:`pybel.BELGraph`
+_relations: Mapping[str, Tuple[str, bool]] = {
+    "activator": (DIRECTLY_INCREASES, True),
+    "agonist": (DIRECTLY_INCREASES, True),
+    "antagonist": (DIRECTLY_DECREASES, True),
+    "inhibitor": (DIRECTLY_DECREASES, True),
+    "inverse agonist": (DIRECTLY_INCREASES, True),
+    "modulator": (DIRECTLY_REGULATES, False),
 }
 
+_function_names = {target_type: cls.__name__ for target_type, cls in _type_map.items()}
+_function_classes = {cls.__name__: cls for cls in _type_map.values()}
+
+CITATION_NAMESPACE = "doi"
+CITATION_IDENTIFIER = "10.26434/chemrxiv.12591221"
+EVIDENCE_TEXT = "Manually curated."
+
+_COLUMNS = [
+    "source_db",
+    "source_id",
+    "source_name",
+    "modulation",
+    "target_type",
+    "target_db",
+    "target_id",
+    "target_name",
+]
+
+
+class BELSpec(NamedTuple):
+    """A specification for which relations go in a BEL graph."""
+
+    #: Should inferred relations be included, or only the curated ones?
+    use_inferred: bool = True
+    #: Should edges have an evidence string?
+    add_evidence: bool = True
+
+
+#: The relations in the INDRA export, which are the curated ones without evidence
+_INDRA_SPEC = BELSpec(use_inferred=False, add_evidence=False)
+
 
 def get_bel(use_inferred: bool = True, add_evidence: bool = True) -> BELGraph:
     """Get Chemical Roles as BEL."""
-    df = get_relations_df(use_inferred=use_inferred)
-    graph = BELGraph(name="Chemical Roles Graph")
-    it = tqdm(df.dropna().values, total=len(df.index), desc="mapping to BEL", unit_scale=True)
-    evidence = "Manually curated." if add_evidence else None
-    for (
-        source_db,
-        source_id,
-        source_name,
-        modulation,
-        target_type,
-        target_db,
-        target_id,
-        target_name,
-    ) in it:
-        if target_type == "molecular function":
-            continue
-        source = pybel.dsl.Abundance(
-            namespace=source_db,
-            identifier=source_id,
-            name=source_name,
-        )
-        target = _type_map[target_type](
-            namespace=target_db,
-            identifier=target_id,
-            name=target_name,
-        )
-        adder = _adders[modulation]
-        adder(
+    return get_bel_graphs([BELSpec(use_inferred=use_inferred, add_evidence=add_evidence)])[0]
+
+
+def get_bel_graphs(specs: Sequence[BELSpec]) -> List[BELGraph]:
+    """Get several BEL graphs over the Chemical Roles from one construction pass.
+
+    Nodes are built once for the union of the relations, then each graph gets
+    the edges for its subset, chosen by a filter on the relations table.
+
+    :param specs: Specifications for each of the graphs to build
+    :returns: A BEL graph for each specification
+    """
+    df = _get_bel_df(use_inferred=any(spec.use_inferred for spec in specs))
+
+    source_codes, source_nodes = _build_nodes(df, "source", node_type="chemical")
+    target_codes, target_nodes = _build_nodes(df, "target")
+    modulations = df["modulation"].values
+
+    rv = []
+    for spec in specs:
+        idx = _get_subset(df, spec)
+        evidence = EVIDENCE_TEXT if spec.add_evidence else None
+        graph = BELGraph(name="Chemical Roles Graph")
+        _add_edges(
             graph,
-            source,
-            target,
-            citation=("doi", "10.26434/chemrxiv.12591221"),
+            sources=source_nodes,
+            targets=target_nodes,
+            edges=zip(source_codes[idx], target_codes[idx], modulations[idx]),
             evidence=evidence,
         )
-    return graph
+        rv.append(graph)
+    return rv
+
+
+def _get_bel_df(use_inferred: bool) -> pd.DataFrame:
+    """Get the relations to convert, with a column for the order of the curated relations."""
+    xrefs_df = get_relations_df(use_inferred=False).rename(columns={"type": "target_type"})
+    xrefs_df = xrefs_df[_COLUMNS].dropna()
+    # Remember the order in which curated rows first appear so curated graphs are built in that order
+    xrefs_df["curated_position"] = range(len(xrefs_df.index))
+    xrefs_df = xrefs_df.drop_duplicates(_COLUMNS)
+    if not use_inferred:
+        df = xrefs_df
+    else:
+        df = get_relations_df()[_COLUMNS].dropna()
+        # The inferred table contains the curated rows, so mark them with a join
+        df = df.merge(xrefs_df, how="left", on=_COLUMNS, sort=False)
+    return df[df["target_type"] != "molecular function"].reset_index(drop=True)
+
+
+def _get_subset(df: pd.DataFrame, spec: BELSpec):
+    if spec.use_inferred:
+        return slice(None)
+    curated = df[df["curated_position"].notna()]
+    return curated.sort_values("curated_position", kind="mergesort").index.values
+
+
+def _build_nodes(df: pd.DataFrame, side: str, node_type: Optional[str] = None):
+    """Build each node once for each unique combination of type, namespace, identifier, and name.
+
+    :param df: The relations dataframe
+    :param side: Either ``source`` or ``target``
+    :param node_type: The type of all nodes on this side. If not given, is taken
+        from the ``<side>_type`` column.
+    :returns: A pair of an array with the position of each row's node and the list of nodes
+    """
+    columns = [f"{side}_db", f"{side}_id", f"{side}_name"]
+    if node_type is None:
+        columns.insert(0, f"{side}_type")
+    codes = df.groupby(columns, sort=False).ngroup().values
+    nodes = [
+        _type_map[node_type or key[0]](namespace=key[-3], identifier=key[-2], name=key[-1])
+        for key in df[columns].drop_duplicates().itertuples(index=False)
+    ]
+    return codes, nodes
+
+
+def _get_templates(evidence: Optional[str]) -> Mapping[str, Dict]:
+    """Get the edge data for each modulation, all sharing the same citation."""
+    citation = citation_dict(namespace=CITATION_NAMESPACE, identifier=CITATION_IDENTIFIER)
+    rv = {}
+    for modulation, (relation, modifies_activity) in _relations.items():
+        attr = {RELATION: relation, EVIDENCE: evidence, CITATION: citation}
+        if modifies_activity:
+            attr[TARGET_MODIFIER] = dsl.activity()
+        rv[modulation] = attr
+    return rv
+
+
+def _add_edges(graph: BELGraph, *, sources, targets, edges, evidence: Optional[str]) -> None:
+    """Add edges in bulk, sharing the edge data built once per relation."""
+    templates = _get_templates(evidence)
+    batch = []
+    for source_code, target_code, modulation in tqdm(edges, desc="mapping to BEL", unit_scale=True):
+        source, target = sources[source_code], targets[target_code]
+        attr = templates[modulation]
+        batch.append((source, target, hash_edge(source, target, attr), attr))
+
+    # Add nodes in order of first appearance, then all edges at once
+    nodes = {}
+    for source, target, _, _ in batch:
+        nodes.setdefault(source, None)
+        nodes.setdefault(target, None)
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from(batch)
+
+
+class _EdgeTable(NamedTuple):
+    """The distinct nodes and edges of a BEL graph, in the order :mod:`networkx` iterates them."""
+
+    #: Nodes in order of insertion into the graph
+    nodes: List[dsl.BaseEntity]
+    #: For each edge, the position of its source node
+    sources: np.ndarray
+    #: For each edge, the position of its target node
+    targets: np.ndarray
+    #: For each edge, its modulation
+    modulations: np.ndarray
+
+
+def _get_edge_tables(specs: Sequence[BELSpec]) -> List[_EdgeTable]:
+    """Get the nodes and edges for several BEL graphs from one pass over the relations.
+
+    As in :func:`get_bel_graphs`, the relations are loaded once for all of the
+    specifications, then each table is built from its subset, chosen by a filter.
+
+    :param specs: Specifications for each of the tables to build
+    :returns: The nodes and edges for each specification
+    """
+    df = _get_bel_df(use_inferred=any(spec.use_inferred for spec in specs))
+    return [
+        _get_edge_table(df.iloc[_get_subset(df, spec)].reset_index(drop=True)) for spec in specs
+    ]
+
+
+def _get_edge_table(df: pd.DataFrame) -> _EdgeTable:
+    """Get the nodes and edges for a BEL graph of the given relations without building the graph."""
+    # Interleave sources and targets so nodes are numbered in the order they would be inserted
+    keys = pd.DataFrame(
+        {
+            "function": _interleave(
+                np.full(len(df.index), dsl.Abundance.__name__, dtype=object),
+                df["target_type"].map(_function_names).values,
+            ),
+            "db": _interleave(df["source_db"].values, df["target_db"].values),
+            "id": _interleave(df["source_id"].values, df["target_id"].values),
+            "name": _interleave(df["source_name"].values, df["target_name"].values),
+        }
+    )
+    node_ids = keys.groupby(list(keys.columns), sort=False).ngroup().values
+    nodes = [
+        _function_classes[function](namespace=namespace, identifier=identifier, name=name)
+        for function, namespace, identifier, name in keys.drop_duplicates().itertuples(index=False)
+    ]
+
+    edges = pd.DataFrame(
+        {
+            "source": node_ids[0::2],
+            "target": node_ids[1::2],
+            "modulation": df["modulation"].values,
+            # Modulations with the same relation and modifier give the same edge
+            "relation": df["modulation"].map(_relations).values,
+        }
+    )
+    edges = edges.drop_duplicates(["source", "target", "relation"])
+    # Edges are iterated by source node, then by target node and key in order of insertion
+    edges["pair"] = edges.groupby(["source", "target"], sort=False).ngroup()
+    edges = edges.sort_values(["source", "pair"], kind="mergesort")
+    return _EdgeTable(
+        nodes=nodes,
+        sources=edges["source"].values,
+        targets=edges["target"].values,
+        modulations=edges["modulation"].values,
+    )
+
+
+def _interleave(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    rv = np.empty(2 * len(a), dtype=object)
+    rv[0::2] = a
+    rv[1::2] = b
+    return rv
+
+
+def _iter_edges(table: _EdgeTable, evidence: Optional[str]):
+    """Iterate over the source node's position, target node's position, key, and data for each edge."""
+    templates = _get_templates(evidence)
+    for source_id, target_id, modulation in zip(table.sources, table.targets, table.modulations):
+        attr = templates[modulation]
+        key = hash_edge(table.nodes[source_id], table.nodes[target_id], attr)
+        yield source_id, target_id, key, attr
+
+
+def write_bel_nodelink_gz(path: str, spec: Optional[BELSpec] = None) -> None:
+    """Write a BEL graph as gzipped node-link JSON incrementally, without building the graph.
+
+    The output is the same as :func:`pybel.dump` on the graph from :func:`get_bel`.
+
+    :param path: The path to write to
+    :param spec: The specification for which relations to include
+    """
+    if spec is None:
+        spec = BELSpec()
+    (table,) = _get_edge_tables([spec])
+    _write_nodelink_gz(path, table, evidence=EVIDENCE_TEXT if spec.add_evidence else None)
+
+
+def _write_nodelink_gz(path: str, table: _EdgeTable, evidence: Optional[str]) -> None:
+    graph_dict = to_nodelink(BELGraph(name="Chemical Roles Graph"))["graph"]
+
+    # Nodes are written sorted by their BEL, and edges refer to nodes by their position
+    bels = [node.as_bel() for node in table.nodes]
+    order = sorted(range(len(table.nodes)), key=bels.__getitem__)
+    position = {node_id: i for i, node_id in enumerate(order)}
+
+    with gzip.open(path, "wt") as file:
+        file.write('{"directed": true, "multigraph": true, "graph": ')
+        file.write(_dumps(graph_dict))
+        file.write(', "nodes": [')
+        for i, node_id in enumerate(order):
+            node = table.nodes[node_id]
+            node_dict = node.copy()
+            node_dict["id"] = node.md5
+            node_dict["bel"] = bels[node_id]
+            file.write((", " if i else "") + _dumps(node_dict))
+        file.write('], "links": [')
+        edges = _iter_edges(table, evidence)
+        it = tqdm(edges, desc="writing BEL", unit_scale=True)
+        for i, (source_id, target_id, key, attr) in enumerate(it):
+            link = dict(attr)
+            link["source"] = position[source_id]
+            link["target"] = position[target_id]
+            link["key"] = key
+            file.write((", " if i else "") + _dumps(link))
+        file.write("]}")
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def write_indra_statements_json(
+    path: str,
+    spec: Optional[BELSpec] = None,
+    chunk_size: int = 10_000,
+) -> None:
+    """Write INDRA statements incrementally, converting a chunk of edges at a time.
+
+    The output has the same layout as :func:`pybel.to_indra_statements_json_file`
+    with ``sort_keys=True``, but only one chunk of edges and their statements
+    are in memory at once.
+
+    :param path: The path to write to
+    :param spec: The specification for which relations to include. Defaults to the
+        curated relations without evidence, as in the INDRA export.
+    :param chunk_size: The number of edges to convert to statements at once
+    """
+    if spec is None:
+        spec = _INDRA_SPEC
+    (table,) = _get_edge_tables([spec])
+    _write_statements_json(
+        path, table, evidence=EVIDENCE_TEXT if spec.add_evidence else None, chunk_size=chunk_size
+    )
+
+
+def write_bel_and_indra(bel_path: str, indra_path: str, chunk_size: int = 10_000) -> None:
+    """Write the BEL and INDRA exports from one pass over the relations.
+
+    The outputs are the same as :func:`write_bel_nodelink_gz` and
+    :func:`write_indra_statements_json` with their default specifications.
+
+    :param bel_path: The path to write the gzipped BEL node-link JSON to
+    :param indra_path: The path to write the INDRA statements JSON to
+    :param chunk_size: The number of edges to convert to statements at once
+    """
+    bel_table, indra_table = _get_edge_tables([BELSpec(), _INDRA_SPEC])
+    _write_nodelink_gz(bel_path, bel_table, evidence=EVIDENCE_TEXT)
+    _write_statements_json(indra_path, indra_table, evidence=None, chunk_size=chunk_size)
+
+
+def _write_statements_json(
+    path: str, table: _EdgeTable, evidence: Optional[str], chunk_size: int
+) -> None:
+    from indra.sources.bel import process_pybel_graph
+
+    edges = _iter_edges(table, evidence)
+
+    with open(path, "w") as file:
+        first = True
+        for chunk in _iter_chunks(edges, chunk_size):
+            graph = BELGraph(name="Chemical Roles Graph")
+            node_ids = {}
+            for source_id, target_id, _, _ in chunk:
+                node_ids.setdefault(source_id, None)
+                node_ids.setdefault(target_id, None)
+            graph.add_nodes_from(table.nodes[node_id] for node_id in node_ids)
+            graph.add_edges_from(
+                (table.nodes[source_id], table.nodes[target_id], key, attr)
+                for source_id, target_id, key, attr in chunk
+            )
+            for statement in process_pybel_graph(graph).statements:
+                text = json.dumps(statement.to_json(), indent=2, sort_keys=True)
+                file.write("[\n" if first else ",\n")
+                file.write("\n".join(f"  {line}" for line in text.splitlines()))
+                first = False
+        file.write("[]" if first else "\n]")
+
+
+def _iter_chunks(it: Iterable, n: int) -> Iterable[List]:
+    chunk = []
+    for element in it:
+        chunk.append(element)
+        if len(chunk) == n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
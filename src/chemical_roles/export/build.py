@@ -5,19 +5,20 @@
 import logging
 import os
 import time
-
-import matplotlib.pyplot as plt
-import seaborn as sns
-from tabulate import tabulate
+from concurrent.futures import Executor, Future
+from typing import Optional
 
 from chemical_roles.constants import (
     DATA,
     DOCS,
-    IMG,
-    RELATIONS_OUTPUT_PATH,
-    RELATIONS_SLIM_OUTPUT_PATH,
+    MAX_GO_FANOUT,
+    RELATIONS_OUTPUT_NAME,
+    RELATIONS_SLIM_OUTPUT_NAME,
     ROOT,
 )
+from chemical_roles.export.enrich import ENRICHMENT_COLUMNS, enrich_relations_df
+from chemical_roles.export.plots import submit_summary_plot
+from chemical_roles.export.summary import Summary, get_summary, write_summary_tsvs
 from chemical_roles.export.utils import get_relations_df
 from chemical_roles.resources import get_xrefs_df
 
@@ -31,73 +32,26 @@ FAMPLEX_HGNC_SYMBOL_MAP_URL = (
 )
 
 
-def rewrite_repo_readme():
-    """Rewrite the summary of curated content in the repository's readme, automatically."""
-    df = get_xrefs_df()
-
-    summary_df = df.groupby(["source_db", "modulation", "type", "target_db"]).size().reset_index()
-    summary_df.columns = [
-        "Source Database",
-        "Modulation",
-        "Target Type",
-        "Target Database",
-        "Count",
-    ]
-    summary_df.to_csv(os.path.join(DATA, "curated_summary.tsv"), sep="\t", index=False)
-
-    modulation_summary_df = df.groupby("modulation").size().reset_index()
-    modulation_summary_df.columns = ["Modulation", "Count"]
-    modulation_summary_df.to_csv(
-        os.path.join(DATA, "curated_summary_by_modulation.tsv"),
-        sep="\t",
-        index=False,
-    )
-    type_summary_df = df.groupby("type").size().reset_index()
-    type_summary_df.columns = ["Target Type", "Count"]
-    type_summary_df.to_csv(
-        os.path.join(DATA, "curated_summary_by_type.tsv"),
-        sep="\t",
-        index=False,
-    )
-    namespace_summary_df = df.groupby("target_db").size().reset_index()
-    namespace_summary_df.columns = ["Target Database", "Count"]
-    namespace_summary_df.to_csv(
-        os.path.join(DATA, "curated_summary_by_namespace.tsv"),
-        sep="\t",
-        index=False,
-    )
-
-    logger.info("Plotting modulation and target type summary")
-    fig, (lax, rax) = plt.subplots(nrows=1, ncols=2, figsize=(12, 5))
-
-    modulation_summary_df["Modulation"] = modulation_summary_df["Modulation"].map(str.title)
-    g = sns.barplot(y="Modulation", x="Count", data=modulation_summary_df, ax=lax)
-    g.set_xscale("log")
-    lax.set_title(
-        f"Modulation ({len(df.index)} in {len(modulation_summary_df.index)} relations)",
-        fontdict={"fontweight": "bold"},
-    )
-    lax.set_ylabel("")
-
-    type_summary_df["Target Type"] = type_summary_df["Target Type"].map(str.title)
-    g = sns.barplot(y="Target Type", x="Count", data=type_summary_df, ax=rax)
-    g.set_xscale("log")
-    rax.set_title(
-        f"Target Type ({len(df.index)} in {len(type_summary_df.index)} types)",
-        fontdict={"fontweight": "bold"},
-    )
-    rax.set_ylabel("")
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(IMG, "curated_summary.png"), dpi=300)
-    plt.savefig(os.path.join(IMG, "curated_summary.svg"))
-
-    text = f"There are {len(df.index)} curated roles as of export on {time.asctime()}\n\n"
-    text += tabulate(modulation_summary_df.values, ["Modulation", "Count"], tablefmt="rst")
-    text += "\n\n"
-    text += tabulate(type_summary_df.values, ["Target Entity Type", "Count"], tablefmt="rst")
-    text += "\n\n"
-    text += tabulate(namespace_summary_df.values, ["Target Database", "Count"], tablefmt="rst")
+def rewrite_repo_readme(
+    summary: Optional[Summary] = None,
+    executor: Optional[Executor] = None,
+    directory: str = DATA,
+) -> Optional[Future]:
+    """Rewrite the summary of curated content in the repository's readme, automatically.
+
+    :param summary: A pre-computed summary of the curated xrefs. If not given, is calculated.
+    :param executor: An executor in which to render the chart in the background
+    :param directory: The directory the summary TSVs are written to
+    :returns: A future for the chart, if it's being rendered in the background
+    """
+    if summary is None:
+        summary = get_summary(get_xrefs_df())
+
+    write_summary_tsvs(summary, directory, "curated")
+    future = submit_summary_plot(summary, "curated_summary", executor=executor)
+
+    text = f"There are {summary.total} curated roles as of export on {time.asctime()}\n\n"
+    text += summary.get_rst()
     text += "\n"
 
     readme_path = os.path.join(ROOT, "README.rst")
@@ -125,125 +79,83 @@ def rewrite_repo_readme():
         for line in readme[end:]:
             print(line, file=file)
 
+    return future
+
 
-def write_export():
+def write_export(
+    executor: Optional[Executor] = None,
+    memory_budget: Optional[int] = None,
+    use_sub_roles: bool = False,
+    directory: str = DATA,
+    relations_path: Optional[str] = None,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> Optional[Future]:
     """Generate export TSVs.
 
-    1. Full TSV at ``export/relations.tsv``
-    2. Slim TSV at ``export/relations_slim.tsv``, appropriate for machine learning
+    1. Full TSV at ``relations.tsv``, with the equivalent identifiers from
+       :mod:`chemical_roles.export.enrich`
+    2. Slim TSV at ``relations_slim.tsv``, appropriate for machine learning
+
+    :param executor: An executor in which to render the chart in the background
+    :param memory_budget: If given, the relations are inferred and sorted out of core,
+        keeping about this many bytes of them in memory. See
+        :mod:`chemical_roles.export.external`.
+    :param use_sub_roles: Should the chemicals with descendant roles be included?
+    :param directory: The directory the relations and summary TSVs are written to
+    :param relations_path: If given with a memory budget, the relations are streamed from
+        this file, written by :func:`chemical_roles.export.external.write_sorted_relations`,
+        instead of being inferred again
+    :param propagate_go: Should the GO targets be propagated over the GO hierarchy? See
+        :func:`chemical_roles.export.utils.infer_relations_df`.
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    :returns: A future for the chart, if it's being rendered in the background
     """
-    df = get_relations_df()
-    logger.info("got relations df with %s rows", len(df.index))
-
-    columns = [
-        "modulation",
-        "target_type",
-        "source_db",
-        "source_id",
-        "source_name",
-        "target_db",
-        "target_id",
-        "target_name",
-    ]
-    df[columns].sort_values(columns).to_csv(RELATIONS_OUTPUT_PATH, sep="\t", index=False)
-
-    logger.info("outputting slim df to %s", RELATIONS_SLIM_OUTPUT_PATH)
-    slim_columns = ["source_db", "source_id", "modulation", "target_db", "target_id"]
-    df[slim_columns].sort_values(slim_columns).to_csv(
-        RELATIONS_SLIM_OUTPUT_PATH, sep="\t", index=False
-    )
-
-    logger.info("making summary df")
-    summary_df = (
-        df.groupby(["source_db", "modulation", "target_type", "target_db"]).size().reset_index()
-    )
-    summary_df.columns = [
-        "Source Database",
-        "Modulation",
-        "Target Type",
-        "Target Database",
-        "Count",
-    ]
-    summary_df.to_csv(os.path.join(DATA, "inferred_summary.tsv"), sep="\t", index=False)
-    summary_df_str = tabulate(
-        summary_df.values,
-        ["source_db", "relation", "target_type", "target_db", "count"],
-        tablefmt="github",
-    )
-
-    logger.info("making modulation summary df")
-    modulation_summary_df = df.groupby(["modulation"]).size().reset_index()
-    modulation_summary_df.columns = ["Modulation", "Count"]
-    modulation_summary_df.to_csv(
-        os.path.join(DATA, "inferred_summary_by_modulation.tsv"),
-        sep="\t",
-        index=False,
-    )
-    modulation_str = tabulate(
-        modulation_summary_df.values,
-        ["modulation", "count"],
-        tablefmt="github",
-    )
-
-    logger.info("making namespace summary df")
-    namespace_summary_df = df.groupby(["target_db"]).size().reset_index()
-    namespace_summary_df.columns = ["Target Database", "Count"]
-    namespace_summary_df.to_csv(
-        os.path.join(DATA, "inferred_summary_by_namespace.tsv"),
-        sep="\t",
-        index=False,
-    )
-    ns_str = tabulate(
-        namespace_summary_df.values,
-        ["namespace", "count"],
-        tablefmt="github",
-    )
-
-    logger.info("making type summary df")
-    type_summary_df = df.groupby(["target_type"]).size().reset_index()
-    type_summary_df.columns = ["Target Type", "Count"]
-    type_summary_df.to_csv(
-        os.path.join(DATA, "inferred_summary_by_type.tsv"), sep="\t", index=False
-    )
-    type_str = tabulate(
-        type_summary_df.values,
-        ["type", "count"],
-        tablefmt="github",
-    )
-
-    logger.info("Plotting modulation and target type summary")
-    fig, (lax, rax) = plt.subplots(nrows=1, ncols=2, figsize=(12, 5))
-
-    modulation_summary_df["Modulation"] = modulation_summary_df["Modulation"].map(str.title)
-    g = sns.barplot(y="Modulation", x="Count", data=modulation_summary_df, ax=lax)
-    g.set_xscale("log")
-    lax.set_title(
-        f"Modulation ({len(df.index)} in {len(modulation_summary_df.index)} relations)",
-        fontdict={"fontweight": "bold"},
-    )
-    lax.set_ylabel("")
-
-    type_summary_df["Target Type"] = type_summary_df["Target Type"].map(str.title)
-    g = sns.barplot(y="Target Type", x="Count", data=type_summary_df, ax=rax)
-    g.set_xscale("log")
-    rax.set_title(
-        f"Target Type ({len(df.index)} in {len(type_summary_df.index)} types)",
-        fontdict={"fontweight": "bold"},
-    )
-    rax.set_ylabel("")
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(IMG, "inferred_summary.png"), dpi=300)
-    plt.savefig(os.path.join(IMG, "inferred_summary.svg"))
+    path = os.path.join(directory, RELATIONS_OUTPUT_NAME)
+    slim_path = os.path.join(directory, RELATIONS_SLIM_OUTPUT_NAME)
+    if memory_budget is not None:
+        from .external import read_sorted_relations, write_relations_tsvs
+
+        summary = write_relations_tsvs(
+            path,
+            slim_path,
+            memory_budget,
+            rows=None if relations_path is None else read_sorted_relations(relations_path),
+            use_sub_roles=use_sub_roles,
+            propagate_go=propagate_go,
+            max_go_fanout=max_go_fanout,
+        )
+    else:
+        df = get_relations_df(
+            use_sub_roles=use_sub_roles, propagate_go=propagate_go, max_go_fanout=max_go_fanout
+        )
+        logger.info("got relations df with %s rows", len(df.index))
+
+        columns = [
+            "modulation",
+            "target_type",
+            "source_db",
+            "source_id",
+            "source_name",
+            "target_db",
+            "target_id",
+            "target_name",
+        ]
+        enriched_df = enrich_relations_df(df)[[*columns, *ENRICHMENT_COLUMNS]]
+        enriched_df.sort_values(columns).to_csv(path, sep="\t", index=False)
+
+        logger.info("outputting slim df to %s", slim_path)
+        slim_columns = ["source_db", "source_id", "modulation", "target_db", "target_id"]
+        df[slim_columns].sort_values(slim_columns).to_csv(slim_path, sep="\t", index=False)
+
+        logger.info("making summary df")
+        summary = get_summary(df)
+    write_summary_tsvs(summary, directory, "inferred")
+    future = submit_summary_plot(summary, "inferred_summary", executor=executor)
 
     with open(os.path.join(DOCS, "index.md"), "w") as file:
         print("# Export Summary\n", file=file)
-        print(f"Exported {len(df.index)} relations on {time.asctime()}\n", file=file)
-        print("\n## Summary by Modulation\n", file=file)
-        print(modulation_str, file=file)
-        print("\n## Summary by Type\n", file=file)
-        print(type_str, file=file)
-        print("\n## Summary by Namespace\n", file=file)
-        print(ns_str, file=file)
-        print("\n## Relation Summary\n", file=file)
-        print(summary_df_str, file=file)
+        print(f"Exported {summary.total} relations on {time.asctime()}\n", file=file)
+        print(summary.get_markdown(), file=file)
+
+    return future
@@ -5,75 +5,294 @@
 import os
 
 import click
+from more_click import verbose_option
 
-from ..constants import DATA
+from ..constants import (
+    DATA,
+    MAX_GO_FANOUT,
+    RELATIONS_OUTPUT_PATH,
+    RELATIONS_SLIM_OUTPUT_PATH,
+)
 
 
 @click.group()
-def export():
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help="Write a JSON report of the time, memory, and row counts of each stage",
+)
+@click.option(
+    "--cprofile",
+    type=click.Path(dir_okay=False),
+    help="Write a cProfile dump of the main process, e.g., for snakeviz",
+)
+@click.option(
+    "--speedscope",
+    type=click.Path(dir_okay=False),
+    help="Write the stages as a speedscope profile",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Trace the peak memory of each stage with tracemalloc, which is several times slower. "
+    "Requires --profile, --cprofile, or --speedscope.",
+)
+@click.pass_context
+def export(ctx: click.Context, profile, cprofile, speedscope, trace_memory: bool):
     """Export the database."""
+    if trace_memory and not (profile or cprofile or speedscope):
+        raise click.UsageError("--trace-memory requires --profile, --cprofile, or --speedscope")
+    if profile or cprofile or speedscope:
+        from ..instrument import profiling
 
-
-@export.command(name="all")
-@click.pass_context
-def export_all(ctx):
-    """Export all."""
-    ctx.invoke(summary)
-    ctx.invoke(obo)
-    ctx.invoke(bel)
-    ctx.invoke(indra)
+        ctx.with_resource(
+            profiling(
+                profile,
+                cprofile_path=cprofile,
+                speedscope_path=speedscope,
+                trace_memory=trace_memory,
+            )
+        )
 
 
 directory_option = click.option("--directory", default=DATA)
+propagate_go_option = click.option(
+    "--propagate-go",
+    is_flag=True,
+    help="Propagate GO targets to their descendants or ancestors, depending on the modulation",
+)
+max_go_fanout_option = click.option(
+    "--max-go-fanout",
+    type=int,
+    default=MAX_GO_FANOUT,
+    show_default=True,
+    help="Don't propagate relations to GO terms with more descendants or ancestors than this",
+)
+
+
+def _parse_size(_ctx, _param, value):
+    if value is None:
+        return None
+    from .external import parse_size
+
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@export.command(name="all")
+@directory_option
+@verbose_option
+@click.option("--force", is_flag=True, help="Run all stages, even if they're unchanged")
+@click.option("--workers", type=int, help="The number of worker processes")
+@click.option(
+    "--memory-budget",
+    callback=_parse_size,
+    help="Infer and sort the relations out of core once, keeping about this much of them "
+    "in memory, e.g., 4G, then stream them to the summary, Parquet, SQLite, and triples "
+    "stages. The OBO and BEL stages still load all of the relations into memory.",
+)
+@click.option("--sub-roles", is_flag=True, help="Include chemicals with descendant roles")
+@propagate_go_option
+@max_go_fanout_option
+def export_all(
+    directory,
+    force: bool,
+    workers,
+    memory_budget,
+    sub_roles: bool,
+    propagate_go: bool,
+    max_go_fanout: int,
+):
+    """Export all, skipping stages whose inputs and outputs are unchanged."""
+    from .pipeline import run_stages
+
+    stages = run_stages(
+        directory=directory,
+        force=force,
+        max_workers=workers,
+        memory_budget=memory_budget,
+        use_sub_roles=sub_roles,
+        propagate_go=propagate_go,
+        max_go_fanout=max_go_fanout,
+    )
+    if stages:
+        click.echo(f"Ran stages: {', '.join(stages)}")
+    else:
+        click.echo("All stages are up-to-date")
 
 
 @export.command()
-def summary():
+@click.option(
+    "--memory-budget",
+    callback=_parse_size,
+    help="Infer and sort the relations out of core, keeping about this much of them "
+    "in memory, e.g., 4G",
+)
+@click.option("--sub-roles", is_flag=True, help="Include chemicals with descendant roles")
+@propagate_go_option
+@max_go_fanout_option
+@verbose_option
+def summary(memory_budget, sub_roles: bool, propagate_go: bool, max_go_fanout: int):
     """Rewrite readme and generate new export."""
-    import seaborn as sns
+    from .pipeline import write_summary
+
+    write_summary(
+        memory_budget=memory_budget,
+        use_sub_roles=sub_roles,
+        propagate_go=propagate_go,
+        max_go_fanout=max_go_fanout,
+    )
 
-    from .build import rewrite_repo_readme, write_export
 
-    sns.set(font_scale=1.3, style="whitegrid")
-    rewrite_repo_readme()
-    write_export()
+@export.command()
+@click.option(
+    "--memory-budget",
+    callback=_parse_size,
+    default="2G",
+    show_default=True,
+    help="The approximate amount of relations to keep in memory before spilling them",
+)
+@click.option("--sub-roles", is_flag=True, help="Include chemicals with descendant roles")
+@click.option("--output", type=click.Path(dir_okay=False), default=RELATIONS_OUTPUT_PATH)
+@click.option("--slim-output", type=click.Path(dir_okay=False), default=RELATIONS_SLIM_OUTPUT_PATH)
+@click.option("--spill-directory", type=click.Path(file_okay=False), help="Defaults to $TMPDIR")
+@propagate_go_option
+@max_go_fanout_option
+@verbose_option
+def relations(
+    memory_budget: int,
+    sub_roles: bool,
+    output,
+    slim_output,
+    spill_directory,
+    propagate_go: bool,
+    max_go_fanout: int,
+):
+    """Write the relations TSVs out of core, within a memory budget."""
+    from .external import write_relations_tsvs
+
+    summary = write_relations_tsvs(
+        output,
+        slim_output,
+        memory_budget,
+        directory=spill_directory,
+        use_sub_roles=sub_roles,
+        propagate_go=propagate_go,
+        max_go_fanout=max_go_fanout,
+    )
+    click.echo(f"Wrote {summary.total:,} relations to {output} and {slim_output}")
 
 
 @export.command()
 @directory_option
 def bel(directory):
     """Write BEL export."""
-    import pybel
+    from .pipeline import write_bel
 
-    from .bel import get_bel
-
-    graph = get_bel()
-    pybel.dump(graph, os.path.join(directory, "crog.bel.nodelink.json.gz"))
+    write_bel(directory)
 
 
 @export.command()
 @directory_option
 def indra(directory):
     """Write INDRA export."""
-    import pybel
-
-    from .bel import get_bel
+    from .pipeline import write_indra
 
-    graph = get_bel(use_inferred=False, add_evidence=False)
-    pybel.to_indra_statements_json_file(
-        graph, os.path.join(directory, "crog.indra.json"), sort_keys=True
-    )
+    write_indra(directory)
 
 
 @export.command()
 @directory_option
 def obo(directory):
     """Write OBO export."""
-    from .obo import get_obo
+    from .pipeline import write_obo
+
+    write_obo(directory)
+
+
+@export.command()
+@directory_option
+@verbose_option
+def parquet(directory):
+    """Write partitioned Parquet datasets of the full and slim relations."""
+    from .pipeline import write_parquet
+
+    write_parquet(directory)
+
+
+@export.command()
+@directory_option
+@verbose_option
+def sqlite(directory):
+    """Write an indexed SQLite database of the curated and inferred relations."""
+    from .pipeline import write_sqlite
+
+    write_sqlite(directory)
+
+
+@export.command()
+@click.option("--directory", default=os.path.join(DATA, "triples"), show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--ratios",
+    type=(float, float, float),
+    default=(0.8, 0.1, 0.1),
+    show_default=True,
+    help="The shares of the training, validation, and testing splits",
+)
+@click.option(
+    "--group-roles/--no-group-roles",
+    default=True,
+    show_default=True,
+    help="Keep roles in the same split as the chemicals that have them, so neither leaks "
+    "across splits. Otherwise, only triples with the same chemical are kept together.",
+)
+@verbose_option
+def triples(directory, seed: int, ratios, group_roles: bool):
+    """Write integer triples with ID maps and seeded splits for machine learning."""
+    from .triples import write_triples
 
-    o = get_obo()
-    o.write_obo(os.path.join(directory, "crog.obo"))
-    o.write_obonet_gz(os.path.join(directory, "crog.obonet.json.gz"))
+    write_triples(directory, ratios=ratios, seed=seed, group_roles=group_roles)
+
+
+@export.command()
+@click.option("--modulation", "modulations", multiple=True, help="e.g., inhibitor")
+@click.option("--target-db", "target_dbs", multiple=True, help="e.g., hgnc")
+@click.option("--target-type", "target_types", multiple=True, help="e.g., protein")
+@click.option("--role", "roles", multiple=True, help="A role's CURIE, e.g., chebi:35222")
+@click.option("--chemical", "chemicals", multiple=True, help="A chemical's CURIE")
+@click.option("--sub-roles", is_flag=True, help="Include chemicals with descendant roles")
+@propagate_go_option
+@max_go_fanout_option
+@click.option("--output", type=click.File("w"), default="-", help="Defaults to stdout")
+@verbose_option
+def infer(
+    modulations,
+    target_dbs,
+    target_types,
+    roles,
+    chemicals,
+    sub_roles: bool,
+    propagate_go: bool,
+    max_go_fanout: int,
+    output,
+):
+    """Infer only the slice of the relations matching the given filters, as a TSV."""
+    from .utils import infer_relations_df
+
+    df = infer_relations_df(
+        use_sub_roles=sub_roles,
+        modulations=modulations or None,
+        target_dbs=target_dbs or None,
+        target_types=target_types or None,
+        roles=roles or None,
+        chemicals=chemicals or None,
+        propagate_go=propagate_go,
+        max_go_fanout=max_go_fanout,
+    )
+    df.to_csv(output, sep="\t", index=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Enrich the relations with equivalent identifiers from crosswalk tables.
+
+The chemicals' Wikidata identifiers and the proteins' HGNC, UniProt, and Wikidata
+identifiers are attached to each relation as the columns in :data:`ENRICHMENT_COLUMNS`,
+so consumers of the TSV and Parquet exports don't have to join them themselves.
+The crosswalks come from ``wd_chemicals.tsv`` and ``wd_proteins.tsv``, which are
+written by ``chemical_roles import wikidata``. They're loaded once, indexed by the
+identifier they're looked up by, and joined onto the relations by hashing::
+
+    from chemical_roles.export.enrich import enrich_relations_df
+    from chemical_roles.export.utils import get_relations_df
+
+    df = enrich_relations_df(get_relations_df())
+
+A key with several equivalents, e.g., an HGNC gene with several UniProt proteins,
+gets them all in one cell separated by ``|``, so every relation keeps one row.
+"""
+
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from ..resources import WD_CHEMICALS_PATH, WD_PROTEINS_PATH
+
+__all__ = [
+    "ENRICHMENT_COLUMNS",
+    "Crosswalks",
+    "build_crosswalks",
+    "get_crosswalks",
+    "get_crosswalks_hash",
+    "enrich_relations_df",
+    "get_row_enricher",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The columns added to the relations, in order
+ENRICHMENT_COLUMNS = [
+    "source_wikidata_id",
+    "target_hgnc_id",
+    "target_uniprot_id",
+    "target_wikidata_id",
+]
+#: The separator between several equivalent identifiers in one cell
+SEPARATOR = "|"
+CROSSWALK_PATHS = [WD_CHEMICALS_PATH, WD_PROTEINS_PATH]
+
+
+class Crosswalks(NamedTuple):
+    """The crosswalk tables, each indexed by the identifier it's looked up by."""
+
+    #: From ChEBI identifiers (without the prefix) to Wikidata identifiers
+    chebi_to_wikidata: pd.Series
+    #: From HGNC identifiers to the ``uniprot_id`` and ``wikidata_id`` of the gene
+    hgnc: pd.DataFrame
+    #: From UniProt identifiers to the ``hgnc_id`` and ``wikidata_id`` of the protein
+    uniprot: pd.DataFrame
+
+
+def _collapse(df: pd.DataFrame, key: str, value: str) -> pd.Series:
+    """Group the unique values of a column by a key, joined by :data:`SEPARATOR`."""
+    df = df[[key, value]].dropna().drop_duplicates().sort_values([key, value])
+    return df.groupby(key, sort=True)[value].agg(SEPARATOR.join)
+
+
+def build_crosswalks(chemicals_df: pd.DataFrame, proteins_df: pd.DataFrame) -> Crosswalks:
+    """Index the crosswalk tables.
+
+    :param chemicals_df: A dataframe like ``wd_chemicals.tsv``, with ``chebi_id``
+        and ``wikidata_id`` columns
+    :param proteins_df: A dataframe like ``wd_proteins.tsv``, with ``hgnc_id``,
+        ``gene_wikidata_id``, ``uniprot_id``, and ``protein_wikidata_id`` columns
+    :returns: The indexed crosswalks
+    """
+    hgnc = pd.DataFrame(
+        {
+            "uniprot_id": _collapse(proteins_df, "hgnc_id", "uniprot_id"),
+            "wikidata_id": _collapse(proteins_df, "hgnc_id", "gene_wikidata_id"),
+        }
+    )
+    uniprot = pd.DataFrame(
+        {
+            "hgnc_id": _collapse(proteins_df, "uniprot_id", "hgnc_id"),
+            "wikidata_id": _collapse(proteins_df, "uniprot_id", "protein_wikidata_id"),
+        }
+    )
+    return Crosswalks(
+        chebi_to_wikidata=_collapse(chemicals_df, "chebi_id", "wikidata_id"),
+        hgnc=hgnc,
+        uniprot=uniprot,
+    )
+
+
+def _read_tsv(path: str, columns) -> pd.DataFrame:
+    if not os.path.exists(path):
+        logger.warning("missing %s. Write it with `chemical_roles import wikidata`", path)
+        return pd.DataFrame(columns=columns, dtype=str)
+    return pd.read_csv(path, sep="\t", dtype=str, usecols=columns)
+
+
+@lru_cache(maxsize=1)
+def get_crosswalks() -> Crosswalks:
+    """Load and index the crosswalks from the package's resources.
+
+    If a crosswalk hasn't been imported, it's empty and its columns are left blank.
+    """
+    return build_crosswalks(
+        _read_tsv(WD_CHEMICALS_PATH, ["chebi_id", "wikidata_id"]),
+        _read_tsv(
+            WD_PROTEINS_PATH, ["hgnc_id", "gene_wikidata_id", "uniprot_id", "protein_wikidata_id"]
+        ),
+    )
+
+
+def get_crosswalks_hash() -> str:
+    """Hash the contents of the crosswalk TSVs, e.g., to fingerprint the export stages."""
+    h = hashlib.sha256()
+    for path in CROSSWALK_PATHS:
+        h.update(os.path.basename(path).encode("utf-8"))
+        if not os.path.exists(path):
+            h.update(b"missing")
+            continue
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _get_chebi_keys(source_db: pd.Series, source_id: pd.Series) -> pd.Series:
+    # Curated chemicals have CURIEs as their identifiers and inferred ones don't
+    return source_id.where(source_db == "chebi").str.replace("^CHEBI:", "", regex=True)
+
+
+def enrich_relations_df(df: pd.DataFrame, crosswalks: Optional[Crosswalks] = None) -> pd.DataFrame:
+    """Add the equivalent identifiers of the sources and targets to the relations.
+
+    :param df: A relations dataframe. If it already has the columns in
+        :data:`ENRICHMENT_COLUMNS`, it's returned as is.
+    :param crosswalks: The crosswalks. Defaults to :func:`get_crosswalks`.
+    :returns: A copy of the relations with the columns in :data:`ENRICHMENT_COLUMNS`.
+        The HGNC and UniProt columns repeat the target's own identifier when it's
+        in that namespace. Missing equivalents are NaN.
+    """
+    if all(column in df.columns for column in ENRICHMENT_COLUMNS):
+        return df
+    if crosswalks is None:
+        crosswalks = get_crosswalks()
+
+    target_id = df["target_id"]
+    hgnc_keys = target_id.where(df["target_db"] == "hgnc")
+    uniprot_keys = target_id.where(df["target_db"] == "uniprot")
+    return df.assign(
+        source_wikidata_id=_get_chebi_keys(df["source_db"], df["source_id"]).map(
+            crosswalks.chebi_to_wikidata
+        ),
+        target_hgnc_id=hgnc_keys.fillna(uniprot_keys.map(crosswalks.uniprot["hgnc_id"])),
+        target_uniprot_id=uniprot_keys.fillna(hgnc_keys.map(crosswalks.hgnc["uniprot_id"])),
+        target_wikidata_id=hgnc_keys.map(crosswalks.hgnc["wikidata_id"]).fillna(
+            uniprot_keys.map(crosswalks.uniprot["wikidata_id"])
+        ),
+    )
+
+
+def get_row_enricher(
+    crosswalks: Optional[Crosswalks] = None,
+) -> Callable[[str, str, str, str], Tuple[str, str, str, str]]:
+    """Get a function that looks up the equivalent identifiers for one relation at a time.
+
+    This gives the same values as :func:`enrich_relations_df` for relations that are
+    streamed instead of collected into a dataframe, e.g., in
+    :mod:`chemical_roles.export.external`.
+
+    :param crosswalks: The crosswalks. Defaults to :func:`get_crosswalks`.
+    :returns: A function from the source's prefix and identifier and the target's
+        prefix and identifier to the values of :data:`ENRICHMENT_COLUMNS`, where
+        missing values are empty strings
+    """
+    if crosswalks is None:
+        crosswalks = get_crosswalks()
+    chebi_to_wikidata = crosswalks.chebi_to_wikidata.to_dict()
+    hgnc_to_uniprot = crosswalks.hgnc["uniprot_id"].to_dict()
+    hgnc_to_wikidata = crosswalks.hgnc["wikidata_id"].to_dict()
+    uniprot_to_hgnc = crosswalks.uniprot["hgnc_id"].to_dict()
+    uniprot_to_wikidata = crosswalks.uniprot["wikidata_id"].to_dict()
+
+    def _enrich(
+        source_db: str, source_id: str, target_db: str, target_id: str
+    ) -> Tuple[str, str, str, str]:
+        source_wikidata_id = ""
+        if source_db == "chebi":
+            key = source_id[len("CHEBI:") :] if source_id.startswith("CHEBI:") else source_id
+            source_wikidata_id = chebi_to_wikidata.get(key, "")
+        if target_db == "hgnc":
+            return (
+                source_wikidata_id,
+                target_id,
+                hgnc_to_uniprot.get(target_id, ""),
+                hgnc_to_wikidata.get(target_id, ""),
+            )
+        if target_db == "uniprot":
+            return (
+                source_wikidata_id,
+                uniprot_to_hgnc.get(target_id, ""),
+                target_id,
+                uniprot_to_wikidata.get(target_id, ""),
+            )
+        return source_wikidata_id, "", "", ""
+
+    return _enrich
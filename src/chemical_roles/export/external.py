@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""Infer and export the relations out of core, within a memory budget.
+
+With ``use_sub_roles=True``, the product of the roles' chemicals and targets can
+be larger than memory. Instead of collecting it into a dataframe, the relations
+are streamed from :func:`chemical_roles.export.utils.iter_relation_rows` into an
+external merge sort: rows are buffered until the budget is reached, then each
+buffer is sorted, deduplicated, and spilled to a temporary file as a run, and
+the runs are combined with a k-way merge. The merged stream is written straight
+to the relations TSVs and counted for the summary::
+
+    from chemical_roles.export.external import parse_size, write_relations_tsvs
+
+    summary = write_relations_tsvs(
+        "relations.tsv", "relations_slim.tsv", memory_budget=parse_size("4G"), use_sub_roles=True,
+    )
+
+To feed several exporters, the merged stream is instead written once to a file
+with :func:`write_sorted_relations`, which each of them reads back in order with
+:func:`read_sorted_relations`, like the stages of
+:func:`chemical_roles.export.pipeline.run_stages` do when given a memory budget.
+"""
+
+import csv
+import heapq
+import itertools as itt
+import logging
+import os
+import pickle
+import re
+import tempfile
+from collections import Counter
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .enrich import ENRICHMENT_COLUMNS, get_row_enricher
+from .provenance import PROVENANCE_COLUMN
+from .summary import SUMMARY_KEYS, Summary, get_summary_from_counts
+from .utils import iter_relation_rows
+from ..instrument import span
+from ..utils import XREFS_COLUMNS
+
+__all__ = [
+    "parse_size",
+    "iter_chunks",
+    "external_sort",
+    "iter_sorted_relations",
+    "write_sorted_relations",
+    "read_sorted_relations",
+    "read_relations_df",
+    "write_relations_tsvs",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The approximate size of a buffered row in bytes, including its sort key. The strings
+#: are mostly shared between rows, so this is dominated by the tuples themselves.
+ROW_BYTES = 320
+#: The number of rows pickled together in a run, which is also how many are read at once
+CHUNK_SIZE = 10_000
+
+#: The columns the full relations TSV is sorted by, which are followed by
+#: :data:`chemical_roles.export.enrich.ENRICHMENT_COLUMNS`
+RELATIONS_COLUMNS = [
+    "modulation",
+    "target_type",
+    "source_db",
+    "source_id",
+    "source_name",
+    "target_db",
+    "target_id",
+    "target_name",
+]
+#: The columns of the slim relations TSV, in their sort order
+RELATIONS_SLIM_COLUMNS = ["source_db", "source_id", "modulation", "target_db", "target_id"]
+#: The columns the equivalent identifiers are looked up by
+ENRICHMENT_KEYS = ["source_db", "source_id", "target_db", "target_id"]
+
+_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size: str) -> int:
+    """Parse a number of bytes like ``512M`` or ``4G``.
+
+    :raises ValueError: If the size can't be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*", size.upper())
+    if match is None:
+        raise ValueError(f"invalid size: {size}")
+    number, unit = match.groups()
+    return int(float(number) * _UNITS[unit])
+
+
+def iter_chunks(rows: Iterable[Tuple], size: int = CHUNK_SIZE) -> Iterator[List[Tuple]]:
+    """Group rows into lists of up to ``size`` rows."""
+    it = iter(rows)
+    while True:
+        chunk = list(itt.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _dump_rows(rows: Iterable[Tuple], file) -> int:
+    n = 0
+    for chunk in iter_chunks(rows):
+        pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+        n += len(chunk)
+    return n
+
+
+def _write_run(rows: List[Tuple], directory: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as file:
+        _dump_rows(rows, file)
+    return path
+
+
+def _read_run(path: str) -> Iterator[Tuple]:
+    with open(path, "rb") as file:
+        while True:
+            try:
+                chunk = pickle.load(file)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def _combine_adjacent(
+    rows: Iterable[Tuple], key: Callable, combine: Optional[Callable[[Tuple, Tuple], Tuple]]
+) -> Iterator[Tuple]:
+    """Combine adjacent rows with the same key."""
+    if combine is None:
+        yield from rows
+        return
+    previous, previous_key = None, None
+    for row in rows:
+        row_key = key(row)
+        if previous is not None and row_key == previous_key:
+            previous = combine(previous, row)
+            continue
+        if previous is not None:
+            yield previous
+        previous, previous_key = row, row_key
+    if previous is not None:
+        yield previous
+
+
+def external_sort(
+    rows: Iterable[Tuple],
+    key: Callable[[Tuple], Tuple],
+    memory_budget: int,
+    *,
+    combine: Optional[Callable[[Tuple, Tuple], Tuple]] = None,
+    directory: Optional[str] = None,
+) -> Iterator[Tuple]:
+    """Sort rows that might not fit in memory.
+
+    :param rows: The rows to sort
+    :param key: A function that gives the sort key of a row
+    :param memory_budget: The approximate number of bytes of rows to buffer before
+        spilling them to a run on disk
+    :param combine: If given, a function that combines two rows with the same key into
+        one, which is applied within each run and again while merging
+    :param directory: The directory in which the runs are spilled. Defaults to the
+        system's temporary directory.
+    :yields: The rows, sorted by their keys
+    """
+    max_rows = max(1, memory_budget // ROW_BYTES)
+    with tempfile.TemporaryDirectory(prefix="chemical-roles-", dir=directory) as tmp:
+        runs: List[str] = []
+        buffer: List[Tuple] = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= max_rows:
+                buffer.sort(key=key)
+                runs.append(_write_run(list(_combine_adjacent(buffer, key, combine)), tmp))
+                logger.info("spilled run %d with %d rows", len(runs), len(buffer))
+                buffer.clear()
+
+        buffer.sort(key=key)
+        if not runs:
+            # Everything fit in the budget, so there's nothing to merge
+            yield from _combine_adjacent(buffer, key, combine)
+            return
+        if buffer:
+            runs.append(_write_run(list(_combine_adjacent(buffer, key, combine)), tmp))
+            buffer.clear()
+        logger.info("merging %d runs", len(runs))
+        merged = heapq.merge(*(_read_run(path) for path in runs), key=key)
+        yield from _combine_adjacent(merged, key, combine)
+
+
+def _or_provenance(left: Tuple, right: Tuple) -> Tuple:
+    return (*left[:-1], left[-1] | right[-1])
+
+
+def _fill_missing(rows: Iterable[Tuple]) -> Iterator[Tuple]:
+    """Replace missing values (None or NaN) with empty strings, so rows can be compared."""
+    for row in rows:
+        if not all(type(value) is str for value in row[:-1]):
+            row = (*(value if isinstance(value, str) else "" for value in row[:-1]), row[-1])
+        yield row
+
+
+def iter_sorted_relations(
+    memory_budget: int,
+    columns: Sequence[str] = XREFS_COLUMNS,
+    *,
+    directory: Optional[str] = None,
+    **kwargs,
+) -> Iterator[Tuple]:
+    """Infer the relations and sort them out of core.
+
+    :param memory_budget: The approximate number of bytes of rows kept in memory
+    :param columns: The columns to sort by, which must be all of
+        :data:`chemical_roles.utils.XREFS_COLUMNS` in any order
+    :param directory: The directory in which the runs are spilled
+    :param kwargs: The filters of :func:`chemical_roles.export.utils.iter_relation_rows`
+    :yields: The values of :data:`chemical_roles.utils.XREFS_COLUMNS` and the provenance
+        flags for each unique relation, sorted by ``columns``. Missing values are
+        given as empty strings.
+    """
+    if sorted(columns) != sorted(XREFS_COLUMNS):
+        raise ValueError(f"should sort by all of {XREFS_COLUMNS}")
+    key = itemgetter(*(XREFS_COLUMNS.index(column) for column in columns))
+    rows = _fill_missing(iter_relation_rows(**kwargs))
+    yield from external_sort(rows, key, memory_budget, combine=_or_provenance, directory=directory)
+
+
+def write_sorted_relations(
+    path: str,
+    memory_budget: int,
+    *,
+    directory: Optional[str] = None,
+    **kwargs,
+) -> int:
+    """Infer the relations and write them to a file, sorted and deduplicated out of core.
+
+    :param path: The path of the file
+    :param memory_budget: The approximate number of bytes of rows kept in memory
+    :param directory: The directory in which the runs are spilled
+    :param kwargs: The filters of :func:`chemical_roles.export.utils.iter_relation_rows`
+    :returns: The number of relations written, which are read back with
+        :func:`read_sorted_relations`
+    """
+    with open(path, "wb") as file:
+        return _dump_rows(
+            iter_sorted_relations(memory_budget, RELATIONS_COLUMNS, directory=directory, **kwargs),
+            file,
+        )
+
+
+def read_sorted_relations(path: str) -> Iterator[Tuple]:
+    """Read the relations written by :func:`write_sorted_relations`, a chunk at a time.
+
+    :yields: The values of :data:`chemical_roles.utils.XREFS_COLUMNS` and the provenance
+        flags for each relation, sorted by :data:`RELATIONS_COLUMNS`. Missing values are
+        given as empty strings.
+    """
+    yield from _read_run(path)
+
+
+def read_relations_df(path: str) -> pd.DataFrame:
+    """Load the relations written by :func:`write_sorted_relations` into a dataframe.
+
+    :returns: The same table as :func:`chemical_roles.export.utils.infer_relations_df`
+        gives, sorted by :data:`chemical_roles.utils.XREFS_COLUMNS`
+    """
+    df = pd.DataFrame(read_sorted_relations(path), columns=[*XREFS_COLUMNS, PROVENANCE_COLUMN])
+    df[XREFS_COLUMNS] = df[XREFS_COLUMNS].replace("", None)
+    df[PROVENANCE_COLUMN] = df[PROVENANCE_COLUMN].astype(np.uint8)
+    return df.sort_values(XREFS_COLUMNS, ignore_index=True)
+
+
+def write_relations_tsvs(
+    path: str,
+    slim_path: str,
+    memory_budget: int,
+    *,
+    directory: Optional[str] = None,
+    rows: Optional[Iterable[Tuple]] = None,
+    **kwargs,
+) -> Summary:
+    """Write the full and slim relations TSVs out of core.
+
+    The output is the same as :func:`chemical_roles.export.build.write_export` writes
+    from the in-memory table, except that rows with missing values might be ordered
+    differently.
+
+    :param path: The path of the full TSV
+    :param slim_path: The path of the slim TSV
+    :param memory_budget: The approximate number of bytes of rows kept in memory
+    :param directory: The directory in which the runs are spilled
+    :param rows: The relations, already sorted by :data:`RELATIONS_COLUMNS`, like from
+        :func:`read_sorted_relations`. If not given, they're inferred and sorted here.
+    :param kwargs: The filters of :func:`chemical_roles.export.utils.iter_relation_rows`,
+        like ``use_sub_roles``
+    :returns: The summary of the relations
+    """
+    if rows is None:
+        rows = iter_sorted_relations(
+            memory_budget, RELATIONS_COLUMNS, directory=directory, **kwargs
+        )
+    counts: Counter = Counter()
+    summary_getter = itemgetter(*(XREFS_COLUMNS.index(column) for column in SUMMARY_KEYS))
+    full_getter = itemgetter(*(XREFS_COLUMNS.index(column) for column in RELATIONS_COLUMNS))
+    enrich_getter = itemgetter(*(XREFS_COLUMNS.index(column) for column in ENRICHMENT_KEYS))
+    enrich = get_row_enricher()
+    slim_getter = itemgetter(*(XREFS_COLUMNS.index(column) for column in RELATIONS_SLIM_COLUMNS))
+
+    def _write_full() -> Iterator[Tuple]:
+        """Write the full TSV while passing on the slim rows to be sorted."""
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+            writer.writerow([*RELATIONS_COLUMNS, *ENRICHMENT_COLUMNS])
+            for row in rows:
+                writer.writerow((*full_getter(row), *enrich(*enrich_getter(row))))
+                counts[summary_getter(row)] += 1
+                yield slim_getter(row)
+
+    with span("relations_tsv") as s:
+        # The slim rows aren't deduplicated, like in the in-memory export
+        slim_rows = external_sort(
+            _write_full(), lambda row: row, memory_budget, directory=directory
+        )
+        with open(slim_path, "w", newline="") as file:
+            writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+            writer.writerow(RELATIONS_SLIM_COLUMNS)
+            writer.writerows(slim_rows)
+        s.count("rows", sum(counts.values()))
+
+    return get_summary_from_counts(
+        {tuple(value or None for value in key): count for key, count in counts.items()}
+    )
@@ -2,29 +2,42 @@
 
 """Export to OBO."""
 
+import gzip
+import json
+from datetime import datetime
 from typing import Iterable, Mapping, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 from pyobo import Obo, Reference, Term, TypeDef
 from tqdm import tqdm
 
 from .utils import get_relations_df
+from ..utils import XREFS_COLUMNS
 
 __all__ = [
     "get_obo",
+    "write_obo",
+    "write_obonet_gz",
 ]
 
+ONTOLOGY = "crog"
+NAME = "Chemical Roles Graph"
+FORMAT_VERSION = "1.2"
+DATE_FORMAT = "%d:%m:%Y %H:%M"
+
 
 def get_obo() -> Obo:
     """Get Chemical Roles as OBO."""
     return Obo(
-        name="Chemical Roles Graph",
-        ontology="crog",
+        name=NAME,
+        ontology=ONTOLOGY,
         iter_terms=iter_terms,
     )
 
 
 def iter_terms() -> Iterable[Term]:
-    df = get_relations_df()
+    df = get_relations_df()[XREFS_COLUMNS]
     it = tqdm(df.dropna().values, total=len(df.index), desc="mapping to OBO", unit_scale=True)
     ref_term = {}
     for (
@@ -72,3 +85,167 @@ def _get_typedef(target_db, target_type, modulation) -> Optional[TypeDef]:
     if t not in _logged:
         _logged.add(t)
         tqdm.write(f"no strategy for: {target_db} {target_type} {modulation}")
+
+
+_TYPEDEF_KEYS = ["target_db", "target_type", "modulation"]
+
+
+def _get_typedef_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        [
+            (*key, typedef.curie, typedef.reference.name or typedef.reference.identifier)
+            for key, typedef in _typedefs.items()
+        ],
+        columns=[*_TYPEDEF_KEYS, "typedef", "typedef_name"],
+    )
+
+
+def get_obo_relations_df(df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Get the OBO relationships for a relations table, grouped by source term.
+
+    :param df: A relations dataframe, sorted by source. Defaults to :func:`get_relations_df`.
+    :returns: A dataframe with one row per relationship, whose columns are the
+        source term's CURIE and name, the typedef's CURIE and name, and the
+        target's CURIE. The ``term`` column gives the position of the source
+        term, in order of first appearance.
+    """
+    if df is None:
+        df = get_relations_df()
+    # Only the relations' own columns are required, since the table might be enriched
+    df = df[XREFS_COLUMNS].dropna()
+
+    # Look up the typedefs for all rows at once by joining on the key
+    df = df.merge(_get_typedef_df(), how="left", on=_TYPEDEF_KEYS, sort=False)
+    missing = df.loc[df["typedef"].isna(), _TYPEDEF_KEYS].drop_duplicates()
+    for target_db, target_type, modulation in missing.values:
+        if (target_db, target_type, modulation) not in _logged:
+            _logged.add((target_db, target_type, modulation))
+            tqdm.write(f"no strategy for: {target_db} {target_type} {modulation}")
+    df = df[df["typedef"].notna()]
+
+    rv = pd.DataFrame(
+        {
+            "source": df["source_db"].str.upper() + ":" + df["source_id"],
+            "source_name": df["source_name"],
+            "typedef": df["typedef"],
+            "typedef_name": df["typedef_name"],
+            "target": df["target_db"].str.upper() + ":" + df["target_id"],
+        }
+    )
+    # Terms are identified by their CURIE and name, numbered in order of first appearance
+    rv["term"] = rv.groupby(["source", "source_name"], sort=False).ngroup()
+    return rv.reset_index(drop=True)
+
+
+def _iter_groups(df: pd.DataFrame) -> Iterable[Tuple[int, int]]:
+    """Iterate over the start and end positions of each term in a sorted relationships dataframe."""
+    terms = df["term"].values
+    if not len(terms):
+        return
+    starts = np.flatnonzero(np.r_[True, terms[1:] != terms[:-1]])
+    ends = np.r_[starts[1:], len(terms)]
+    yield from zip(starts.tolist(), ends.tolist())
+
+
+def _iter_header_lines(date: str) -> Iterable[str]:
+    yield f"format-version: {FORMAT_VERSION}"
+    yield f"date: {date}"
+    yield f"ontology: {ONTOLOGY}"
+
+
+def write_obo(
+    path: str, df: Optional[pd.DataFrame] = None, date: Optional[datetime] = None
+) -> None:
+    """Write the OBO export incrementally, one ``[Term]`` stanza at a time.
+
+    :param path: The path to write to
+    :param df: A relations dataframe, sorted by source. Defaults to :func:`get_relations_df`.
+    :param date: The date to put in the header. Defaults to now.
+    """
+    rels = get_obo_relations_df(df)
+    # Within a term, relationships are ordered by their typedef's name
+    rels = rels.sort_values(["term", "typedef_name"], kind="mergesort")
+
+    sources, names, typedefs, targets = (
+        rels[column].values for column in ("source", "source_name", "typedef", "target")
+    )
+    with open(path, "w") as file:
+        for line in _iter_header_lines((date or datetime.now()).strftime(DATE_FORMAT)):
+            print(line, file=file)
+        it = tqdm(_iter_groups(rels), desc="writing OBO", unit_scale=True, unit="term")
+        for start, end in it:
+            print("\n[Term]", file=file)
+            print(f"id: {sources[start]}", file=file)
+            if names[start]:
+                print(f"name: {names[start]}", file=file)
+            for typedef, target in zip(typedefs[start:end], targets[start:end]):
+                print(f"relationship: {typedef} {target}", file=file)
+
+
+def write_obonet_gz(
+    path: str, df: Optional[pd.DataFrame] = None, date: Optional[datetime] = None
+) -> None:
+    """Write the OBO export as gzipped node-link JSON in the :mod:`obonet` style, incrementally.
+
+    :param path: The path to write to
+    :param df: A relations dataframe, sorted by source. Defaults to :func:`get_relations_df`.
+    :param date: The date to put in the graph's metadata. Defaults to now.
+    """
+    rels = get_obo_relations_df(df)
+    # Within a term, relationships are grouped by typedef in order of first appearance
+    rels["typedef_rank"] = rels.groupby(["term", "typedef"], sort=False).ngroup()
+    rels = rels.sort_values(["term", "typedef_rank"], kind="mergesort")
+
+    graph = {
+        "name": NAME,
+        "ontology": ONTOLOGY,
+        "auto-generated-by": None,
+        "typedefs": [],
+        "format-version": FORMAT_VERSION,
+        "data-version": None,
+        "synonymtypedef": [],
+        "date": (date or datetime.now()).strftime(DATE_FORMAT),
+    }
+
+    sources, names, typedefs, targets = (
+        rels[column].values for column in ("source", "source_name", "typedef", "target")
+    )
+    groups = list(_iter_groups(rels))
+    # Targets that aren't terms themselves are added as bare nodes after the terms
+    term_ids = set(sources[start] for start, _ in groups)
+    target_ids = [target for target in pd.unique(targets) if target not in term_ids]
+
+    # Links are unique on source, target, and key, grouped by target in order of first appearance
+    links = rels[["term", "source", "target", "typedef"]].drop_duplicates(
+        ["source", "target", "typedef"]
+    )
+    links["target_rank"] = links.groupby(["term", "target"], sort=False).ngroup()
+    links = links.sort_values(["term", "target_rank"], kind="mergesort")
+
+    with gzip.open(path, "wt") as file:
+        file.write('{"directed": true, "multigraph": true, "graph": ')
+        file.write(json.dumps(graph))
+        file.write(', "nodes": [')
+        first = True
+        for start, end in groups:
+            node = {"id": sources[start]}
+            if names[start]:
+                node["name"] = names[start]
+            node["relationship"] = [
+                f"{typedef} {target}"
+                for typedef, target in zip(typedefs[start:end], targets[start:end])
+            ]
+            file.write(("" if first else ", ") + json.dumps(node))
+            first = False
+        for target in target_ids:
+            file.write(("" if first else ", ") + json.dumps({"id": target}))
+            first = False
+        file.write('], "links": [')
+        first = True
+        for source, target, key in links[["source", "target", "typedef"]].values:
+            file.write(
+                ("" if first else ", ")
+                + json.dumps({"source": source, "target": target, "key": key})
+            )
+            first = False
+        file.write("]}")
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""Export the relations as columnar Parquet datasets.
+
+The full and slim tables are each written as a hive-partitioned dataset, e.g.,
+``relations.parquet/modulation=inhibitor/target_db=hgnc/part-0.parquet``, so
+consumers can prune partitions and push down filters on the remaining columns
+using the row-group statistics::
+
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset("relations.parquet", format="parquet", partitioning="hive")
+    table = dataset.to_table(
+        filter=(ds.field("modulation") == "inhibitor") & (ds.field("target_db") == "hgnc"),
+    )
+
+The datasets can also be written out of core from the relations sorted by
+:func:`chemical_roles.export.external.write_sorted_relations`, in which case the
+rows of each dataset are sorted again within a memory budget then written in
+batches of a row group.
+"""
+
+import logging
+import os
+import shutil
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from .enrich import ENRICHMENT_COLUMNS, enrich_relations_df, get_row_enricher
+from .provenance import PROVENANCE_COLUMN
+from .utils import get_relations_df
+from ..utils import XREFS_COLUMNS
+
+__all__ = [
+    "PARTITION_COLUMNS",
+    "RELATIONS_PARQUET_NAME",
+    "RELATIONS_SLIM_PARQUET_NAME",
+    "write_parquet",
+    "write_parquet_dataset",
+    "write_parquet_dataset_batches",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The columns on which the datasets are partitioned, in order of the directory hierarchy
+PARTITION_COLUMNS = ["modulation", "target_db"]
+
+#: The columns of the full table, the same as in ``relations.tsv`` plus the provenance bitmask
+COLUMNS = [
+    "modulation",
+    "target_type",
+    "source_db",
+    "source_id",
+    "source_name",
+    "target_db",
+    "target_id",
+    "target_name",
+    PROVENANCE_COLUMN,
+    *ENRICHMENT_COLUMNS,
+]
+#: The columns of the slim table, the same as in ``relations_slim.tsv``
+SLIM_COLUMNS = ["source_db", "source_id", "modulation", "target_db", "target_id"]
+
+#: The name of the full dataset's directory
+RELATIONS_PARQUET_NAME = "relations.parquet"
+#: The name of the slim dataset's directory
+RELATIONS_SLIM_PARQUET_NAME = "relations_slim.parquet"
+
+
+def _get_sort_columns(columns: Sequence[str]) -> List[str]:
+    # Sort within partitions so the row group statistics on the identifiers are selective
+    return [*PARTITION_COLUMNS, *(c for c in columns if c not in PARTITION_COLUMNS)]
+
+
+def _is_dictionary_column(column: str) -> bool:
+    """Is a column low cardinality, so it's dictionary-encoded in the Arrow schema?"""
+    return column not in PARTITION_COLUMNS and not column.endswith(("_id", "_name"))
+
+
+def _get_type(column: str):
+    import pyarrow as pa
+
+    if column == PROVENANCE_COLUMN:
+        return pa.uint8()
+    if _is_dictionary_column(column):
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def write_parquet_dataset(
+    df: pd.DataFrame,
+    path: str,
+    columns: Sequence[str],
+    *,
+    compression: str = "zstd",
+    row_group_size: int = 100_000,
+) -> None:
+    """Write a relations dataframe as a partitioned, dictionary-encoded Parquet dataset.
+
+    :param df: A relations dataframe
+    :param path: The directory in which the dataset is written. It's replaced if it already exists.
+    :param columns: The columns to write, which must include :data:`PARTITION_COLUMNS`
+    :param compression: The Parquet compression codec
+    :param row_group_size: The maximum number of rows per row group. Each row
+        group keeps min/max statistics so readers can skip ones that don't match a filter.
+    """
+    import pyarrow as pa
+
+    df = df[list(columns)].sort_values(_get_sort_columns(columns)).reset_index(drop=True)
+
+    # Dictionary-encode the low cardinality columns in the Arrow schema so readers get
+    # categoricals back, and Parquet's own dictionary encoding handles the rest
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in columns:
+        if pa.types.is_string(table.schema.field(column).type) and _is_dictionary_column(column):
+            i = table.schema.get_field_index(column)
+            table = table.set_column(i, column, table.column(column).dictionary_encode())
+
+    _write_dataset(table, path, schema=None, compression=compression, row_group_size=row_group_size)
+
+
+def write_parquet_dataset_batches(
+    rows: Iterable[Tuple],
+    path: str,
+    columns: Sequence[str],
+    *,
+    compression: str = "zstd",
+    row_group_size: int = 100_000,
+) -> None:
+    """Write rows that are streamed in order as a partitioned Parquet dataset.
+
+    The dataset has the same schema as :func:`write_parquet_dataset` writes, except
+    that a column whose values are all missing is still typed as a string.
+
+    :param rows: The values of ``columns`` for each relation, sorted like
+        :func:`write_parquet_dataset` sorts them. Missing values are empty strings.
+    :param path: The directory in which the dataset is written. It's replaced if it already exists.
+    :param columns: The columns to write, which must include :data:`PARTITION_COLUMNS`
+    :param compression: The Parquet compression codec
+    :param row_group_size: The number of rows converted at once, which is also the
+        maximum number of rows per row group
+    """
+    import pyarrow as pa
+
+    from .external import iter_chunks
+
+    schema = pa.schema([(column, _get_type(column)) for column in columns])
+
+    def _iter_batches() -> Iterator["pa.RecordBatch"]:
+        for chunk in iter_chunks(rows, row_group_size):
+            yield pa.RecordBatch.from_arrays(
+                [
+                    pa.array(
+                        values if field.name == PROVENANCE_COLUMN else [v or None for v in values],
+                        type=field.type,
+                    )
+                    for field, values in zip(schema, zip(*chunk))
+                ],
+                schema=schema,
+            )
+
+    _write_dataset(
+        _iter_batches(),
+        path,
+        schema=schema,
+        compression=compression,
+        row_group_size=row_group_size,
+    )
+
+
+def _write_dataset(data, path: str, *, schema, compression: str, row_group_size: int) -> None:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Remove stale partitions, e.g., for a modulation that no longer appears
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        data,
+        base_dir=path,
+        schema=schema,
+        format=file_format,
+        partitioning=ds.partitioning(
+            pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]),
+            flavor="hive",
+        ),
+        basename_template="part-{i}.parquet",
+        max_rows_per_group=row_group_size,
+        file_options=file_format.make_write_options(
+            compression=compression,
+            use_dictionary=True,
+            write_statistics=True,
+        ),
+    )
+
+
+def write_parquet(
+    directory: str,
+    df: Optional[pd.DataFrame] = None,
+    *,
+    relations_path: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+    spill_directory: Optional[str] = None,
+) -> List[str]:
+    """Write the full and slim relations tables as Parquet datasets.
+
+    :param directory: The directory in which the datasets' directories are made
+    :param df: A relations dataframe. Defaults to :func:`get_relations_df`. It's enriched
+        with :func:`chemical_roles.export.enrich.enrich_relations_df` if it isn't already.
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`, instead
+    :param memory_budget: The approximate number of bytes of rows kept in memory while
+        sorting the streamed relations, which is required with ``relations_path``
+    :param spill_directory: The directory in which the sorted runs are spilled
+    :returns: The paths of the datasets' directories
+    """
+    if relations_path is not None:
+        if memory_budget is None:
+            raise ValueError("a memory budget is needed to stream the relations")
+        return _write_parquet_out_of_core(
+            directory, relations_path, memory_budget, spill_directory=spill_directory
+        )
+
+    if df is None:
+        df = get_relations_df()
+    df = enrich_relations_df(df)
+
+    rv = []
+    for name, columns in [
+        (RELATIONS_PARQUET_NAME, COLUMNS),
+        (RELATIONS_SLIM_PARQUET_NAME, SLIM_COLUMNS),
+    ]:
+        path = os.path.join(directory, name)
+        logger.info("writing %s rows to %s", len(df.index), path)
+        write_parquet_dataset(df, path, columns)
+        rv.append(path)
+    return rv
+
+
+def _write_parquet_out_of_core(
+    directory: str,
+    relations_path: str,
+    memory_budget: int,
+    *,
+    spill_directory: Optional[str] = None,
+) -> List[str]:
+    from .external import ENRICHMENT_KEYS, external_sort, read_sorted_relations
+
+    enrich = get_row_enricher()
+    enrich_getter = itemgetter(*(XREFS_COLUMNS.index(column) for column in ENRICHMENT_KEYS))
+    layout = [*XREFS_COLUMNS, PROVENANCE_COLUMN, *ENRICHMENT_COLUMNS]
+
+    rv = []
+    for name, columns in [
+        (RELATIONS_PARQUET_NAME, COLUMNS),
+        (RELATIONS_SLIM_PARQUET_NAME, SLIM_COLUMNS),
+    ]:
+        path = os.path.join(directory, name)
+        sort_columns = _get_sort_columns(columns)
+        sort_getter = itemgetter(*(layout.index(column) for column in sort_columns))
+        # Puts the sorted rows back in the order of the columns
+        column_getter = itemgetter(*(sort_columns.index(column) for column in columns))
+        use_enrichment = any(column in ENRICHMENT_COLUMNS for column in columns)
+
+        def _iter_rows() -> Iterator[Tuple]:
+            for row in read_sorted_relations(relations_path):
+                if use_enrichment:
+                    row = (*row, *enrich(*enrich_getter(row)))
+                yield sort_getter(row)
+
+        logger.info("writing relations to %s out of core", path)
+        rows = external_sort(
+            _iter_rows(), lambda row: row, memory_budget, directory=spill_directory
+        )
+        write_parquet_dataset_batches(map(column_getter, rows), path, columns)
+        rv.append(path)
+    return rv
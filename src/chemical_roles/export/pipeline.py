@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+
+"""Orchestrate the export stages as a dependency graph.
+
+The stages form the following graph, where the relations table is computed
+once then shared with each of the exporters that depend on it::
+
+    xrefs.tsv ──┬──────────────────────────────┐
+                └─> relations ──┬──> obo       │
+    upstream ───────┤           ├──> bel <─────┘
+    inference ──────┘           ├──> sqlite
+                                ├──> triples
+                                └─> enrich ──┬──> summary
+    crosswalks ─────────────────────┘        └──> parquet
+
+Each stage declares its inputs as named fingerprints (the hash of ``xrefs.tsv``,
+the upstream resource versions, the other inputs to inference like FamPlex and the
+version of the inference rules, the relations table derived from all of them, and
+the hash of the crosswalks joined by :mod:`chemical_roles.export.enrich`) and its
+outputs as files under ``docs/``. The BEL stage writes both the BEL and the INDRA
+exports from one pass over the relations. A manifest of these content hashes is
+kept in :data:`chemical_roles.constants.EXPORT_MANIFEST_PATH` so stages whose
+inputs and outputs are unchanged can be skipped.
+
+With a memory budget, the relations are instead sorted out of core into a file by
+:func:`chemical_roles.export.external.write_sorted_relations`, which the summary,
+Parquet, SQLite, and triples stages stream from, each with its share of the budget.
+The OBO and BEL stages build graphs of all of the relations, so they still load
+them into memory, but from the sorted file instead of inferring them again.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from ..constants import (
+    DATA,
+    DOCS,
+    EXPORT_MANIFEST_PATH,
+    IMG,
+    MAX_GO_FANOUT,
+    RELATIONS_OUTPUT_NAME,
+    RELATIONS_SLIM_OUTPUT_NAME,
+    ROOT,
+)
+from ..instrument import get_recorder, recording, span
+from ..resources import XREFS_PATH
+from ..utils import hash_file
+
+__all__ = [
+    "Stage",
+    "STAGES",
+    "run_stages",
+    "write_summary",
+    "write_obo",
+    "write_bel",
+    "write_indra",
+    "write_bel_and_indra",
+    "write_parquet",
+    "write_sqlite",
+    "write_triples",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def write_summary(
+    directory: str = DATA,
+    memory_budget: Optional[int] = None,
+    *,
+    relations_path: Optional[str] = None,
+    use_sub_roles: bool = False,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> None:
+    """Rewrite the readme and generate the summary exports.
+
+    The charts are rendered in background processes while the TSVs are written.
+
+    :param directory: The directory the relations and summary TSVs are written to. The
+        readme, the docs' index, and the charts are always written to the docs.
+    :param memory_budget: If given, the relations TSVs are written out of core,
+        keeping about this many bytes of relations in memory
+    :param relations_path: If given with a memory budget, the relations are streamed
+        from this file, written by
+        :func:`chemical_roles.export.external.write_sorted_relations`
+    :param use_sub_roles: Should the chemicals with descendant roles be included?
+    :param propagate_go: Should the GO targets be propagated over the GO hierarchy?
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    """
+    from .build import rewrite_repo_readme, write_export
+
+    # Daemonic workers (e.g., on Python 3.8) can't start their own processes
+    if multiprocessing.current_process().daemon:
+        with span("readme"):
+            rewrite_repo_readme(directory=directory)
+        with span("summary"):
+            write_export(
+                memory_budget=memory_budget,
+                use_sub_roles=use_sub_roles,
+                propagate_go=propagate_go,
+                max_go_fanout=max_go_fanout,
+                directory=directory,
+                relations_path=relations_path,
+            )
+        return
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        with span("readme"):
+            readme_future = rewrite_repo_readme(executor=executor, directory=directory)
+        with span("summary"):
+            summary_future = write_export(
+                executor=executor,
+                memory_budget=memory_budget,
+                use_sub_roles=use_sub_roles,
+                propagate_go=propagate_go,
+                max_go_fanout=max_go_fanout,
+                directory=directory,
+                relations_path=relations_path,
+            )
+        with span("plots"):
+            for future in (readme_future, summary_future):
+                if future is not None:
+                    future.result()
+
+
+def write_obo(directory: str = DATA) -> None:
+    """Write the OBO and OBO Graph JSON exports."""
+    from .obo import write_obo as _write_obo
+    from .obo import write_obonet_gz
+
+    with span("obo"):
+        _write_obo(os.path.join(directory, "crog.obo"))
+    with span("obonet"):
+        write_obonet_gz(os.path.join(directory, "crog.obonet.json.gz"))
+
+
+def write_bel(directory: str = DATA) -> None:
+    """Write the BEL export."""
+    from .bel import write_bel_nodelink_gz
+
+    with span("bel"):
+        write_bel_nodelink_gz(os.path.join(directory, "crog.bel.nodelink.json.gz"))
+
+
+def write_indra(directory: str = DATA) -> None:
+    """Write the INDRA export."""
+    from .bel import write_indra_statements_json
+
+    with span("indra"):
+        write_indra_statements_json(os.path.join(directory, "crog.indra.json"))
+
+
+def write_bel_and_indra(directory: str = DATA) -> None:
+    """Write the BEL and INDRA exports from one pass over the relations."""
+    from .bel import write_bel_and_indra as _write_bel_and_indra
+
+    with span("bel"):
+        _write_bel_and_indra(
+            os.path.join(directory, "crog.bel.nodelink.json.gz"),
+            os.path.join(directory, "crog.indra.json"),
+        )
+
+
+def write_parquet(
+    directory: str = DATA,
+    *,
+    relations_path: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Write the full and slim relations tables as partitioned Parquet datasets.
+
+    :param directory: The directory the datasets are written to
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`
+    :param memory_budget: The approximate number of bytes of streamed relations to
+        keep in memory while they're sorted for each dataset
+    """
+    from .parquet import write_parquet as _write_parquet
+
+    with span("parquet"):
+        _write_parquet(directory, relations_path=relations_path, memory_budget=memory_budget)
+
+
+def write_sqlite(
+    directory: str = DATA,
+    *,
+    relations_path: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Write the curated and inferred relations as an indexed SQLite database.
+
+    :param directory: The directory the database is written to
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`
+    :param memory_budget: The approximate number of bytes of streamed relations to
+        keep in memory while they're sorted by their normalized identifiers
+    """
+    from .sqlite import write_sqlite as _write_sqlite
+
+    with span("sqlite"):
+        _write_sqlite(
+            os.path.join(directory, "crog.sqlite"),
+            relations_path=relations_path,
+            memory_budget=memory_budget,
+        )
+
+
+def write_triples(
+    directory: str = DATA,
+    *,
+    relations_path: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Write the relations as integer triples with seeded splits.
+
+    :param directory: The directory the triples' directory is made in
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`
+    :param memory_budget: Not used, since only the integer triples of the streamed
+        relations are kept in memory
+    """
+    from .triples import write_triples as _write_triples
+
+    with span("triples"):
+        _write_triples(os.path.join(directory, "triples"), relations_path=relations_path)
+
+
+class Stage(NamedTuple):
+    """An export stage in the build graph."""
+
+    #: The name of the stage
+    name: str
+    #: A function that takes the output directory and writes the stage's outputs
+    func: Callable[[str], None]
+    #: The names of the fingerprints this stage depends on
+    inputs: Tuple[str, ...]
+    #: A function that takes the output directory and returns the paths written
+    outputs: Callable[[str], List[str]]
+    #: Can the stage stream the sorted relations, in which case its function also
+    #: takes the ``relations_path`` and ``memory_budget`` keywords?
+    streams: bool = False
+
+
+def _summary_outputs(directory: str) -> List[str]:
+    rv = [
+        os.path.join(directory, RELATIONS_OUTPUT_NAME),
+        os.path.join(directory, RELATIONS_SLIM_OUTPUT_NAME),
+        os.path.join(DOCS, "index.md"),
+        os.path.join(ROOT, "README.rst"),
+    ]
+    for prefix in ("curated", "inferred"):
+        rv.append(os.path.join(directory, f"{prefix}_summary.tsv"))
+        for key in ("modulation", "namespace", "type"):
+            rv.append(os.path.join(directory, f"{prefix}_summary_by_{key}.tsv"))
+        rv.append(os.path.join(IMG, f"{prefix}_summary.png"))
+        rv.append(os.path.join(IMG, f"{prefix}_summary.svg"))
+    return rv
+
+
+def _outputs(*names: str) -> Callable[[str], List[str]]:
+    def _get(directory: str) -> List[str]:
+        return [os.path.join(directory, name) for name in names]
+
+    return _get
+
+
+def _dataset_outputs(*names: str) -> Callable[[str], List[str]]:
+    """Get the files in dataset directories, whose partitions depend on the data."""
+
+    def _get(directory: str) -> List[str]:
+        return sorted(
+            os.path.join(root, filename)
+            for name in names
+            for root, _, filenames in os.walk(os.path.join(directory, name))
+            for filename in filenames
+        )
+
+    return _get
+
+
+#: The stages of the export, in an order compatible with their dependencies
+STAGES: Sequence[Stage] = [
+    Stage(
+        "summary",
+        write_summary,
+        ("xrefs", "relations", "crosswalks"),
+        _summary_outputs,
+        streams=True,
+    ),
+    Stage("obo", write_obo, ("relations",), _outputs("crog.obo", "crog.obonet.json.gz")),
+    Stage(
+        "bel",
+        write_bel_and_indra,
+        ("xrefs", "relations"),
+        _outputs("crog.bel.nodelink.json.gz", "crog.indra.json"),
+    ),
+    Stage(
+        "parquet",
+        write_parquet,
+        ("relations", "crosswalks"),
+        _dataset_outputs("relations.parquet", "relations_slim.parquet"),
+        streams=True,
+    ),
+    Stage("sqlite", write_sqlite, ("xrefs", "relations"), _outputs("crog.sqlite"), streams=True),
+    Stage(
+        "triples",
+        write_triples,
+        ("relations",),
+        _outputs(
+            *(
+                os.path.join("triples", name)
+                for name in (
+                    "entity_to_id.tsv",
+                    "relation_to_id.tsv",
+                    "triples.npy",
+                    "train.npy",
+                    "validation.npy",
+                    "test.npy",
+                    "splits.json",
+                )
+            )
+        ),
+        streams=True,
+    ),
+]
+
+
+def _hash_json(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_fingerprints(
+    use_sub_roles: bool = False,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> Dict[str, Optional[str]]:
+    """Get the fingerprints for each of the stages' possible inputs.
+
+    A fingerprint is None when it can't be determined, in which case the
+    stages that depend on it are never skipped.
+
+    :param use_sub_roles: Are the chemicals with descendant roles included in the relations?
+    :param propagate_go: Are the GO targets propagated over the GO hierarchy?
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    """
+    from .enrich import get_crosswalks_hash
+    from .utils import get_inference_versions, get_upstream_versions
+
+    versions = get_upstream_versions()
+    # FamPlex is refreshed first, so a change to it is picked up by the export
+    inference_versions = get_inference_versions(refresh=True)
+    rv = {
+        "xrefs": hash_file(XREFS_PATH),
+        "upstream": None if None in versions.values() else _hash_json(versions),
+        "inference": (
+            None if None in inference_versions.values() else _hash_json(inference_versions)
+        ),
+        "crosswalks": get_crosswalks_hash(),
+    }
+    # The relations table is determined by the curated xrefs, the upstream resources,
+    # the other inputs to inference, and the options it's run with
+    inputs = [rv["xrefs"], rv["upstream"], rv["inference"]]
+    options = {
+        "use_sub_roles": use_sub_roles,
+        "propagate_go": propagate_go,
+        # The fan-out only matters when GO targets are propagated
+        "max_go_fanout": max_go_fanout if propagate_go else None,
+    }
+    rv["relations"] = None if None in inputs else _hash_json([*inputs, options])
+    return rv
+
+
+def _read_manifest(path: str) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _is_fresh(stage: Stage, inputs: Mapping[str, Optional[str]], record, directory: str) -> bool:
+    if not record or any(v is None for v in inputs.values()) or record["inputs"] != inputs:
+        return False
+    outputs = {os.path.relpath(path, ROOT): path for path in stage.outputs(directory)}
+    if set(outputs) != set(record["outputs"]):
+        return False
+    return all(
+        os.path.exists(path) and hash_file(path) == record["outputs"][key]
+        for key, path in outputs.items()
+    )
+
+
+#: The path of the relations table a worker process has already loaded
+_loaded_relations_path: Optional[str] = None
+
+
+def _run_stage(
+    name: str,
+    directory: str,
+    relations_path: Optional[str],
+    trace_memory: Optional[bool] = None,
+    memory_budget: Optional[int] = None,
+) -> Tuple[str, List[Dict]]:
+    """Run a stage in a worker, loading the shared relations table on first use.
+
+    :param relations_path: The path of the relations, pickled as a dataframe, or sorted
+        by :func:`chemical_roles.export.external.write_sorted_relations` if there's
+        a memory budget
+    :param memory_budget: The stage's share of the memory budget, if there is one
+    :returns: The name of the stage and, if ``trace_memory`` isn't None, the spans
+        recorded while running it
+    """
+    if trace_memory is None:
+        return _run_stage_inner(name, directory, relations_path, memory_budget), []
+    with recording(trace_memory=trace_memory) as recorder:
+        with span(f"stage:{name}"):
+            _run_stage_inner(name, directory, relations_path, memory_budget)
+    return name, recorder.spans
+
+
+def _run_stage_inner(
+    name: str,
+    directory: str,
+    relations_path: Optional[str],
+    memory_budget: Optional[int],
+) -> str:
+    global _loaded_relations_path
+    stage = next(stage for stage in STAGES if stage.name == name)
+    if relations_path is not None and memory_budget is not None and stage.streams:
+        stage.func(directory, relations_path=relations_path, memory_budget=memory_budget)
+        return name
+    if relations_path is not None and relations_path != _loaded_relations_path:
+        from .utils import preload_relations_df
+
+        # The exporters get the relations with the default options from get_relations_df(),
+        # so the table the pipeline computed is registered as the default
+        with span("load_relations"):
+            if memory_budget is None:
+                with open(relations_path, "rb") as file:
+                    df = pickle.load(file)
+            else:
+                from .external import read_relations_df
+
+                df = read_relations_df(relations_path)
+            preload_relations_df(df)
+        _loaded_relations_path = relations_path
+    stage.func(directory)
+    return name
+
+
+def run_stages(
+    directory: str = DATA,
+    *,
+    force: bool = False,
+    max_workers: Optional[int] = None,
+    manifest_path: str = EXPORT_MANIFEST_PATH,
+    memory_budget: Optional[int] = None,
+    use_sub_roles: bool = False,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> List[str]:
+    """Run the stages whose inputs or outputs changed since the last run.
+
+    :param directory: The directory in which the relations and summary TSVs and the OBO,
+        BEL, INDRA, Parquet, SQLite, and triples exports are written
+    :param force: Should all stages be run, even if they're unchanged?
+    :param max_workers: The number of worker processes. Defaults to the number of CPUs.
+    :param manifest_path: The path to the manifest of content hashes
+    :param memory_budget: If given, the relations are inferred and sorted out of core,
+        then streamed to the stages that can stream them, which split the budget between
+        the ones that run at the same time. The OBO and BEL stages still load all of
+        the relations into memory.
+    :param use_sub_roles: Should the chemicals with descendant roles be included?
+    :param propagate_go: Should the GO targets be propagated over the GO hierarchy? See
+        :func:`chemical_roles.export.utils.infer_relations_df`.
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    :returns: The names of the stages that were run
+    """
+    manifest = _read_manifest(manifest_path)
+    relations_options = {
+        "use_sub_roles": use_sub_roles,
+        "propagate_go": propagate_go,
+        "max_go_fanout": max_go_fanout,
+    }
+    fingerprints = get_fingerprints(**relations_options)
+    stage_inputs = {
+        stage.name: {key: fingerprints[key] for key in stage.inputs} for stage in STAGES
+    }
+
+    stages = []
+    for stage in STAGES:
+        if not force and _is_fresh(
+            stage, stage_inputs[stage.name], manifest.get(stage.name), directory
+        ):
+            logger.info("skipping unchanged stage: %s", stage.name)
+        else:
+            stages.append(stage)
+    if not stages:
+        return []
+
+    # Workers record their own spans, which are sent back to this process's recorder
+    recorder = get_recorder()
+    trace_memory = None if recorder is None else recorder.trace_memory
+
+    stage_memory_budget = None
+    if memory_budget is not None:
+        n_streaming = sum(stage.streams for stage in stages)
+        n_concurrent = min(n_streaming, max_workers or os.cpu_count() or 1)
+        stage_memory_budget = memory_budget // max(1, n_concurrent)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        relations_path = None
+        if any("relations" in stage.inputs for stage in stages) and memory_budget is not None:
+            from .external import write_sorted_relations
+
+            logger.info("sorting shared relations out of core")
+            relations_path = os.path.join(tmp, "relations.run")
+            with span("relations") as s:
+                s.count(
+                    "rows",
+                    write_sorted_relations(
+                        relations_path, memory_budget, directory=tmp, **relations_options
+                    ),
+                )
+        elif any("relations" in stage.inputs for stage in stages):
+            from .utils import get_relations_df
+
+            logger.info("computing shared relations table")
+            relations_path = os.path.join(tmp, "relations.pkl")
+            with span("relations"):
+                df = get_relations_df(**relations_options)
+            if any("crosswalks" in stage.inputs for stage in stages):
+                from .enrich import enrich_relations_df
+
+                # Join the crosswalks once here instead of in each stage that writes them
+                with span("enrich", rows=len(df.index)):
+                    df = enrich_relations_df(df)
+            with span("pickle_relations", rows=len(df.index)):
+                with open(relations_path, "wb") as file:
+                    pickle.dump(df, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    _run_stage,
+                    stage.name,
+                    directory,
+                    relations_path if "relations" in stage.inputs else None,
+                    trace_memory,
+                    stage_memory_budget,
+                )
+                for stage in stages
+            ]
+            for future in as_completed(futures):
+                name, spans = future.result()
+                if recorder is not None:
+                    recorder.add(spans)
+                logger.info("finished stage: %s", name)
+
+    # Only record the manifest once every stage finished successfully
+    for stage in stages:
+        manifest[stage.name] = {
+            "inputs": stage_inputs[stage.name],
+            "outputs": {
+                os.path.relpath(path, ROOT): hash_file(path) for path in stage.outputs(directory)
+            },
+        }
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return [stage.name for stage in stages]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""Render summary charts, reusing existing images when the plotted data are unchanged.
+
+Each chart is keyed on a hash of the summary data it plots. The keys of the
+charts last written to ``docs/img/`` are kept in
+:data:`chemical_roles.constants.PLOT_CACHE_PATH`, so a chart is only rendered
+again when its data change or its images go missing.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Executor, Future
+from typing import Optional
+
+import pandas as pd
+
+from .summary import Summary
+from ..constants import IMG, PLOT_CACHE_PATH
+
+__all__ = [
+    "get_plot_key",
+    "plot_summary",
+    "submit_summary_plot",
+]
+
+logger = logging.getLogger(__name__)
+
+#: Guards the plot cache file against callbacks from concurrent renders
+_cache_lock = threading.Lock()
+
+
+def get_plot_key(summary: Summary) -> str:
+    """Hash the data plotted for a summary."""
+    h = hashlib.sha256(str(summary.total).encode("utf-8"))
+    for df in (summary.by_modulation, summary.by_type):
+        h.update(",".join(df.columns).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _get_paths(name: str, directory: str):
+    return os.path.join(directory, f"{name}.png"), os.path.join(directory, f"{name}.svg")
+
+
+def _read_cache(path: str):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _is_cached(name: str, key: str, directory: str, cache_path: str) -> bool:
+    return _read_cache(cache_path).get(name) == key and all(
+        os.path.exists(path) for path in _get_paths(name, directory)
+    )
+
+
+def _record(name: str, key: str, cache_path: str) -> None:
+    with _cache_lock:
+        cache = _read_cache(cache_path)
+        cache[name] = key
+        with open(cache_path, "w") as file:
+            json.dump(cache, file, indent=2, sort_keys=True)
+
+
+def plot_summary(summary: Summary, name: str, directory: str = IMG) -> None:
+    """Plot the modulation and target type summaries to ``<directory>/<name>.{png,svg}``."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set(font_scale=1.3, style="whitegrid")
+
+    logger.info("Plotting modulation and target type summary")
+    fig, (lax, rax) = plt.subplots(nrows=1, ncols=2, figsize=(12, 5))
+
+    modulation_summary_df = summary.by_modulation.copy()
+    modulation_summary_df["Modulation"] = modulation_summary_df["Modulation"].map(str.title)
+    g = sns.barplot(y="Modulation", x="Count", data=modulation_summary_df, ax=lax)
+    g.set_xscale("log")
+    lax.set_title(
+        f"Modulation ({summary.total} in {len(modulation_summary_df.index)} relations)",
+        fontdict={"fontweight": "bold"},
+    )
+    lax.set_ylabel("")
+
+    type_summary_df = summary.by_type.copy()
+    type_summary_df["Target Type"] = type_summary_df["Target Type"].map(str.title)
+    g = sns.barplot(y="Target Type", x="Count", data=type_summary_df, ax=rax)
+    g.set_xscale("log")
+    rax.set_title(
+        f"Target Type ({summary.total} in {len(type_summary_df.index)} types)",
+        fontdict={"fontweight": "bold"},
+    )
+    rax.set_ylabel("")
+
+    plt.tight_layout()
+    png_path, svg_path = _get_paths(name, directory)
+    plt.savefig(png_path, dpi=300)
+    plt.savefig(svg_path)
+    plt.close(fig)
+
+
+def submit_summary_plot(
+    summary: Summary,
+    name: str,
+    executor: Optional[Executor] = None,
+    directory: str = IMG,
+    cache_path: str = PLOT_CACHE_PATH,
+) -> Optional[Future]:
+    """Plot a summary unless its images are already up-to-date.
+
+    :param summary: The summary to plot
+    :param name: The name of the chart, used for the image file names
+    :param executor: An executor in which to render the chart in the background.
+        If none is given, the chart is rendered synchronously.
+    :param directory: The directory in which the images are written
+    :param cache_path: The path of the file with the keys of the charts already rendered
+    :returns: A future for the render if one was submitted to the executor
+    """
+    key = get_plot_key(summary)
+    if _is_cached(name, key, directory, cache_path):
+        logger.info("reusing unchanged %s plot", name)
+        return None
+    if executor is None:
+        plot_summary(summary, name, directory)
+        _record(name, key, cache_path)
+        return None
+
+    def _callback(f: Future) -> None:
+        if f.exception() is None:
+            _record(name, key, cache_path)
+
+    future = executor.submit(plot_summary, summary, name, directory)
+    future.add_done_callback(_callback)
+    return future
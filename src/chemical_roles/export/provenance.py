@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Provenance of the relations in the inferred table.
+
+Each row of the inferred table has a ``provenance`` column with a bitmask of
+the :class:`Provenance` flags for the ways it was produced. Rows that are
+produced in several ways are only kept once, with their flags combined, so
+curated-only, inferred-only, and per-rule views are all masks over the same
+table::
+
+    from chemical_roles.export.provenance import Provenance, filter_provenance
+    from chemical_roles.export.utils import get_relations_df
+
+    df = get_relations_df()
+    curated_df = filter_provenance(df, any_of=Provenance.CURATED)
+    famplex_df = filter_provenance(df, any_of=Provenance.FPLX_MEMBERS)
+"""
+
+import enum
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "PROVENANCE_COLUMN",
+    "Provenance",
+    "combine_provenance",
+    "filter_provenance",
+]
+
+#: The name of the column holding the provenance bitmask
+PROVENANCE_COLUMN = "provenance"
+
+
+class Provenance(enum.IntFlag):
+    """The ways a relation can be produced."""
+
+    #: The relation is in ``xrefs.tsv``
+    CURATED = 1
+    #: The source is a chemical with a curated role
+    ROLE_CLOSURE = 2
+    #: The source is a chemical with a descendant of a curated role
+    SUB_ROLES = 4
+    #: The target is a UniProt protein for an HGNC gene
+    HGNC_UNIPROT = 8
+    #: The target is an HGNC gene that's a member of a FamPlex entity
+    FPLX_MEMBERS = 16
+    #: The target is a child or member of an EC code
+    EC_CHILDREN = 32
+    #: The target is a GO molecular function for an EC code
+    EC2GO = 64
+    #: The target is a descendant or ancestor of a GO term, see
+    #: :data:`chemical_roles.export.utils.GO_DIRECTIONS`
+    GO_CLOSURE = 128
+
+
+def combine_provenance(df: pd.DataFrame, columns: Sequence[str]) -> pd.DataFrame:
+    """Keep only the first of each duplicate row, with the provenance of all of them.
+
+    :param df: A dataframe with a provenance column, sorted by ``columns`` so duplicates are adjacent
+    :param columns: The columns on which rows are duplicates
+    :returns: The deduplicated dataframe
+    """
+    if df.empty:
+        return df
+    starts = np.flatnonzero(~df.duplicated(list(columns), keep="first").values)
+    provenance = np.bitwise_or.reduceat(df[PROVENANCE_COLUMN].values, starts)
+    rv = df.iloc[starts].copy()
+    rv[PROVENANCE_COLUMN] = provenance.astype(df[PROVENANCE_COLUMN].dtype)
+    return rv
+
+
+def filter_provenance(
+    df: pd.DataFrame,
+    any_of: Optional[Provenance] = None,
+    none_of: Optional[Provenance] = None,
+) -> pd.DataFrame:
+    """Filter relations by their provenance.
+
+    :param df: A dataframe with a provenance column
+    :param any_of: If given, only keep relations with at least one of these flags
+    :param none_of: If given, only keep relations with none of these flags
+    :returns: The matching relations
+    """
+    provenance = df[PROVENANCE_COLUMN].values
+    mask = np.ones(len(provenance), dtype=bool)
+    if any_of is not None:
+        mask &= (provenance & int(any_of)) != 0
+    if none_of is not None:
+        mask &= (provenance & int(none_of)) == 0
+    return df[mask]
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+"""Export the relations as an indexed SQLite database.
+
+The database has an ``entity`` table that acts as a dictionary of CURIEs and a
+``relation`` table that refers to it, with a flag for inferred relations and their
+:class:`chemical_roles.export.provenance.Provenance` bitmask, and with covering indexes for looking up
+relations by source, by target, and by modulation. The ``relations`` view joins
+them back into the same shape as ``relations.tsv``::
+
+    import sqlite3
+
+    with sqlite3.connect("file:crog.sqlite?mode=ro", uri=True) as conn:
+        conn.execute(
+            "SELECT source_db, source_id, source_name FROM relations"
+            " WHERE target_db = ? AND target_id = ? AND modulation = ?",
+            ("hgnc", "5293", "inhibitor"),
+        ).fetchall()
+
+The database can also be written out of core from the relations sorted by
+:func:`chemical_roles.export.external.write_sorted_relations`. Then only the
+dictionary of entities is kept in memory, and the relations are inserted as
+they're streamed.
+"""
+
+import logging
+import os
+import sqlite3
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import pandas as pd
+
+from .provenance import PROVENANCE_COLUMN, Provenance, combine_provenance
+from .utils import get_relations_df
+from ..utils import normalize_curie
+
+__all__ = [
+    "SCHEMA",
+    "INDEXES",
+    "write_sqlite",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The statements that create the tables, indexes, and views
+SCHEMA = [
+    """
+    CREATE TABLE entity (
+        id INTEGER PRIMARY KEY,
+        prefix TEXT NOT NULL,
+        identifier TEXT NOT NULL,
+        name TEXT,
+        UNIQUE (prefix, identifier)
+    )
+    """,
+    """
+    CREATE TABLE relation (
+        source INTEGER NOT NULL REFERENCES entity (id),
+        modulation TEXT NOT NULL,
+        target_type TEXT NOT NULL,
+        target INTEGER NOT NULL REFERENCES entity (id),
+        inferred INTEGER NOT NULL,
+        provenance INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE VIEW relations AS
+    SELECT
+        s.prefix AS source_db,
+        s.identifier AS source_id,
+        s.name AS source_name,
+        r.modulation,
+        r.target_type,
+        t.prefix AS target_db,
+        t.identifier AS target_id,
+        t.name AS target_name,
+        r.inferred,
+        r.provenance
+    FROM relation r
+    JOIN entity s ON r.source = s.id
+    JOIN entity t ON r.target = t.id
+    """,
+]
+
+_INDEX_COLUMNS = "target_type, inferred, provenance"
+
+#: The indexes, which are created after the bulk insert. Each includes all
+#: of the relation table's columns so lookups never need to visit the table.
+INDEXES = [
+    f"CREATE INDEX relation_source ON relation (source, modulation, target, {_INDEX_COLUMNS})",
+    f"CREATE INDEX relation_target ON relation (target, modulation, source, {_INDEX_COLUMNS})",
+    f"CREATE INDEX relation_modulation ON relation (modulation, source, target, {_INDEX_COLUMNS})",
+]
+
+_KEY = ["source_db", "source_id", "modulation", "target_db", "target_id"]
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Remove redundant prefixes from identifiers, like ``CHEBI:`` in ``CHEBI:133016``."""
+    df = df.rename(columns={"type": "target_type"}).dropna(subset=_KEY)
+    for side in ("source", "target"):
+        df[f"{side}_id"] = [
+            normalize_curie(prefix, identifier)[1]
+            for prefix, identifier in zip(df[f"{side}_db"].values, df[f"{side}_id"].values)
+        ]
+    return df
+
+
+def _get_entities(df: pd.DataFrame) -> pd.DataFrame:
+    """Get the dictionary of CURIEs appearing as sources or targets, each with its first name."""
+    entities = pd.concat(
+        [
+            df[[f"{side}_db", f"{side}_id", f"{side}_name"]].set_axis(
+                ["prefix", "identifier", "name"], axis=1
+            )
+            for side in ("source", "target")
+        ],
+        ignore_index=True,
+    )
+    entities = entities.drop_duplicates(["prefix", "identifier"]).reset_index(drop=True)
+    entities.insert(0, "id", range(1, 1 + len(entities.index)))
+    return entities
+
+
+def _iter_records(df: pd.DataFrame) -> Iterable[tuple]:
+    for record in df.itertuples(index=False, name=None):
+        yield tuple(None if pd.isna(value) else value for value in record)
+
+
+def write_sqlite(
+    path: str,
+    df: Optional[pd.DataFrame] = None,
+    *,
+    relations_path: Optional[str] = None,
+    memory_budget: Optional[int] = None,
+    spill_directory: Optional[str] = None,
+) -> None:
+    """Write the curated and inferred relations to a SQLite database.
+
+    The database is built in a temporary file next to ``path`` in a single
+    transaction, then moved into place so readers never see a partial file.
+
+    :param path: The path to write to. It's replaced if it already exists.
+    :param df: The inferred relations dataframe, with a provenance column.
+        Defaults to :func:`get_relations_df`.
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`, instead. The
+        entities get their identifiers in the order they first appear in the relations,
+        rather than the sources' before the targets'.
+    :param memory_budget: The approximate number of bytes of rows kept in memory while
+        sorting the streamed relations, which is required with ``relations_path``
+    :param spill_directory: The directory in which the sorted runs are spilled
+    """
+    if relations_path is not None:
+        if memory_budget is None:
+            raise ValueError("a memory budget is needed to stream the relations")
+        entities: Dict[Tuple[str, str], Tuple[int, Optional[str]]] = {}
+        relation_records = _iter_streamed_records(
+            relations_path, memory_budget, entities, spill_directory=spill_directory
+        )
+
+        def _iter_entity_records() -> Iterator[tuple]:
+            # This is only iterated once the relations are inserted and the entities are known
+            for (prefix, identifier), (entity_id, name) in entities.items():
+                yield entity_id, prefix, identifier, name
+
+        _write_database(path, relation_records, _iter_entity_records())
+        return
+
+    if df is None:
+        df = get_relations_df()
+
+    # Relations that are the same once their identifiers are normalized are combined
+    df = _normalize(df).sort_values(_KEY, kind="mergesort")
+    df = combine_provenance(df, _KEY)
+    df["inferred"] = ((df[PROVENANCE_COLUMN].values & int(Provenance.CURATED)) == 0).astype(int)
+
+    entities_df = _get_entities(df)
+    curie_to_id = pd.Series(
+        entities_df["id"].values,
+        index=pd.MultiIndex.from_frame(entities_df[["prefix", "identifier"]]),
+    )
+    relations = pd.DataFrame(
+        {
+            side: curie_to_id.reindex(
+                pd.MultiIndex.from_frame(df[[f"{side}_db", f"{side}_id"]])
+            ).values
+            for side in ("source", "target")
+        }
+    )
+    relations["modulation"] = df["modulation"].values
+    relations["target_type"] = df["target_type"].values
+    relations["inferred"] = df["inferred"].values
+    relations["provenance"] = df[PROVENANCE_COLUMN].values.astype(int)
+    relations = relations[
+        ["source", "modulation", "target_type", "target", "inferred", "provenance"]
+    ]
+    _write_database(path, _iter_records(relations), _iter_records(entities_df))
+
+
+def _iter_streamed_records(
+    relations_path: str,
+    memory_budget: int,
+    entities: Dict[Tuple[str, str], Tuple[int, Optional[str]]],
+    *,
+    spill_directory: Optional[str] = None,
+) -> Iterator[tuple]:
+    """Normalize, sort, and combine the streamed relations like :func:`write_sqlite` does.
+
+    :param entities: A dictionary that's filled with the identifier and name of
+        each entity as it first appears
+    :yields: A record of the relation table for each relation
+    """
+    from .external import external_sort, read_sorted_relations
+
+    def _iter_rows() -> Iterator[Tuple]:
+        for row in read_sorted_relations(relations_path):
+            (
+                source_db,
+                source_id,
+                source_name,
+                modulation,
+                target_type,
+                target_db,
+                target_id,
+                target_name,
+                provenance,
+            ) = row
+            if not all((source_db, source_id, modulation, target_db, target_id)):
+                continue
+            yield (
+                source_db,
+                normalize_curie(source_db, source_id)[1],
+                modulation,
+                target_db,
+                normalize_curie(target_db, target_id)[1],
+                source_name,
+                target_type,
+                target_name,
+                provenance,
+            )
+
+    def _combine(left: Tuple, right: Tuple) -> Tuple:
+        return (*left[:-1], left[-1] | right[-1])
+
+    def _get_entity_id(prefix: str, identifier: str, name: str) -> int:
+        entity = entities.get((prefix, identifier))
+        if entity is None:
+            entity = entities[prefix, identifier] = (len(entities) + 1, name or None)
+        return entity[0]
+
+    rows = external_sort(
+        _iter_rows(),
+        itemgetter(0, 1, 2, 3, 4),
+        memory_budget,
+        combine=_combine,
+        directory=spill_directory,
+    )
+    for (
+        source_db,
+        source_id,
+        modulation,
+        target_db,
+        target_id,
+        source_name,
+        target_type,
+        target_name,
+        provenance,
+    ) in rows:
+        yield (
+            _get_entity_id(source_db, source_id, source_name),
+            modulation,
+            target_type or None,
+            _get_entity_id(target_db, target_id, target_name),
+            int(not provenance & int(Provenance.CURATED)),
+            int(provenance),
+        )
+
+
+def _write_database(path: str, relations: Iterable[tuple], entities: Iterable[tuple]) -> None:
+    """Write the records of the relation and entity tables to a new database.
+
+    The relations are inserted first, so the entities can be collected while they are.
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        # The file is only moved into place once it's complete, so durability can be skipped
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO relation (source, modulation, target_type, target, inferred, provenance)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            relations,
+        )
+        conn.executemany(
+            "INSERT INTO entity (id, prefix, identifier, name) VALUES (?, ?, ?, ?)",
+            entities,
+        )
+        (n_entities,) = conn.execute("SELECT COUNT(*) FROM entity").fetchone()
+        (n_relations,) = conn.execute("SELECT COUNT(*) FROM relation").fetchone()
+        logger.info("wrote %d entities and %d relations to %s", n_entities, n_relations, path)
+        for statement in INDEXES:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+        # Collect statistics for the query planner, then compact the file
+        conn.execute("ANALYZE")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""Summarize relations tables in a single aggregation pass.
+
+The relations are counted once over the finest key (source database,
+modulation, target type, target database) and each of the marginal
+summaries is rolled up from those counts rather than from the full table.
+"""
+
+import os
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+import pandas as pd
+from tabulate import tabulate
+
+__all__ = [
+    "Summary",
+    "get_summary",
+    "get_summary_from_counts",
+    "write_summary_tsvs",
+]
+
+#: The finest key over which relations are counted
+SUMMARY_KEYS = ["source_db", "modulation", "target_type", "target_db"]
+
+_FULL_COLUMNS = [
+    "Source Database",
+    "Modulation",
+    "Target Type",
+    "Target Database",
+    "Count",
+]
+
+
+class Summary(NamedTuple):
+    """Counts over a relations table and its marginals."""
+
+    #: The number of rows in the summarized table
+    total: int
+    #: Counts over the finest key
+    full: pd.DataFrame
+    #: Counts by modulation
+    by_modulation: pd.DataFrame
+    #: Counts by target type
+    by_type: pd.DataFrame
+    #: Counts by target database
+    by_namespace: pd.DataFrame
+
+    def get_markdown(self) -> str:
+        """Get the summary as markdown tables, as used in ``docs/index.md``."""
+        modulation_str = tabulate(
+            self.by_modulation.values, ["modulation", "count"], tablefmt="github"
+        )
+        type_str = tabulate(self.by_type.values, ["type", "count"], tablefmt="github")
+        ns_str = tabulate(self.by_namespace.values, ["namespace", "count"], tablefmt="github")
+        summary_df_str = tabulate(
+            self.full.values,
+            ["source_db", "relation", "target_type", "target_db", "count"],
+            tablefmt="github",
+        )
+        return "\n".join(
+            [
+                "\n## Summary by Modulation\n",
+                modulation_str,
+                "\n## Summary by Type\n",
+                type_str,
+                "\n## Summary by Namespace\n",
+                ns_str,
+                "\n## Relation Summary\n",
+                summary_df_str,
+            ]
+        )
+
+    def get_rst(self) -> str:
+        """Get the marginal summaries as reStructuredText tables, as used in the README."""
+        modulation_df = _title(self.by_modulation, "Modulation")
+        type_df = _title(self.by_type, "Target Type")
+        text = tabulate(modulation_df.values, ["Modulation", "Count"], tablefmt="rst")
+        text += "\n\n"
+        text += tabulate(type_df.values, ["Target Entity Type", "Count"], tablefmt="rst")
+        text += "\n\n"
+        text += tabulate(self.by_namespace.values, ["Target Database", "Count"], tablefmt="rst")
+        return text
+
+
+def _title(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    rv = df.copy()
+    rv[column] = rv[column].map(str.title)
+    return rv
+
+
+def get_summary(df: pd.DataFrame) -> Summary:
+    """Count the relations in a table by the finest key then roll up the marginals.
+
+    :param df: A relations dataframe. Either the curated table, whose target type
+        column is named ``type``, or the inferred table, where it's ``target_type``.
+    :returns: The counts over the finest key and its marginals
+    """
+    if "target_type" not in df.columns:
+        df = df.rename(columns={"type": "target_type"})
+    keys = df[SUMMARY_KEYS].astype("category")
+
+    # Keep groups with missing values so they're still counted in the marginals
+    counts = keys.groupby(SUMMARY_KEYS, observed=True, dropna=False).size()
+    return _summarize(counts, total=len(df.index))
+
+
+def get_summary_from_counts(counts: Mapping[Tuple[Optional[str], ...], int]) -> Summary:
+    """Summarize relations that were already counted, e.g., while streaming them.
+
+    :param counts: A mapping from the values of :data:`SUMMARY_KEYS` to the number of
+        relations with them. Missing values are given as None.
+    :returns: The same summary as :func:`get_summary` gives for the counted relations
+    """
+    index = pd.MultiIndex.from_tuples(list(counts), names=SUMMARY_KEYS)
+    series = pd.Series(list(counts.values()), index=index, dtype="int64").sort_index()
+    return _summarize(series, total=int(series.sum()))
+
+
+def _summarize(counts: pd.Series, total: int) -> Summary:
+    full = counts[counts.index.to_frame().notna().all(axis=1).values].reset_index()
+    full.columns = _FULL_COLUMNS
+    return Summary(
+        total=total,
+        full=_astype_str(full),
+        by_modulation=_rollup(counts, "modulation", "Modulation"),
+        by_type=_rollup(counts, "target_type", "Target Type"),
+        by_namespace=_rollup(counts, "target_db", "Target Database"),
+    )
+
+
+def _rollup(counts: pd.Series, key: str, label: str) -> pd.DataFrame:
+    rv = counts.groupby(level=key, observed=True).sum().reset_index()
+    rv.columns = [label, "Count"]
+    return _astype_str(rv)
+
+
+def _astype_str(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert categorical columns back to strings."""
+    for column in df.columns[:-1]:
+        df[column] = df[column].astype(str)
+    return df
+
+
+def write_summary_tsvs(summary: Summary, directory: str, prefix: str) -> None:
+    """Write the full summary and each of its marginals as TSVs.
+
+    :param summary: A summary
+    :param directory: The directory in which the TSVs are written
+    :param prefix: The prefix for the file names, e.g., ``curated`` or ``inferred``
+    """
+    for suffix, df in [
+        ("", summary.full),
+        ("_by_modulation", summary.by_modulation),
+        ("_by_namespace", summary.by_namespace),
+        ("_by_type", summary.by_type),
+    ]:
+        df.to_csv(os.path.join(directory, f"{prefix}_summary{suffix}.tsv"), sep="\t", index=False)
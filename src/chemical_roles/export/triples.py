@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""Export the relations as integer triples for machine learning.
+
+The triples are written to a directory with the following files:
+
+- ``entity_to_id.tsv`` and ``relation_to_id.tsv`` map the CURIEs of the chemicals
+  and targets and the modulations to their integer identifiers
+- ``triples.npy`` has an int64 array with a (head, relation, tail) row for each relation
+- ``train.npy``, ``validation.npy``, and ``test.npy`` have the splits of the triples
+- ``splits.json`` has the seed, ratios, and sizes used for the splits, and whether
+  roles were kept in the same split as the chemicals that have them, which is the default
+
+The arrays can be memory-mapped with ``numpy.load(path, mmap_mode="r")``.
+
+The triples can also be collected from the relations streamed out of
+:func:`chemical_roles.export.external.write_sorted_relations`, in which case only
+the entities and the integer triples are kept in memory.
+"""
+
+import json
+import logging
+import os
+from array import array
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+import pandas as pd
+
+from .utils import get_relations_df
+from ..utils import normalize_curie
+
+__all__ = [
+    "Triples",
+    "get_triples",
+    "get_triples_from_rows",
+    "get_role_groups",
+    "split_triples",
+    "write_triples",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The names of the splits, in order
+SPLITS = ["train", "validation", "test"]
+
+
+class Triples(NamedTuple):
+    """Relations as integer triples."""
+
+    #: The CURIEs of the entities, sorted, whose positions are their identifiers
+    entities: List[str]
+    #: The modulations, sorted, whose positions are their identifiers
+    relations: List[str]
+    #: An array with a (head, relation, tail) row for each relation
+    triples: np.ndarray
+
+
+def _get_curies(df: pd.DataFrame, side: str) -> List[str]:
+    return [
+        ":".join(normalize_curie(prefix, identifier))
+        for prefix, identifier in zip(df[f"{side}_db"].values, df[f"{side}_id"].values)
+    ]
+
+
+def get_triples(df: pd.DataFrame) -> Triples:
+    """Convert a relations dataframe to integer triples.
+
+    :param df: A relations dataframe
+    :returns: The entity and relation labels and the unique triples, sorted
+    """
+    df = df.dropna(subset=["source_db", "source_id", "modulation", "target_db", "target_id"])
+    heads, tails = _get_curies(df, "source"), _get_curies(df, "target")
+    entity_codes, entities = pd.factorize(pd.Series(heads + tails), sort=True)
+    relation_codes, relations = pd.factorize(df["modulation"], sort=True)
+
+    n = len(df.index)
+    triples = np.stack([entity_codes[:n], relation_codes, entity_codes[n:]], axis=1)
+    triples = np.unique(triples.astype(np.int64), axis=0)
+    return Triples(list(entities), list(relations), triples)
+
+
+def get_triples_from_rows(rows: Iterable[Tuple]) -> Triples:
+    """Convert streamed relations to integer triples, like :func:`get_triples`.
+
+    :param rows: The values of :data:`chemical_roles.utils.XREFS_COLUMNS` and the
+        provenance flags for each relation, like from
+        :func:`chemical_roles.export.external.read_sorted_relations`. Missing values
+        can be empty strings.
+    :returns: The entity and relation labels and the unique triples, sorted
+    """
+    entity_to_code: Dict[str, int] = {}
+    relation_to_code: Dict[str, int] = {}
+    codes = array("q")
+    for source_db, source_id, _, modulation, _, target_db, target_id, *_ in rows:
+        if not all((source_db, source_id, modulation, target_db, target_id)):
+            continue
+        head = ":".join(normalize_curie(source_db, source_id))
+        tail = ":".join(normalize_curie(target_db, target_id))
+        codes.append(entity_to_code.setdefault(head, len(entity_to_code)))
+        codes.append(relation_to_code.setdefault(modulation, len(relation_to_code)))
+        codes.append(entity_to_code.setdefault(tail, len(entity_to_code)))
+
+    # Renumber the labels in sorted order, like pandas.factorize(sort=True) does
+    entities, entity_codes = _sort_codes(entity_to_code)
+    relations, relation_codes = _sort_codes(relation_to_code)
+    triples = np.frombuffer(codes, dtype=np.int64).reshape(-1, 3)
+    triples = np.stack(
+        [entity_codes[triples[:, 0]], relation_codes[triples[:, 1]], entity_codes[triples[:, 2]]],
+        axis=1,
+    )
+    return Triples(entities, relations, np.unique(triples, axis=0))
+
+
+def _sort_codes(label_to_code: Mapping[str, int]) -> Tuple[List[str], np.ndarray]:
+    """Sort the labels, and get the position in the sorted labels of each code."""
+    labels = sorted(label_to_code)
+    positions = np.empty(len(labels), dtype=np.int64)
+    positions[[label_to_code[label] for label in labels]] = np.arange(len(labels))
+    return labels, positions
+
+
+def get_role_groups(
+    entities: Sequence[str], role_to_chemicals: Mapping[str, Iterable[Tuple[str, str]]]
+) -> np.ndarray:
+    """Group each role with the chemicals that have it, so they land in the same split.
+
+    Groups are the connected components of the role-chemical graph, so chemicals
+    with several roles join their roles' groups together.
+
+    :param entities: The CURIEs of the entities
+    :param role_to_chemicals: A mapping from ChEBI role identifiers to the chemicals that have them
+    :returns: The group of each entity
+    """
+    curie_to_id = {curie: i for i, curie in enumerate(entities)}
+    parents = np.arange(len(entities))
+
+    def _find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for role_id, chemicals in role_to_chemicals.items():
+        role = curie_to_id.get(f"chebi:{role_id}")
+        if role is None:
+            continue
+        for prefix, identifier in chemicals:
+            chemical = curie_to_id.get(":".join(normalize_curie(prefix, identifier)))
+            if chemical is not None:
+                parents[_find(chemical)] = _find(role)
+
+    return np.array([_find(i) for i in range(len(entities))])
+
+
+def split_triples(
+    triples: np.ndarray,
+    ratios: Sequence[float] = (0.8, 0.1, 0.1),
+    seed: int = 0,
+    groups: Optional[np.ndarray] = None,
+) -> List[np.ndarray]:
+    """Split triples such that all triples with the same head's group are in the same split.
+
+    Groups are shuffled with the seed, then assigned to splits in order until each
+    split has about its share of the triples, so the splits are deterministic.
+
+    :param triples: An array of (head, relation, tail) triples
+    :param ratios: The share of the triples in each split
+    :param seed: The seed for shuffling the groups
+    :param groups: The group of each entity. Defaults to each entity being its own group.
+    :returns: An array of triples for each split
+    """
+    ratios = np.asarray(ratios, dtype=float)
+    heads = triples[:, 0]
+    triple_groups = heads if groups is None else groups[heads]
+
+    unique_groups, inverse, counts = np.unique(
+        triple_groups, return_inverse=True, return_counts=True
+    )
+    order = np.random.default_rng(seed).permutation(len(unique_groups))
+    # Assign each group to the split its midpoint falls in, cumulatively over the shuffled groups
+    ends = np.cumsum(counts[order])
+    midpoints = (ends - counts[order] / 2) / max(len(triples), 1)
+    group_split = np.empty(len(unique_groups), dtype=np.int64)
+    group_split[order] = np.searchsorted(np.cumsum(ratios / ratios.sum()), midpoints)
+    np.minimum(group_split, len(ratios) - 1, out=group_split)
+
+    triple_split = group_split[inverse]
+    return [triples[triple_split == i] for i in range(len(ratios))]
+
+
+def _write_labels(path: str, labels: Sequence[str]) -> None:
+    pd.DataFrame({"id": range(len(labels)), "label": labels}).to_csv(path, sep="\t", index=False)
+
+
+def write_triples(
+    directory: str,
+    df: Optional[pd.DataFrame] = None,
+    ratios: Sequence[float] = (0.8, 0.1, 0.1),
+    seed: int = 0,
+    group_roles: bool = True,
+    role_to_chemicals: Optional[Mapping[str, Set[Tuple[str, str]]]] = None,
+    relations_path: Optional[str] = None,
+) -> Triples:
+    """Write the relations as integer triples, with their labels and splits.
+
+    :param directory: The directory in which the files are written
+    :param df: A relations dataframe. Defaults to :func:`get_relations_df`.
+    :param ratios: The share of the triples in the training, validation, and testing splits
+    :param seed: The seed for the splits
+    :param group_roles: Should roles be kept in the same split as the chemicals that
+        have them, so neither leaks across splits? See :func:`get_role_groups`. If not,
+        only the triples with the same head are kept together.
+    :param role_to_chemicals: The chemicals that have each ChEBI role, which are grouped
+        with it. Defaults to :func:`chemical_roles.bundle.get_role_to_children`.
+    :param relations_path: If given, the relations are streamed from this file, written
+        by :func:`chemical_roles.export.external.write_sorted_relations`, instead
+    :returns: The triples
+    """
+    if relations_path is not None:
+        from .external import read_sorted_relations
+
+        triples = get_triples_from_rows(read_sorted_relations(relations_path))
+    else:
+        triples = get_triples(get_relations_df() if df is None else df)
+    os.makedirs(directory, exist_ok=True)
+
+    logger.info(
+        "writing %d triples over %d entities and %d relations",
+        len(triples.triples),
+        len(triples.entities),
+        len(triples.relations),
+    )
+    _write_labels(os.path.join(directory, "entity_to_id.tsv"), triples.entities)
+    _write_labels(os.path.join(directory, "relation_to_id.tsv"), triples.relations)
+    np.save(os.path.join(directory, "triples.npy"), triples.triples)
+
+    groups = None
+    if group_roles:
+        if role_to_chemicals is None:
+            from ..bundle import get_role_to_children
+
+            role_to_chemicals = get_role_to_children()
+        groups = get_role_groups(triples.entities, role_to_chemicals)
+    splits = split_triples(triples.triples, ratios=ratios, seed=seed, groups=groups)
+    for name, split in zip(SPLITS, splits):
+        np.save(os.path.join(directory, f"{name}.npy"), split)
+
+    with open(os.path.join(directory, "splits.json"), "w") as file:
+        json.dump(
+            {
+                "seed": seed,
+                "ratios": list(ratios),
+                "group_roles": group_roles,
+                "sizes": {name: len(split) for name, split in zip(SPLITS, splits)},
+            },
+            file,
+            indent=2,
+        )
+    return triples
@@ -4,45 +4,399 @@
 
 import itertools as itt
 import logging
+import os
+import tempfile
 from collections import defaultdict
 from functools import lru_cache
-from typing import Iterable, List, Mapping, Tuple
-
-import networkx as nx
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 import pandas as pd
-import pyobo
-from protmapper import uniprot_client
-from protmapper.api import hgnc_id_to_up, hgnc_name_to_id
-from pyobo.sources import expasy
-from pyobo.sources.chebi import get_chebi_role_to_children
-from pyobo.struct import has_member
 from tqdm import tqdm
 
+from chemical_roles.closure import ClosureIndex
+from chemical_roles.constants import MAX_GO_FANOUT
+from chemical_roles.export.provenance import (
+    PROVENANCE_COLUMN,
+    Provenance,
+    combine_provenance,
+)
+from chemical_roles.instrument import span
 from chemical_roles.resources import get_xrefs_df
-from chemical_roles.utils import XREFS_COLUMNS
+from chemical_roles.utils import XREFS_COLUMNS, hash_file, normalize_curie
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+    from chemical_roles.bundle import BundledLookup
+
+# PyOBO and protmapper are imported where they're used, since protmapper loads the
+# HGNC and UniProt tables when it's imported and neither is needed for preloaded tables
 
 logger = logging.getLogger(__name__)
 
+# The provenance flags as plain integers, which are cheaper to combine during inference
+CURATED = int(Provenance.CURATED)
+ROLE_CLOSURE = int(Provenance.ROLE_CLOSURE)
+SUB_ROLES = int(Provenance.SUB_ROLES)
+HGNC_UNIPROT = int(Provenance.HGNC_UNIPROT)
+FPLX_MEMBERS = int(Provenance.FPLX_MEMBERS)
+EC_CHILDREN = int(Provenance.EC_CHILDREN)
+EC2GO = int(Provenance.EC2GO)
+GO_CLOSURE = int(Provenance.GO_CLOSURE)
+
+#: Upstream resources whose versions determine the content of the inferred relations,
+#: along with the other inputs in :func:`get_inference_versions`
+UPSTREAM_PREFIXES = ["chebi", "expasy", "go", "hgnc"]
+#: The version of the inference rules. Bump it whenever a change to the rules changes
+#: which relations are inferred, so the exports that depend on them are rebuilt.
+INFERENCE_VERSION = 1
+
+#: The direction in the GO hierarchy that the GO targets of each modulation are propagated
+#: in. Blocking a function or process blocks each of its more specific kinds, while
+#: enhancing or changing a specific one enhances or changes the more general one it's
+#: a kind of. Relations with other modulations aren't propagated.
+GO_DIRECTIONS = {
+    "inhibitor": "descendants",
+    "antagonist": "descendants",
+    "inverse agonist": "descendants",
+    "destabilizer": "descendants",
+    "activator": "ancestors",
+    "agonist": "ancestors",
+    "inducer": "ancestors",
+    "stabilizer": "ancestors",
+    "modulator": "ancestors",
+}
+#: The roots of GO's aspects, which are too general to propagate to
+GO_ROOTS = {"0003674", "0005575", "0008150"}
+
+#: Relations dataframes that have already been computed, e.g., by a parent process,
+#: keyed by the arguments of :func:`get_relations_df`
+_preloaded: Dict[Tuple[bool, bool, bool, int], pd.DataFrame] = {}
+
+
+def preload_relations_df(
+    df: pd.DataFrame,
+    use_sub_roles: bool = False,
+    use_inferred: bool = True,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> None:
+    """Register an already computed relations dataframe so it isn't computed again."""
+    _preloaded[use_sub_roles, use_inferred, propagate_go, max_go_fanout] = df
+    get_relations_df.cache_clear()
+
+
+def get_upstream_versions(
+    prefixes: Optional[Iterable[str]] = None,
+    use_bundle: bool = True,
+) -> Mapping[str, Optional[str]]:
+    """Get the versions of the upstream resources used during inference.
+
+    Versions that can't be looked up (e.g., when offline) are given as None.
+    If a bundle is in use, the versions it was built from are given instead.
+
+    :param prefixes: The resources to look up. Defaults to :data:`UPSTREAM_PREFIXES`.
+    :param use_bundle: Should the versions of the bundle in use be given? If not, they're
+        always looked up, e.g., to build a new bundle.
+    """
+    from chemical_roles.bundle import get_bundle
+
+    if prefixes is None:
+        prefixes = UPSTREAM_PREFIXES
+    bundle = get_bundle() if use_bundle else None
+    if bundle is not None:
+        return {prefix: bundle.versions.get(prefix) for prefix in prefixes}
+
+    import bioversions
+
+    rv = {}
+    for prefix in prefixes:
+        try:
+            rv[prefix] = bioversions.get_version(prefix)
+        except Exception:  # noqa:B902
+            logger.warning("could not look up version for %s", prefix)
+            rv[prefix] = None
+    return rv
+
+
+def get_inference_versions(refresh: bool = False) -> Mapping[str, Optional[str]]:
+    """Get the versions of the inputs to inference besides the curated relations and ontologies.
+
+    These are the inference rules, the FamPlex relations, which are downloaded from
+    FamPlex's default branch, and protmapper's HGNC and UniProt tables. If a bundle
+    is in use, the hashes of its FamPlex and HGNC to UniProt tables are given instead.
+    Versions that can't be determined (e.g., when offline) are given as None.
+
+    :param refresh: Should the FamPlex relations be downloaded again before they're
+        hashed? See :func:`ensure_famplex_relations`.
+    """
+    from chemical_roles.bundle import get_bundle
+
+    rv: Dict[str, Optional[str]] = {"inference": str(INFERENCE_VERSION)}
+    bundle = get_bundle()
+    if bundle is not None:
+        rv["famplex"] = bundle.manifest["tables"]["famplex"]["sha256"]
+        rv["protmapper"] = bundle.manifest["tables"]["hgnc_uniprot"]["sha256"]
+        return rv
+
+    try:
+        path = ensure_famplex_relations(refresh=refresh)
+    except Exception:  # noqa:B902
+        logger.warning("could not download the FamPlex relations")
+        rv["famplex"] = None
+    else:
+        rv["famplex"] = hash_file(path)
+
+    # The version is read from the metadata, since importing protmapper loads its tables
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        rv["protmapper"] = version("protmapper")
+    except PackageNotFoundError:
+        rv["protmapper"] = None
+    return rv
+
 
 @lru_cache(maxsize=4)
-def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) -> pd.DataFrame:
-    """Assemble the relations dataframe."""
-    xrefs_df = get_xrefs_df()
+def get_relations_df(
+    use_sub_roles: bool = False,
+    use_inferred: bool = True,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> pd.DataFrame:
+    """Assemble the relations dataframe.
+
+    :param use_sub_roles: Should the chemicals with descendant roles be included?
+    :param use_inferred: Should the inferred relations be included, or only the curated ones?
+    :param propagate_go: Should the GO targets be propagated over the GO hierarchy?
+        See :func:`infer_relations_df`.
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    :returns: The relations dataframe
+    """
+    preloaded = _preloaded.get((use_sub_roles, use_inferred, propagate_go, max_go_fanout))
+    if preloaded is not None:
+        return preloaded
+
+    with span("xrefs") as s:
+        xrefs_df = get_xrefs_df()
+        s.count("rows", len(xrefs_df.index))
     if not use_inferred:
         return xrefs_df
+    return infer_relations_df(
+        xrefs_df,
+        use_sub_roles=use_sub_roles,
+        propagate_go=propagate_go,
+        max_go_fanout=max_go_fanout,
+    )
+
+
+def _normalize_curies(curies: Optional[Collection[str]]) -> Optional[Set[Tuple[str, str]]]:
+    if curies is None:
+        return None
+    return {normalize_curie(*curie.split(":", 1)) for curie in curies}
+
+
+def infer_relations_df(
+    xrefs_df: Optional[pd.DataFrame] = None,
+    *,
+    use_sub_roles: bool = False,
+    modulations: Optional[Collection[str]] = None,
+    target_dbs: Optional[Collection[str]] = None,
+    target_types: Optional[Collection[str]] = None,
+    roles: Optional[Collection[str]] = None,
+    chemicals: Optional[Collection[str]] = None,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> pd.DataFrame:
+    """Infer relations over the target and role hierarchies, only for the requested slice.
+
+    Each filter is applied as early as possible. The curated relations are filtered
+    by modulation and role before anything is expanded, the target hierarchies are
+    only loaded and expanded when they can produce a requested target, and the roles
+    are only expanded to the requested chemicals. With no filters, this gives the
+    same table as :func:`get_relations_df`.
+
+    :param xrefs_df: The curated relations. Defaults to :func:`get_xrefs_df`.
+    :param use_sub_roles: Should the chemicals with descendant roles be included?
+    :param modulations: If given, only infer relations with these modulations
+    :param target_dbs: If given, only infer relations to targets in these namespaces
+    :param target_types: If given, only infer relations to targets of these types
+    :param roles: If given, only infer relations from these roles' CURIEs
+    :param chemicals: If given, only infer relations from these chemicals' CURIEs.
+        Curated relations are kept only if their source is one of them.
+    :param propagate_go: Should the GO targets, including the ones from ec2go, be
+        propagated over the GO hierarchy in the directions in :data:`GO_DIRECTIONS`?
+    :param max_go_fanout: The maximum number of GO terms one relation is propagated to
+    :returns: The curated relations and the inferred relations, with the same columns
+        as :data:`chemical_roles.utils.XREFS_COLUMNS` and a ``provenance`` column with
+        the :class:`chemical_roles.export.provenance.Provenance` flags for each row
+    """
+    rows = list(
+        iter_relation_rows(
+            xrefs_df,
+            use_sub_roles=use_sub_roles,
+            modulations=modulations,
+            target_dbs=target_dbs,
+            target_types=target_types,
+            roles=roles,
+            chemicals=chemicals,
+            propagate_go=propagate_go,
+            max_go_fanout=max_go_fanout,
+        )
+    )
+    logger.info("inferred df has %d rows", len(rows))
+    with span("sort_dedup", rows=len(rows)) as s:
+        rv = pd.DataFrame(rows, columns=[*XREFS_COLUMNS, PROVENANCE_COLUMN])
+        rv[PROVENANCE_COLUMN] = rv[PROVENANCE_COLUMN].astype(np.uint8)
+        rv.sort_values(XREFS_COLUMNS, inplace=True)
+        # Rows produced in several ways are kept once, with all of their provenance
+        rv = combine_provenance(rv, XREFS_COLUMNS)
+        s.count("unique_rows", len(rv.index))
+    return rv
+
 
-    famplex_id_to_members = _get_famplex()
+def iter_relation_rows(
+    xrefs_df: Optional[pd.DataFrame] = None,
+    *,
+    use_sub_roles: bool = False,
+    modulations: Optional[Collection[str]] = None,
+    target_dbs: Optional[Collection[str]] = None,
+    target_types: Optional[Collection[str]] = None,
+    roles: Optional[Collection[str]] = None,
+    chemicals: Optional[Collection[str]] = None,
+    propagate_go: bool = False,
+    max_go_fanout: int = MAX_GO_FANOUT,
+) -> Iterable[Tuple]:
+    """Iterate over the curated and inferred relations, without sorting or deduplicating them.
+
+    Takes the same arguments as :func:`infer_relations_df`.
+
+    :yields: The values of :data:`chemical_roles.utils.XREFS_COLUMNS` and the
+        provenance flags for each relation, first the curated then the inferred ones
+    """
+    if xrefs_df is None:
+        with span("xrefs") as s:
+            xrefs_df = get_xrefs_df()
+            s.count("rows", len(xrefs_df.index))
+    roles = _normalize_curies(roles)
+    chemicals = _normalize_curies(chemicals)
+
+    def _want(target_db: str, target_type: str) -> bool:
+        return (target_dbs is None or target_db in target_dbs) and (
+            target_types is None or target_type in target_types
+        )
 
-    logger.info("getting enzyme classes")
-    expasy_graph, ec_code_to_children = get_expasy_closure()
-    logger.info("getting ec2go")
-    ec2go = expasy.get_ec2go()
-    logger.info("ec2go has %d elements", len(ec2go))
+    # Push down the filters on the curated relations
+    if modulations is not None:
+        xrefs_df = xrefs_df[xrefs_df["modulation"].isin(modulations)]
+    if roles is not None:
+        xrefs_df = xrefs_df[
+            [
+                normalize_curie(source_db, source_id) in roles
+                for source_db, source_id in xrefs_df[["source_db", "source_id"]].values
+            ]
+        ]
+
+    for row in xrefs_df.values:
+        if _want(row[5], row[4]) and (
+            chemicals is None or normalize_curie(row[0], row[1]) in chemicals
+        ):
+            yield (*row, CURATED)
+
+    role_to_chemicals = None
+    if chemicals is not None and not use_sub_roles:
+        # Only expand the targets of roles that some of the requested chemicals have
+        from chemical_roles.bundle import get_role_to_children
+
+        role_to_chemicals = get_role_to_children()
+        xrefs_df = xrefs_df[
+            [
+                source_db == "chebi"
+                and not chemicals.isdisjoint(
+                    role_to_chemicals.get(normalize_curie(source_db, source_id)[1], [])
+                )
+                for source_db, source_id in xrefs_df[["source_db", "source_id"]].values
+            ]
+        ]
+
+    with span("target_expansion", rows=len(xrefs_df.index)) as s:
+        x = _infer_targets(xrefs_df, _want)
+        s.count("roles", len(x))
+        s.count("relations", sum(map(len, x.values())))
+        s.count("skipped_non_chebi", int((xrefs_df["source_db"] != "chebi").sum()))
+    if propagate_go:
+        with span("go_propagation") as s:
+            n_relations, n_skipped = _propagate_go(x, GO_DIRECTIONS, max_go_fanout)
+            s.count("relations", n_relations)
+            s.count("skipped", n_skipped)
+    with span("role_expansion", roles=len(x)) as s:
+        n = 0
+        for n, row in enumerate(
+            _infer_chemicals(
+                x,
+                use_sub_roles=use_sub_roles,
+                chemicals=chemicals,
+                role_to_chemicals=role_to_chemicals,
+            ),
+            start=1,
+        ):
+            yield row
+        s.count("rows", n)
+
+
+def _infer_targets(
+    xrefs_df: pd.DataFrame, want: Callable[[str, str], bool]
+) -> Mapping[Tuple[str, str], List[Tuple[str, str, str, str, str, int]]]:
+    """Expand the curated relations' targets over the target hierarchies.
+
+    :param xrefs_df: The curated relations
+    :param want: A function of a target's namespace and type that decides if it's kept
+    :returns: A mapping from each ChEBI role to its expanded relations' modulation,
+        target type, target namespace, target identifier, target name, and provenance
+    """
+    # Only load the target hierarchies that can produce a requested target
+    curated_target_dbs = set(xrefs_df["target_db"])
+    want_hgnc, want_uniprot = want("hgnc", "protein"), want("uniprot", "protein")
+    famplex_id_to_members = ClosureIndex.from_edges([])
+    if "fplx" in curated_target_dbs and (want_hgnc or want_uniprot):
+        with span("famplex") as s:
+            famplex_id_to_members = _get_famplex()
+            s.count("families", len(famplex_id_to_members))
+    ec_code_to_children, ec2go = {}, {}
+    want_go = want("go", "molecular function")
+    if "eccode" in curated_target_dbs and (
+        want_go or any(want(db, target_type) for db, target_type in DB_TO_TYPE.items())
+    ):
+        # The closure is also needed for GO since codes without children are skipped
+        logger.info("getting enzyme classes")
+        with span("expasy_closure") as s:
+            _, ec_code_to_children = get_expasy_closure()
+            s.count("ec_codes", len(ec_code_to_children))
+        if want_go:
+            logger.info("getting ec2go")
+            from chemical_roles.bundle import get_ec2go
+
+            with span("ec2go") as s:
+                ec2go = get_ec2go()
+                s.count("ec_codes", len(ec2go))
+            logger.info("ec2go has %d elements", len(ec2go))
 
-    rows = list(xrefs_df.values)
     x = defaultdict(list)
     it = tqdm(
-        rows,
+        xrefs_df.values,
         total=len(xrefs_df.index),
         desc="inferring over target hierarchies",
     )
@@ -68,37 +422,56 @@ def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) ->
 
         if target_db == "hgnc":
             # Append original
-            x[source_db, source_id].append((modulation, "protein", "hgnc", target_id, target_name))
-            # Append inferred
-            for uniprot_id, uniprot_name in get_uniprot_id_names(target_id):
+            if want_hgnc:
                 x[source_db, source_id].append(
-                    (modulation, "protein", "uniprot", uniprot_id, uniprot_name)
+                    (modulation, "protein", "hgnc", target_id, target_name, 0)
                 )
+            # Append inferred
+            if want_uniprot:
+                for uniprot_id, uniprot_name in get_uniprot_id_names(target_id):
+                    x[source_db, source_id].append(
+                        (modulation, "protein", "uniprot", uniprot_id, uniprot_name, HGNC_UNIPROT)
+                    )
 
         elif target_db == "fplx":
             # Append original
-            x[source_db, source_id].append(
-                (modulation, target_type, target_db, target_id, target_name)
-            )
-            # Append inferred
-            for hgnc_id, hgnc_symbol in famplex_id_to_members.get(target_id, []):
+            if want(target_db, target_type):
                 x[source_db, source_id].append(
-                    (modulation, "protein", "hgnc", hgnc_id, hgnc_symbol)
+                    (modulation, target_type, target_db, target_id, target_name, 0)
                 )
-                for uniprot_id, uniprot_name in get_uniprot_id_names(hgnc_id):
+            # Append inferred, from all of the genes in nested entities too
+            for _, hgnc_id, hgnc_symbol in famplex_id_to_members.get_labels(
+                target_id, prefixes=("hgnc",)
+            ):
+                if want_hgnc:
                     x[source_db, source_id].append(
-                        (modulation, "protein", "uniprot", uniprot_id, uniprot_name)
+                        (modulation, "protein", "hgnc", hgnc_id, hgnc_symbol, FPLX_MEMBERS)
                     )
+                if want_uniprot:
+                    for uniprot_id, uniprot_name in get_uniprot_id_names(hgnc_id):
+                        x[source_db, source_id].append(
+                            (
+                                modulation,
+                                "protein",
+                                "uniprot",
+                                uniprot_id,
+                                uniprot_name,
+                                FPLX_MEMBERS | HGNC_UNIPROT,
+                            )
+                        )
 
         elif target_db == "eccode":
             children_ec_codes = ec_code_to_children.get(target_id)
             if children_ec_codes is None:
                 # this is the case for about 15 entries
-                logger.info(f"could not find children of {target_db}:{target_id}")
+                if ec_code_to_children:
+                    logger.info(f"could not find children of {target_db}:{target_id}")
                 continue
 
             for sub_target_db, sub_target_id, sub_target_name in children_ec_codes:
                 target_type = DB_TO_TYPE[sub_target_db]
+                if not want(sub_target_db, target_type):
+                    continue
                 x[source_db, source_id].append(
                     (
                         modulation,
@@ -106,6 +479,7 @@ def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) ->
                         sub_target_db,
                         sub_target_id,
                         sub_target_name,
+                        EC_CHILDREN,
                     )
                 )
 
@@ -117,20 +491,88 @@ def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) ->
                         "go",
                         go_id,
                         go_name,
+                        EC2GO,
                     )
                 )
 
-        else:
+        elif want(target_db, target_type):
             x[source_db, source_id].append(
-                (modulation, target_type, target_db, target_id, target_name)
+                (modulation, target_type, target_db, target_id, target_name, 0)
             )
 
     logger.info("x mapping: %d/%d", len(x), sum(map(len, x.values())))
     logger.info("skipped %d non-chebi source terms", non_chebi_counter)
+    return x
+
+
+def _propagate_go(
+    x: Mapping[Tuple[str, str], List[Tuple[str, str, str, str, str, int]]],
+    directions: Mapping[str, str],
+    max_fanout: int,
+) -> Tuple[int, int]:
+    """Add the descendants or ancestors of the GO targets to the expanded relations.
+
+    :param x: The expanded relations from :func:`_infer_targets`, which are extended in place
+    :param directions: The direction each modulation's targets are propagated in
+    :param max_fanout: The maximum number of GO terms one relation is propagated to
+    :returns: The number of relations added and the number that weren't propagated
+        because they would have fanned out to more than ``max_fanout`` terms
+    """
+    closures: Dict[str, ClosureIndex] = {}
+    n_relations = n_skipped = 0
+    for rows in x.values():
+        propagated = []
+        for modulation, target_type, target_db, target_id, _target_name, provenance in rows:
+            direction = directions.get(modulation)
+            if target_db != "go" or direction is None:
+                continue
+            if direction not in closures:
+                closures[direction] = get_go_closure(direction)
+            # The ec2go terms have prefixes and the curated ones don't by now
+            has_prefix = target_id.startswith("GO:")
+            key = target_id[len("GO:") :] if has_prefix else target_id
+            labels = [
+                label for label in closures[direction].get_labels(key) if label[1] not in GO_ROOTS
+            ]
+            if len(labels) > max_fanout:
+                n_skipped += 1
+                continue
+            for _, go_id, go_name in labels:
+                propagated.append(
+                    (
+                        modulation,
+                        target_type,
+                        "go",
+                        f"GO:{go_id}" if has_prefix else go_id,
+                        go_name,
+                        provenance | GO_CLOSURE,
+                    )
+                )
+        rows.extend(propagated)
+        n_relations += len(propagated)
+    if n_skipped:
+        logger.info(
+            "did not propagate %d relations to more than %d GO terms", n_skipped, max_fanout
+        )
+    return n_relations, n_skipped
+
+
+def _infer_chemicals(
+    x: Mapping[Tuple[str, str], List[Tuple[str, str, str, str, str, int]]],
+    use_sub_roles: bool = False,
+    chemicals: Optional[Set[Tuple[str, str]]] = None,
+    role_to_chemicals: Optional[Mapping[str, Set[Tuple[str, str]]]] = None,
+) -> Iterable[Tuple[str, ...]]:
+    """Expand the relations from roles to the chemicals that have them."""
+    import pyobo
+
+    from chemical_roles.bundle import get_descendants, get_name, get_role_to_children
 
     logger.info("inferring over role hiearchies")
+    if role_to_chemicals is None:
+        role_to_chemicals = get_role_to_children() if x else {}
     db_to_role_to_chemical_curies = {
-        "chebi": get_chebi_role_to_children(),
+        "chebi": role_to_chemicals,
     }
     for (role_db, role_id), entries in tqdm(
         sorted(x.items()), desc="inferring over role hierarchies"
@@ -138,9 +580,7 @@ def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) ->
         sub_role_curies = {(role_db, role_id)}
 
         if role_db == "chebi" and use_sub_roles:
-            sub_role_curies |= {
-                pyobo.normalize_curie(c) for c in pyobo.get_subhierarchy(role_db, role_id)
-            }
+            sub_role_curies |= {pyobo.normalize_curie(c) for c in get_descendants(role_db, role_id)}
 
         chemical_curies = set(
             itt.chain.from_iterable(
@@ -149,32 +589,36 @@ def get_relations_df(use_sub_roles: bool = False, use_inferred: bool = True) ->
             )
         )
         if not chemical_curies:
-            tqdm.write(f"no inference for {role_db}:{role_id} ! {pyobo.get_name(role_db, role_id)}")
+            tqdm.write(f"no inference for {role_db}:{role_id} ! {get_name(role_db, role_id)}")
             continue
+        if chemicals is not None:
+            chemical_curies &= chemicals
+        # Chemicals that have the role itself, rather than only one of its descendants
+        direct_curies = db_to_role_to_chemical_curies[role_db].get(role_id, set())
 
-        for modulation, target_type, target_db, target_id, target_name in entries:
+        for modulation, target_type, target_db, target_id, target_name, provenance in entries:
             for chemical_db, chemical_id in chemical_curies:
-                rows.append(
-                    (
-                        chemical_db,
-                        chemical_id,
-                        pyobo.get_name(chemical_db, chemical_id),
-                        modulation,
-                        target_type,
-                        target_db,
-                        target_id,
-                        target_name,
-                    )
+                yield (
+                    chemical_db,
+                    chemical_id,
+                    get_name(chemical_db, chemical_id),
+                    modulation,
+                    target_type,
+                    target_db,
+                    target_id,
+                    target_name,
+                    provenance
+                    | (
+                        ROLE_CLOSURE
+                        if (chemical_db, chemical_id) in direct_curies
+                        else ROLE_CLOSURE | SUB_ROLES
+                    ),
                 )
 
-    logger.info("inferred df has %d rows", len(rows))
-    rv = pd.DataFrame(rows, columns=XREFS_COLUMNS)
-    rv.sort_values(XREFS_COLUMNS, inplace=True)
-    rv.drop_duplicates(inplace=True)
-    return rv
-
 
 FAMPLEX_RELATIONS_URL = "https://raw.githubusercontent.com/sorgerlab/famplex/master/relations.csv"
+#: The FamPlex relations that are followed to the members of an entity
+FAMPLEX_RELATIONS = {"isa", "partof"}
 DB_TO_TYPE = {
     "eccode": "protein family",
     "uniprot": "protein",
@@ -182,25 +626,106 @@ DB_TO_TYPE = {
 }
 
 
-def _get_famplex():
+def _get_famplex() -> Union[ClosureIndex, "BundledLookup"]:
+    from chemical_roles.bundle import get_bundle
+
+    bundle = get_bundle()
+    if bundle is not None:
+        return bundle.get_famplex()
+    return build_famplex()
+
+
+def ensure_famplex_relations(refresh: bool = False) -> str:
+    """Get the path of FamPlex's relations in the PyStow directory, downloading them if needed.
+
+    The relations are read from FamPlex's default branch, so they're downloaded again
+    when refreshing, which ``chemical_roles cache warm``, ``chemical_roles bundle build``,
+    and :func:`chemical_roles.export.pipeline.run_stages` do. The new file replaces the
+    old one only once it's complete. If it can't be downloaded, e.g., on an air-gapped
+    machine using a mirror, the copy that's already there is used.
+
+    :param refresh: Should the relations be downloaded again if they already were?
+    :returns: The path of the relations CSV
+    :raises Exception: If the relations can't be downloaded and there's no copy yet
+    """
+    import pystow
+    from pystow.utils import download
+
+    path = str(pystow.join("chemical_roles", "famplex", name="relations.csv"))
+    if os.path.exists(path) and not refresh:
+        return path
+
+    fd, tmp = tempfile.mkstemp(prefix=".relations-", suffix=".csv", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        download(FAMPLEX_RELATIONS_URL, tmp, force=True)
+    except Exception:  # noqa:B902
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if not os.path.exists(path):
+            raise
+        logger.warning("could not refresh the FamPlex relations, so the cached copy is used")
+    else:
+        os.replace(tmp, path)
+    return path
+
+
+def build_famplex(refresh: bool = False) -> ClosureIndex:
+    """Get the transitive closure of the members of each FamPlex entity.
+
+    Both ``isa`` and ``partof`` relations are followed, so an entity whose members
+    are themselves FamPlex entities has all of their HGNC genes as descendants too.
+
+    :param refresh: Should the FamPlex relations be downloaded again? See
+        :func:`ensure_famplex_relations`.
+    :returns: An index from each FamPlex entity to the labels of all of the HGNC genes
+        and FamPlex entities below it
+    """
+    from protmapper.api import hgnc_name_to_id
+
     logger.info("loading famplex mapping")
-    famplex_id_to_members = defaultdict(list)
-    famplex_relations_df = pd.read_csv(FAMPLEX_RELATIONS_URL)
-    for source_id, source_name, rel, target_db, target_name in famplex_relations_df.values:
-        if source_id.lower() == "hgnc" and rel == "isa" and target_db.lower() == "fplx":
+    famplex_relations_df = pd.read_csv(ensure_famplex_relations(refresh=refresh))
+    edges = []
+    for source_db, source_name, rel, target_db, target_name in famplex_relations_df.values:
+        if rel not in FAMPLEX_RELATIONS or target_db.lower() != "fplx":
+            continue
+        if source_db.lower() == "hgnc":
             try:
                 hgnc_id = hgnc_name_to_id[source_name]
             except KeyError:
                 logger.warning(f"Could not find {source_name} for fplx:{target_name}")
                 continue
-            famplex_id_to_members[target_name].append((hgnc_id, source_name))
+            child = ("hgnc", hgnc_id, source_name)
+        elif source_db.lower() == "fplx":
+            child = ("fplx", source_name, source_name)
+        else:
+            continue
+        edges.append((child, ("fplx", target_name, target_name)))
+
+    rv = ClosureIndex.from_edges(edges)
+    logger.info("famplex closure has %d elements and %d members", len(rv), rv.nnz)
+    return rv
+
+
+def get_expasy_closure() -> Tuple[Optional["nx.DiGraph"], Mapping[str, List[str]]]:
+    """Get the ExPASy closure map.
+
+    If a bundle is in use, the closure is read from it and no graph is given.
+    """
+    from chemical_roles.bundle import get_bundle
+
+    bundle = get_bundle()
+    if bundle is not None:
+        return None, bundle.get_expasy_closure()
+    return build_expasy_closure()
 
-    logger.info("famplex mapping has %d elements", len(famplex_id_to_members))
-    return famplex_id_to_members
 
+def build_expasy_closure() -> Tuple["nx.DiGraph", Mapping[str, List[str]]]:
+    """Build the ExPASy closure map from the ExPASy ontology."""
+    import networkx as nx
+    from pyobo.sources import expasy
+    from pyobo.struct import has_member
 
-def get_expasy_closure() -> Tuple[nx.DiGraph, Mapping[str, List[str]]]:
-    """Get the ExPASy closure map."""
     _graph = nx.DiGraph()
     expasy_obo = expasy.get_obo()
     for term in expasy_obo:
@@ -224,8 +749,76 @@ def get_expasy_closure() -> Tuple[nx.DiGraph, Mapping[str, List[str]]]:
     return _graph, rv
 
 
+@lru_cache(maxsize=2)
+def get_go_closure(direction: str = "descendants") -> ClosureIndex:
+    """Get the transitive closure of the GO hierarchy.
+
+    It's built once for each release of GO, then saved under the PyStow directory
+    and loaded from there. The release is the one from :func:`get_upstream_versions`,
+    so with a bundle, it's the release the bundle was built from.
+
+    :param direction: Either ``descendants`` or ``ancestors``
+    :returns: An index from each GO term to its descendants or ancestors
+    """
+    if direction not in {"descendants", "ancestors"}:
+        raise ValueError(f"invalid direction: {direction}")
+    version = get_upstream_versions(["go"])["go"]
+    if version is None:
+        logger.warning("could not look up the version of GO, so its closure isn't saved")
+        return build_go_closure(direction)
+
+    import pystow
+
+    path = pystow.join("chemical_roles", "go_closure", version, name=f"{direction}.npz")
+    if path.exists():
+        return ClosureIndex.load(str(path))
+    rv = build_go_closure(direction, version=version)
+    rv.save(str(path))
+    return rv
+
+
+def build_go_closure(direction: str = "descendants", version: Optional[str] = None) -> ClosureIndex:
+    """Build the transitive closure of the GO hierarchy.
+
+    Only the ``is_a`` relations are followed, since a term that's ``part_of`` another
+    isn't a kind of it, e.g., a subunit of a complex isn't the complex.
+
+    :param direction: Either ``descendants`` or ``ancestors``
+    :param version: The release of GO to use. Defaults to the latest one.
+    :returns: An index from each GO term to its descendants or ancestors
+    """
+    import pyobo
+
+    names = pyobo.get_id_name_mapping("go", version=version)
+    hierarchy = pyobo.get_hierarchy("go", include_part_of=False, version=version)
+    edges = []
+    for child, parent in hierarchy.edges():
+        child_prefix, child_id = pyobo.normalize_curie(child)
+        parent_prefix, parent_id = pyobo.normalize_curie(parent)
+        if child_prefix != "go" or parent_prefix != "go":
+            continue
+        edge = ("go", child_id, names.get(child_id)), ("go", parent_id, names.get(parent_id))
+        edges.append(edge if direction == "descendants" else edge[::-1])
+    rv = ClosureIndex.from_edges(edges)
+    logger.info("GO %s closure has %d terms and %d pairs", direction, len(rv), rv.nnz)
+    return rv
+
+
 def get_uniprot_id_names(hgnc_id: str) -> Iterable[Tuple[str, str]]:
     """Get all of the UniProt identifiers for a given gene."""
+    from chemical_roles.bundle import get_bundle
+
+    bundle = get_bundle()
+    if bundle is not None:
+        rv = bundle.get_hgnc_to_uniprot().get(str(hgnc_id))
+        if rv is None:
+            tqdm.write(f"could not find HGNC:{hgnc_id}")
+        yield from rv or []
+        return
+
+    from protmapper import uniprot_client
+    from protmapper.api import hgnc_id_to_up
+
     try:
         r = hgnc_id_to_up[str(hgnc_id)]
     except KeyError:
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+"""Import mappings and relations from other resources."""
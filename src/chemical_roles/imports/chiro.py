@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""Import the relations from ChIRO that aren't curated yet.
+
+`ChIRO <https://github.com/obophenotype/chiro>`_ relates ChEBI roles to the
+targets of their chemicals, e.g., ``inhibitor_of`` a GO term. Its relations
+are read into a dataframe, then only the namespaces its targets actually use
+are loaded, in parallel, and the names are resolved with one vectorized lookup
+per column. Finally, the relations are anti-joined against ``xrefs.tsv``, so
+what's left are only the relations between pairs that aren't curated yet::
+
+    from chemical_roles.imports.chiro import get_chiro_import_df
+
+    new_df, curated_df = get_chiro_import_df()
+
+``curated_df`` has the relations whose pairs are already curated, with the
+curated modulation in the ``curated_modulation`` column, so conflicts with the
+curation can be reviewed.
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Collection, Dict, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from ..utils import XREFS_COLUMNS
+
+__all__ = [
+    "MAPPING_PREFIXES",
+    "get_chiro_df",
+    "get_chiro_import_df",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The namespaces of ChIRO's targets whose names can be looked up
+MAPPING_PREFIXES = ["ncbitaxon", "go", "pr", "hp", "mp"]
+#: The type of the targets in each namespace. GO terms are left blank to be curated,
+#: since they could be molecular functions, biological processes, or complexes.
+TARGET_TYPES = {
+    "ncbitaxon": "organism",
+    "pr": "protein",
+    "hp": "phenotype",
+    "mp": "phenotype",
+}
+#: The namespaces whose identifiers are written without their prefix in ``xrefs.tsv``
+BARE_PREFIXES = {"ncbitaxon"}
+#: The columns identifying a pair of a chemical and a target
+PAIR_COLUMNS = ["source_db", "source_id", "target_db", "target_id"]
+
+
+def _get_local_ids(curies: pd.Series) -> pd.Series:
+    return curies.str.replace(r"^[A-Za-z.]+:", "", regex=True)
+
+
+def get_chiro_df(graph=None) -> pd.DataFrame:
+    """Get ChIRO's relations, without names.
+
+    :param graph: ChIRO as an OBO graph. Defaults to :func:`pyobo.get_obo_graph`.
+    :returns: A dataframe with the columns of :data:`chemical_roles.utils.XREFS_COLUMNS`.
+        The identifiers are formatted like in ``xrefs.tsv``, and the names are empty.
+    """
+    if graph is None:
+        import pyobo
+
+        graph = pyobo.get_obo_graph("chiro")
+
+    df = pd.DataFrame(
+        [
+            (node, relationship)
+            for node, relationships in graph.nodes(data="relationship")
+            if relationships
+            for relationship in relationships
+        ],
+        columns=["source_id", "relationship"],
+    )
+    df[["relation", "target_curie"]] = df["relationship"].str.split(" ", n=1, expand=True)
+    df["relation"] = df["relation"].str.replace("_of$", "", regex=True)
+    df["target_db"] = df["target_curie"].str.split(":", n=1).str[0].str.lower()
+    df["target_id"] = df["target_curie"].where(
+        ~df["target_db"].isin(BARE_PREFIXES), _get_local_ids(df["target_curie"])
+    )
+    return pd.DataFrame(
+        {
+            "source_db": "chebi",
+            "source_id": df["source_id"],
+            "source_name": None,
+            "modulation": df["relation"],
+            "target_type": df["target_db"].map(TARGET_TYPES),
+            "target_db": df["target_db"],
+            "target_id": df["target_id"],
+            "target_name": None,
+        },
+        columns=XREFS_COLUMNS,
+    )
+
+
+def _get_names(
+    prefix_to_ids: Mapping[str, Collection[str]], max_workers: Optional[int]
+) -> Mapping[str, Mapping[str, str]]:
+    """Look up the names of the entities in each namespace in parallel worker processes."""
+    # Parsing the caches is CPU-bound, so each namespace is loaded in its own process
+    with ProcessPoolExecutor(max_workers=max_workers or max(1, len(prefix_to_ids))) as executor:
+        futures = {
+            prefix: executor.submit(_lookup_names, prefix, identifiers)
+            for prefix, identifiers in prefix_to_ids.items()
+        }
+        return {prefix: future.result() for prefix, future in futures.items()}
+
+
+def _lookup_names(prefix: str, identifiers: Collection[str]) -> Dict[str, str]:
+    """Get the names of the given entities in a namespace, so only those are sent back."""
+    from ..bundle import get_id_name_mapping
+
+    id_to_name = get_id_name_mapping(prefix)
+    return {
+        identifier: id_to_name[identifier] for identifier in identifiers if identifier in id_to_name
+    }
+
+
+def get_chiro_import_df(
+    chiro_df: Optional[pd.DataFrame] = None,
+    xrefs_df: Optional[pd.DataFrame] = None,
+    *,
+    max_workers: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Get the relations from ChIRO that aren't curated yet.
+
+    Relations whose chemical or target can't be named are dropped, like ones whose
+    target is in a namespace outside of :data:`MAPPING_PREFIXES`.
+
+    :param chiro_df: ChIRO's relations. Defaults to :func:`get_chiro_df`.
+    :param xrefs_df: The curated relations. Defaults to ``xrefs.tsv``.
+    :param max_workers: The number of worker processes loading namespaces at once.
+        Defaults to one for each namespace.
+    :returns: A pair of dataframes with the columns of
+        :data:`chemical_roles.utils.XREFS_COLUMNS`, sorted. The first has the relations
+        whose chemical and target aren't related in the curated relations. The second
+        has the relations whose pairs are already curated, and also has the curated
+        modulations in a ``curated_modulation`` column.
+    """
+    if chiro_df is None:
+        chiro_df = get_chiro_df()
+    if xrefs_df is None:
+        from ..resources import get_xrefs_df
+
+        xrefs_df = get_xrefs_df()
+    xrefs_df = xrefs_df.rename(columns={"type": "target_type"})
+
+    unknown = chiro_df.loc[~chiro_df["target_db"].isin(MAPPING_PREFIXES), "target_db"]
+    for prefix, count in unknown.value_counts().items():
+        logger.warning("skipping %d relations to targets in unknown namespace %s", count, prefix)
+    chiro_df = chiro_df[chiro_df["target_db"].isin(MAPPING_PREFIXES)]
+
+    # Only load the namespaces that are actually used
+    prefixes = ["chebi", *sorted(set(chiro_df["target_db"]))]
+    source_ids = _get_local_ids(chiro_df["source_id"])
+    target_ids = _get_local_ids(chiro_df["target_id"])
+    names = _get_names(
+        {
+            "chebi": source_ids.unique().tolist(),
+            **{
+                prefix: target_ids[chiro_df["target_db"] == prefix].unique().tolist()
+                for prefix in prefixes[1:]
+            },
+        },
+        max_workers=max_workers,
+    )
+
+    target_names = pd.Series(index=chiro_df.index, dtype=object)
+    for prefix in prefixes[1:]:
+        idx = chiro_df["target_db"] == prefix
+        target_names[idx] = target_ids[idx].map(names[prefix])
+    chiro_df = chiro_df.assign(
+        source_name=source_ids.map(names["chebi"]),
+        target_name=target_names,
+    )
+    for side in ("source", "target"):
+        missing = chiro_df[f"{side}_name"].isna()
+        if missing.any():
+            logger.warning("skipping %d relations with unnamed %ss", missing.sum(), side)
+    chiro_df = chiro_df.dropna(subset=["source_name", "target_name"])
+
+    # Anti-join on the pairs, comparing local identifiers since the curation isn't uniform
+    keys = chiro_df[PAIR_COLUMNS].assign(
+        source_id=_get_local_ids(chiro_df["source_id"]),
+        target_id=_get_local_ids(chiro_df["target_id"]),
+    )
+    curated = (
+        xrefs_df[[*PAIR_COLUMNS, "modulation"]]
+        .dropna(subset=PAIR_COLUMNS)
+        .assign(
+            source_id=lambda df: _get_local_ids(df["source_id"]),
+            target_id=lambda df: _get_local_ids(df["target_id"]),
+        )
+        .groupby(PAIR_COLUMNS, sort=False)["modulation"]
+        .agg(lambda modulations: "|".join(sorted(set(modulations))))
+        .rename("curated_modulation")
+    )
+    curated_modulation = keys.join(curated, on=PAIR_COLUMNS)["curated_modulation"]
+    is_curated = curated_modulation.notna()
+
+    new_df = chiro_df[~is_curated]
+    curated_df = chiro_df[is_curated].assign(curated_modulation=curated_modulation[is_curated])
+    conflicts = (curated_df["modulation"] != curated_df["curated_modulation"]).sum()
+    logger.info(
+        "found %d new relations and %d already curated, of which %d have another modulation",
+        len(new_df.index),
+        len(curated_df.index),
+        conflicts,
+    )
+    return (
+        new_df.drop_duplicates().sort_values(XREFS_COLUMNS).reset_index(drop=True),
+        curated_df.drop_duplicates().sort_values(XREFS_COLUMNS).reset_index(drop=True),
+    )
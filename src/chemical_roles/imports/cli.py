@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""CLI for importing mappings and relations from other resources."""
+
+from typing import Optional
+
+import click
+from more_click import verbose_option
+
+from .wikidata import PAGE_SIZE, QUERIES, WIKIDATA_ENDPOINT_URL
+
+__all__ = [
+    "import_",
+]
+
+
+@click.group(name="import")
+def import_():
+    """Import mappings and relations from other resources."""
+
+
+@import_.command()
+@click.option(
+    "--endpoint",
+    default=WIKIDATA_ENDPOINT_URL,
+    show_default=True,
+    help="A SPARQL endpoint that returns CSV results, e.g., a local stand-in",
+)
+@click.option(
+    "--query",
+    "names",
+    type=click.Choice(list(QUERIES)),
+    multiple=True,
+    help="Only fetch these mappings. Defaults to all of them.",
+)
+@click.option(
+    "--directory",
+    type=click.Path(file_okay=False),
+    help="The directory the TSVs are written to. Defaults to the package's resources.",
+)
+@click.option("--page-size", type=int, default=PAGE_SIZE, show_default=True)
+@click.option(
+    "--workers",
+    type=int,
+    default=4,
+    show_default=True,
+    help="The number of shards fetched at once",
+)
+@click.option(
+    "--cache-directory",
+    type=click.Path(file_okay=False),
+    help="The directory the pages are cached in. Defaults to one under the PyStow directory.",
+)
+@click.option("--no-cache", is_flag=True, help="Don't read or write cached pages")
+@click.option("--refresh", is_flag=True, help="Fetch the cached pages again")
+@verbose_option
+def wikidata(
+    endpoint: str,
+    names,
+    directory: Optional[str],
+    page_size: int,
+    workers: int,
+    cache_directory: Optional[str],
+    no_cache: bool,
+    refresh: bool,
+):
+    """Write the mappings from HGNC and ChEBI to Wikidata."""
+    from .wikidata import write_wikidata_mappings
+
+    if no_cache:
+        cache_directory = None
+    elif cache_directory is None:
+        import pystow
+
+        cache_directory = str(pystow.join("chemical_roles", "wikidata"))
+
+    paths = write_wikidata_mappings(
+        names or None,
+        directory=directory,
+        endpoint=endpoint,
+        page_size=page_size,
+        max_workers=workers,
+        cache_directory=cache_directory,
+        refresh=refresh,
+    )
+    for name, path in paths.items():
+        click.echo(f"wrote {name} to {path}")
+
+
+@import_.command()
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="Where the new relations are written, like xrefs.tsv. Defaults to stdout.",
+)
+@click.option(
+    "--curated-output",
+    type=click.File("w"),
+    help="Where the relations whose pairs are already curated are written, with the "
+    "curated modulations, e.g., to review conflicts",
+)
+@click.option(
+    "--workers", type=int, help="The number of worker processes loading namespaces at once"
+)
+@verbose_option
+def chiro(output, curated_output, workers: Optional[int]):
+    """Write the relations from ChIRO that aren't curated yet."""
+    from .chiro import get_chiro_import_df
+
+    new_df, curated_df = get_chiro_import_df(max_workers=workers)
+    new_df.rename(columns={"target_type": "type"}).to_csv(output, sep="\t", index=False)
+    if curated_output is not None:
+        curated_df.rename(columns={"target_type": "type"}).to_csv(
+            curated_output, sep="\t", index=False
+        )
+
+
+if __name__ == "__main__":
+    import_()
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""Get the mappings from HGNC and ChEBI to Wikidata.
+
+Each query is split into shards by the first digit of its key, e.g., the HGNC
+identifier, and each shard is fetched in keyset-paginated pages: a page asks for
+the next rows in the order of the key starting from the last key of the previous
+page, so no page needs an ``OFFSET`` that the endpoint would have to skip over.
+The shards are fetched concurrently and the pages are read as CSV, one line at a
+time. Each page is cached in a directory under the query's hash, so running the
+import again (e.g., after it was interrupted) only fetches the pages it's missing.
+
+The endpoint can be any SPARQL endpoint that returns CSV results, e.g., a local
+stand-in::
+
+    from chemical_roles.imports.wikidata import write_wikidata_mappings
+
+    write_wikidata_mappings(
+        endpoint="http://localhost:8000/sparql",
+        directory="resources",
+        cache_directory="wikidata-pages",
+    )
+"""
+
+import contextlib
+import csv
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+)
+
+from ..resources import WD_CHEMICALS_PATH, WD_PROTEINS_PATH
+
+__all__ = [
+    "MappingQuery",
+    "QUERIES",
+    "get_wikidata_rows",
+    "write_wikidata_mappings",
+]
+
+logger = logging.getLogger(__name__)
+
+WIKIDATA_ENDPOINT_URL = "https://query.wikidata.org/sparql"
+#: The number of rows asked for in each page
+PAGE_SIZE = 10_000
+#: The shards of each query, by the first character of its key
+SHARDS = tuple("123456789")
+#: The statuses after which a page is requested again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = "chemical_roles (https://github.com/chemical-roles/chemical-roles)"
+
+
+def _get_local_name(iri: str) -> str:
+    return iri.rsplit("/", 1)[-1]
+
+
+class MappingQuery(NamedTuple):
+    """A query for mappings that's paginated by a key."""
+
+    #: The variables in the SELECT clause
+    variables: Tuple[str, ...]
+    #: The graph pattern in the WHERE clause
+    where: str
+    #: The variable that's paginated by, which is a string literal
+    key: str
+    #: The header of the TSV
+    header: Tuple[str, ...]
+    #: A function from a result to the values of its row in the TSV
+    get_row: Callable[[Mapping[str, str]], Tuple]
+
+    def get_sparql(self, shard: str, start: Optional[str], limit: int) -> str:
+        """Get the query for one page.
+
+        :param shard: The first character of the keys in the page
+        :param start: The smallest key in the page, if any
+        :param limit: The maximum number of results
+        :returns: The SPARQL query
+        """
+        key = f"STR(?{self.key})"
+        condition = f"STRSTARTS({key}, {_quote(shard)})"
+        if start is not None:
+            condition = f"{condition} && {key} >= {_quote(start)}"
+        return (
+            f"SELECT {' '.join('?' + variable for variable in self.variables)}\n"
+            f"WHERE {{\n{self.where}\nFILTER({condition})\n}}\n"
+            f"ORDER BY ?{self.key}\n"
+            f"LIMIT {limit}\n"
+        )
+
+
+def _quote(value: str) -> str:
+    """Quote a string literal in SPARQL."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+#: The queries and the TSVs they're written to
+QUERIES: Dict[str, Tuple[MappingQuery, str]] = {
+    "proteins": (
+        MappingQuery(
+            variables=("hgnc_id", "hgnc_symbol", "gene", "uniprot_id", "protein"),
+            where="""\
+?gene wdt:P354 ?hgnc_id ;
+      wdt:P353 ?hgnc_symbol ;
+      wdt:P688 ?protein .
+?protein wdt:P352 ?uniprot_id .""",
+            key="hgnc_id",
+            header=(
+                "hgnc_id",
+                "hgnc_symbol",
+                "gene_wikidata_id",
+                "uniprot_id",
+                "protein_wikidata_id",
+            ),
+            get_row=lambda result: (
+                int(result["hgnc_id"]),
+                result["hgnc_symbol"],
+                _get_local_name(result["gene"]),
+                result["uniprot_id"],
+                _get_local_name(result["protein"]),
+            ),
+        ),
+        WD_PROTEINS_PATH,
+    ),
+    "chemicals": (
+        MappingQuery(
+            variables=("chebi_id", "chemical"),
+            where="?chemical wdt:P683 ?chebi_id .",
+            key="chebi_id",
+            header=("chebi_id", "wikidata_id"),
+            get_row=lambda result: (int(result["chebi_id"]), _get_local_name(result["chemical"])),
+        ),
+        WD_CHEMICALS_PATH,
+    ),
+}
+
+
+@contextlib.contextmanager
+def _atomic_open(path: str) -> Iterator[TextIO]:
+    """Open a file for writing that only replaces the path once it's closed without errors."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", newline="") as file:
+            yield file
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+class _PageFetcher:
+    """Fetches pages from a SPARQL endpoint, with retries and an optional cache."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        cache_directory: Optional[str],
+        refresh: bool,
+        retries: int,
+        timeout: float,
+    ):
+        import requests
+
+        self.endpoint = endpoint
+        self.cache_directory = cache_directory
+        self.refresh = refresh
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Accept": "text/csv", "User-Agent": USER_AGENT})
+
+    def _get_response(self, sparql: str):
+        import requests
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    self.endpoint, data={"query": sparql}, stream=True, timeout=self.timeout
+                )
+            except requests.ConnectionError:
+                if attempt >= self.retries:
+                    raise
+                delay = 2.0**attempt
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    response.raise_for_status()
+                    # CSV results are UTF-8, even when the response doesn't say so
+                    response.encoding = "utf-8"
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else 2.0**attempt
+                response.close()
+            attempt += 1
+            logger.info("retrying page in %.0fs (attempt %d)", delay, attempt)
+            time.sleep(delay)
+
+    def iter_results(self, sparql: str) -> Iterator[Dict[str, str]]:
+        """Iterate over the results of a query, reading them one line at a time."""
+        if self.cache_directory is None:
+            with self._get_response(sparql) as response:
+                yield from csv.DictReader(response.iter_lines(decode_unicode=True))
+            return
+
+        key = hashlib.sha256(f"{self.endpoint}\n{sparql}".encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_directory, f"{key}.csv")
+        if self.refresh or not os.path.exists(path):
+            with self._get_response(sparql) as response, _atomic_open(path) as file:
+                for line in response.iter_lines(decode_unicode=True):
+                    print(line, file=file)
+        else:
+            logger.debug("using cached page %s", path)
+        with open(path, newline="") as file:
+            yield from csv.DictReader(file)
+
+
+def _iter_shard(
+    fetcher: _PageFetcher, query: MappingQuery, shard: str, page_size: int
+) -> Iterator[Dict[str, str]]:
+    """Iterate over the results of a shard, page by page."""
+    start, limit = None, page_size
+    while True:
+        results = list(fetcher.iter_results(query.get_sparql(shard, start, limit)))
+        if len(results) < limit:
+            yield from results
+            return
+        # The last key might continue on the next page, so its results are fetched again there
+        last = results[-1][query.key]
+        complete = [result for result in results if result[query.key] != last]
+        if not complete:
+            # A single key has more results than fit in a page
+            limit *= 2
+            continue
+        yield from complete
+        start, limit = last, page_size
+
+
+def get_wikidata_rows(
+    names: Optional[Iterable[str]] = None,
+    *,
+    endpoint: str = WIKIDATA_ENDPOINT_URL,
+    page_size: int = PAGE_SIZE,
+    max_workers: int = 4,
+    cache_directory: Optional[str] = None,
+    refresh: bool = False,
+    retries: int = 5,
+    timeout: float = 300.0,
+) -> Dict[str, List[Tuple]]:
+    """Fetch the sorted rows of the mappings from Wikidata.
+
+    :param names: The keys of :data:`QUERIES` to fetch. Defaults to all of them.
+    :param endpoint: The URL of the SPARQL endpoint
+    :param page_size: The number of results asked for in each page
+    :param max_workers: The number of shards fetched at once. The Wikidata Query
+        Service allows five concurrent queries from each client.
+    :param cache_directory: If given, the directory in which pages are cached
+    :param refresh: Should cached pages be fetched again?
+    :param retries: How many times a page is requested again after a connection error
+        or a rate limit or server error
+    :param timeout: The timeout of each request in seconds
+    :returns: A dictionary from the name of each query to its rows, sorted
+    """
+    if names is None:
+        names = list(QUERIES)
+    if cache_directory is not None:
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def _fetch(name: str, shard: str) -> List[Tuple]:
+        query, _ = QUERIES[name]
+        fetcher = _PageFetcher(endpoint, cache_directory, refresh, retries, timeout)
+        rows = [query.get_row(result) for result in _iter_shard(fetcher, query, shard, page_size)]
+        logger.info("fetched %d %s in shard %s", len(rows), name, shard)
+        return rows
+
+    tasks = [(name, shard) for name in names for shard in SHARDS]
+    rv: Dict[str, List[Tuple]] = {name: [] for name in names}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (name, _), rows in zip(tasks, executor.map(lambda task: _fetch(*task), tasks)):
+            rv[name].extend(rows)
+    for rows in rv.values():
+        rows.sort()
+    return rv
+
+
+def write_wikidata_mappings(
+    names: Optional[Iterable[str]] = None,
+    *,
+    directory: Optional[str] = None,
+    **kwargs,
+) -> Dict[str, str]:
+    """Fetch the mappings from Wikidata and write them as TSVs.
+
+    Each TSV is only replaced once all of its rows were fetched.
+
+    :param names: The keys of :data:`QUERIES` to fetch. Defaults to all of them.
+    :param directory: The directory of the TSVs. Defaults to the package's resources.
+    :param kwargs: Keyword arguments passed to :func:`get_wikidata_rows`, like
+        ``endpoint`` and ``cache_directory``
+    :returns: A dictionary from the name of each query to the path of its TSV
+    """
+    rv = {}
+    name_to_rows = get_wikidata_rows(names, **kwargs)
+    for name, rows in name_to_rows.items():
+        query, path = QUERIES[name]
+        if directory is not None:
+            path = os.path.join(directory, os.path.basename(path))
+        with _atomic_open(path) as file:
+            writer = csv.writer(file, delimiter="\t", lineterminator="\n")
+            writer.writerow(query.header)
+            writer.writerows(rows)
+        logger.info("wrote %d %s to %s", len(rows), name, path)
+        rv[name] = path
+    return rv
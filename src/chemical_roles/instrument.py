@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""Instrument the stages of inference and export with named spans.
+
+Code marks its stages with :func:`span`, which records nothing unless a
+:class:`Recorder` is active, e.g., in :func:`profiling`::
+
+    from chemical_roles.instrument import profiling, span
+
+    with profiling(report_path="profile.json"):
+        with span("famplex") as s:
+            famplex_id_to_members = _get_famplex()
+            s.count("families", len(famplex_id_to_members))
+
+Each span records its wall time, CPU time, the process's peak resident set size
+when it ends, its peak traced memory (if :mod:`tracemalloc` is enabled), and any
+counters set with :meth:`Span.count`. Spans opened inside other spans in the same
+thread are nested under them. The spans can be written as a JSON report and as
+a `speedscope <https://www.speedscope.app>`_ profile.
+"""
+
+import contextlib
+import itertools as itt
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+__all__ = [
+    "Span",
+    "Recorder",
+    "span",
+    "get_recorder",
+    "recording",
+    "profiling",
+]
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+#: The active recorder, if any
+_recorder: Optional["Recorder"] = None
+#: The stack of open spans in each thread
+_local = threading.local()
+_ids = itt.count()
+
+
+def _get_max_rss() -> Optional[int]:
+    """Get the peak resident set size of the process, in bytes."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes and macOS reports bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class Span:
+    """A named stage whose time, memory, and counters are recorded."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **counters: int):
+        """Initialize the span.
+
+        :param name: The name of the stage
+        :param parent: The enclosing span, if any
+        :param counters: The initial values of counters, like the number of rows
+        """
+        self.name = name
+        self.parent = parent
+        self.id = f"{os.getpid()}-{next(_ids)}"
+        self.counters: Dict[str, int] = dict(counters)
+        self.start = time.time()
+        self.wall_time: Optional[float] = None
+        self.cpu_time: Optional[float] = None
+        self.max_rss: Optional[int] = None
+        self.peak_memory: Optional[int] = None
+        self._perf_counter = time.perf_counter()
+        self._process_time = time.process_time()
+        self._peak = 0
+
+    @property
+    def path(self) -> str:
+        """Get the names of this span and the spans enclosing it, separated by slashes."""
+        return self.name if self.parent is None else f"{self.parent.path}/{self.name}"
+
+    def count(self, key: str, n: int = 1) -> None:
+        """Add to a counter."""
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def _reset_peak(self) -> None:
+        """Keep the peak so far, then reset it so an enclosed span can measure its own."""
+        if tracemalloc.is_tracing():
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            # The peak can't be reset before Python 3.9, so enclosing peaks are kept instead
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+
+    def _finish(self) -> None:
+        self.wall_time = time.perf_counter() - self._perf_counter
+        self.cpu_time = time.process_time() - self._process_time
+        self.max_rss = _get_max_rss()
+        if tracemalloc.is_tracing():
+            self.peak_memory = max(self._peak, tracemalloc.get_traced_memory()[1])
+            if self.parent is not None:
+                self.parent._peak = max(self.parent._peak, self.peak_memory)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the span as a JSON-serializable dictionary."""
+        return {
+            "id": self.id,
+            "parent": None if self.parent is None else self.parent.id,
+            "name": self.name,
+            "path": self.path,
+            "pid": os.getpid(),
+            "start": self.start,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "max_rss": self.max_rss,
+            "peak_memory": self.peak_memory,
+            "counters": self.counters,
+        }
+
+
+def _get_stack() -> List[Span]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextlib.contextmanager
+def span(name: str, **counters: int) -> Iterable[Span]:
+    """Record a stage, if a recorder is active.
+
+    :param name: The name of the stage
+    :param counters: The initial values of counters, like the number of input rows
+    :yields: The span, whose counters can be updated with :meth:`Span.count`
+    """
+    stack = _get_stack()
+    parent = stack[-1] if stack else None
+    s = Span(name, parent=parent, **counters)
+    recorder = _recorder
+    if recorder is None:
+        yield s
+        return
+
+    if parent is not None:
+        parent._reset_peak()
+    elif tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    stack.append(s)
+    try:
+        yield s
+    finally:
+        stack.pop()
+        s._finish()
+        recorder.add([s.as_dict()])
+        logger.debug("%s took %.3fs", s.path, s.wall_time)
+
+
+class Recorder:
+    """Collects the spans recorded while it's active."""
+
+    def __init__(self, trace_memory: bool = False):
+        """Initialize the recorder.
+
+        :param trace_memory: Should the peak memory of each span be traced with
+            :mod:`tracemalloc`? This makes the instrumented code several times slower.
+        """
+        self.trace_memory = trace_memory
+        self.start = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, spans: Iterable[Mapping[str, Any]]) -> None:
+        """Add finished spans, e.g., from a worker process."""
+        with self._lock:
+            self.spans.extend(spans)
+
+    def get_totals(self) -> Dict[str, Dict[str, Any]]:
+        """Aggregate the spans by their path."""
+        rv: Dict[str, Dict[str, Any]] = {}
+        for s in self.spans:
+            total = rv.setdefault(
+                s["path"], {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "counters": {}}
+            )
+            total["calls"] += 1
+            total["wall_time"] += s["wall_time"]
+            total["cpu_time"] += s["cpu_time"]
+            for key in ("max_rss", "peak_memory"):
+                if s[key] is not None:
+                    total[key] = max(total.get(key, 0), s[key])
+            for key, value in s["counters"].items():
+                total["counters"][key] = total["counters"].get(key, 0) + value
+        return rv
+
+    def get_report(self) -> Dict[str, Any]:
+        """Get a JSON-serializable report of the spans and their totals."""
+        return {
+            "metadata": {
+                "argv": sys.argv,
+                "start": self.start,
+                "python": sys.version.split()[0],
+                "trace_memory": self.trace_memory,
+            },
+            "totals": self.get_totals(),
+            "spans": sorted(self.spans, key=lambda s: s["start"]),
+        }
+
+    def write_report(self, path: str) -> None:
+        """Write the report as JSON."""
+        with open(path, "w") as file:
+            json.dump(self.get_report(), file, indent=2)
+
+    def get_speedscope(self) -> Dict[str, Any]:
+        """Get the spans as a speedscope profile, with one timeline for each process."""
+        frames: List[Dict[str, str]] = []
+        frame_ids: Dict[str, int] = {}
+        profiles = []
+        for pid in sorted({s["pid"] for s in self.spans}):
+            spans = sorted(
+                (s for s in self.spans if s["pid"] == pid),
+                key=lambda s: (s["start"], s["path"].count("/")),
+            )
+            events: List[Dict[str, Any]] = []
+            stack: List[Dict[str, Any]] = []
+            at = 0.0
+
+            def _close(until: Optional[float] = None) -> None:
+                nonlocal at
+                top = stack.pop()
+                end = top["start"] - self.start + top["wall_time"]
+                at = max(at, end if until is None else min(end, until))
+                events.append({"type": "C", "frame": frame_ids[top["path"]], "at": at})
+
+            for s in spans:
+                start = s["start"] - self.start
+                while stack and stack[-1]["id"] != s["parent"]:
+                    _close(until=start)
+                if s["path"] not in frame_ids:
+                    frame_ids[s["path"]] = len(frames)
+                    frames.append({"name": s["name"], "file": s["path"]})
+                at = max(at, start)
+                events.append({"type": "O", "frame": frame_ids[s["path"]], "at": at})
+                stack.append(s)
+            while stack:
+                _close()
+
+            profiles.append(
+                {
+                    "type": "evented",
+                    "name": f"process {pid}",
+                    "unit": "seconds",
+                    "startValue": events[0]["at"] if events else 0.0,
+                    "endValue": at,
+                    "events": events,
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": " ".join(sys.argv),
+            "exporter": "chemical_roles",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def write_speedscope(self, path: str) -> None:
+        """Write the spans as a speedscope profile."""
+        with open(path, "w") as file:
+            json.dump(self.get_speedscope(), file)
+
+
+def get_recorder() -> Optional[Recorder]:
+    """Get the active recorder, if any."""
+    return _recorder
+
+
+@contextlib.contextmanager
+def recording(trace_memory: bool = False) -> Iterable[Recorder]:
+    """Record the spans opened in this process.
+
+    :param trace_memory: Should the peak memory of each span be traced with :mod:`tracemalloc`?
+    :yields: The recorder
+    """
+    global _recorder
+    previous, previous_stack = _recorder, _get_stack()
+    _recorder = Recorder(trace_memory=trace_memory)
+    # Spans left open in a forked parent process aren't this recorder's
+    _local.stack = []
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        yield _recorder
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _recorder, _local.stack = previous, previous_stack
+
+
+@contextlib.contextmanager
+def profiling(
+    report_path: Optional[str] = None,
+    *,
+    cprofile_path: Optional[str] = None,
+    speedscope_path: Optional[str] = None,
+    trace_memory: bool = False,
+) -> Iterable[Recorder]:
+    """Record the spans, then write them out.
+
+    :param report_path: If given, where the JSON report of the spans is written
+    :param cprofile_path: If given, where a :mod:`cProfile` dump of this process is written.
+        Stages run in worker processes aren't included.
+    :param speedscope_path: If given, where the spans are written as a speedscope profile
+    :param trace_memory: Should the peak memory of each span be traced with :mod:`tracemalloc`?
+    :yields: The recorder
+    """
+    profiler = None
+    if cprofile_path is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+    with recording(trace_memory=trace_memory) as recorder:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            with span("main"):
+                yield recorder
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(cprofile_path)
+                logger.info("wrote cProfile dump to %s", cprofile_path)
+            if report_path is not None:
+                recorder.write_report(report_path)
+                logger.info("wrote profile report to %s", report_path)
+            if speedscope_path is not None:
+                recorder.write_speedscope(speedscope_path)
+                logger.info("wrote speedscope profile to %s", speedscope_path)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""A :mod:`click` group that imports its subcommands only when they're invoked."""
+
+import importlib
+from typing import Mapping, Optional, Tuple
+
+import click
+
+__all__ = [
+    "LazyGroup",
+]
+
+
+class LazyGroup(click.Group):
+    """A group whose subcommands are imported from their modules on first use.
+
+    Each lazy subcommand is given by the import path of the command and its
+    short help, so listing the commands in ``--help`` doesn't import anything::
+
+        @click.group(
+            cls=LazyGroup,
+            lazy_subcommands={"export": ("chemical_roles.export.cli:export", "Export the database.")},
+        )
+        def main():
+            ...
+    """
+
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Optional[Mapping[str, Tuple[str, str]]] = None,
+        **kwargs,
+    ):
+        """Initialize the group.
+
+        :param lazy_subcommands: A mapping from each subcommand's name to a pair of
+            its import path, like ``package.module:command``, and its short help
+        """
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = dict(lazy_subcommands or {})
+
+    def list_commands(self, ctx: click.Context):  # noqa:D102
+        return sorted({*super().list_commands(ctx), *self.lazy_subcommands})
+
+    def get_command(self, ctx: click.Context, cmd_name: str):  # noqa:D102
+        if cmd_name not in self.commands and cmd_name in self.lazy_subcommands:
+            self.add_command(self._load(cmd_name), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load(self, cmd_name: str) -> click.Command:
+        import_path, _ = self.lazy_subcommands[cmd_name]
+        module_name, _, attr = import_path.partition(":")
+        command = getattr(importlib.import_module(module_name), attr)
+        if not isinstance(command, click.Command):
+            raise TypeError(f"{import_path} is not a click command")
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        """Write the commands' short help, without importing the ones not yet loaded."""
+        limit = formatter.width - 6 - max(map(len, self.list_commands(ctx)), default=0)
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                if command.hidden:
+                    continue
+                rows.append((name, command.get_short_help_str(limit)))
+            else:
+                rows.append((name, self.lazy_subcommands[name][1]))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
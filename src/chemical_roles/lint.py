@@ -4,12 +4,10 @@
 
 import sys
 
-import bioregistry
 import click
 from more_click import verbose_option
 
 from .resources import XREFS_PATH, get_xrefs_df
-from .utils import get_single_mappings, sort_xrefs_df
 
 
 @click.group()
@@ -36,6 +34,8 @@ def tabs():
 @verbose_option
 def mappings():
     """Find single mapped entries."""
+    from .utils import get_single_mappings
+
     df = get_xrefs_df()
 
     idx = (df["target_db"] == "pr") & (df["type"] == "protein")
@@ -82,12 +82,16 @@ def _p(errors):
 @lint.command()
 def sort():
     """Sort the entries."""
+    from .utils import sort_xrefs_df
+
     sort_xrefs_df()
 
 
 @lint.command()
 def validate():
     """Validate identifiers."""
+    import bioregistry
+
     df = get_xrefs_df()
     for i, (prefix, identifier) in df[["source_db", "source_id"]].iterrows():
         norm_prefix = bioregistry.normalize_prefix(prefix)
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+"""Query the inferred relations in memory.
+
+The relations are loaded once into a :class:`RelationIndex`, which keeps the
+CURIEs in a dictionary and the relations as arrays of integer codes sorted by
+source and by target, so a lookup is a hash table access followed by a
+contiguous slice::
+
+    from chemical_roles.query import get_index
+
+    index = get_index()
+    index.get_targets("chebi:15365", modulation="inhibitor")
+    index.get_chemicals("hgnc:9604")
+
+The index is immutable once it's built, so it can be shared between threads
+without locking.
+"""
+
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import List, Mapping, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .constants import RELATIONS_OUTPUT_PATH
+from .utils import normalize_curie
+
+__all__ = [
+    "Relation",
+    "RelationIndex",
+    "get_index",
+    "get_role_chemicals",
+    "load_relations_df",
+    "normalize_curie_str",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class Relation(NamedTuple):
+    """A relation between a chemical and a target, in the shape of a row of ``relations.tsv``."""
+
+    source_db: str
+    source_id: str
+    source_name: Optional[str]
+    modulation: str
+    target_type: Optional[str]
+    target_db: str
+    target_id: str
+    target_name: Optional[str]
+
+
+def normalize_curie_str(curie: str) -> str:
+    """Normalize a CURIE string, e.g., ``CHEBI:15365`` to ``chebi:15365``."""
+    prefix, _, identifier = curie.partition(":")
+    return ":".join(normalize_curie(prefix, identifier))
+
+
+def _freeze(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+class _Adjacency(NamedTuple):
+    """Positions of relations grouped by an entity, in compressed sparse row layout."""
+
+    #: Positions of relations, sorted by the entity
+    order: np.ndarray
+    #: Offsets into ``order`` for each entity code, with one extra at the end
+    offsets: np.ndarray
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, size: int) -> "_Adjacency":
+        order = np.argsort(codes, kind="stable").astype(np.int32)
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=size), out=offsets[1:])
+        return cls(_freeze(order), _freeze(offsets))
+
+    def get(self, code: int) -> np.ndarray:
+        return self.order[self.offsets[code] : self.offsets[code + 1]]
+
+
+class RelationIndex:
+    """An immutable index over relations for lookups by chemical, target, and role."""
+
+    def __init__(self, df: pd.DataFrame):
+        """Build an index from a relations dataframe.
+
+        :param df: A relations dataframe, as from :func:`chemical_roles.export.utils.get_relations_df`
+            or as read from ``relations.tsv``. Redundant prefixes in identifiers are removed.
+        """
+        df = df.rename(columns={"type": "target_type"})
+        df = df.dropna(subset=["source_db", "source_id", "modulation", "target_db", "target_id"])
+
+        sources = [
+            ":".join(normalize_curie(prefix, identifier))
+            for prefix, identifier in zip(df["source_db"].values, df["source_id"].values)
+        ]
+        targets = [
+            ":".join(normalize_curie(prefix, identifier))
+            for prefix, identifier in zip(df["target_db"].values, df["target_id"].values)
+        ]
+        codes, curies = pd.factorize(pd.Series(sources + targets), sort=True)
+        names = pd.concat([df["source_name"], df["target_name"]], ignore_index=True)
+        # Take the first name given for each CURIE
+        first = pd.Series(names.values).groupby(codes, sort=True).first()
+
+        #: The CURIEs, sorted, and their names
+        self.curies: Tuple[str, ...] = tuple(curies)
+        self.names: Tuple[Optional[str], ...] = tuple(
+            None if pd.isna(name) else name for name in first.reindex(range(len(curies))).values
+        )
+        self._curie_to_code: Mapping[str, int] = {curie: i for i, curie in enumerate(curies)}
+
+        # Relations that are duplicated after normalizing the identifiers are only kept once
+        n = len(df.index)
+        modulation_codes, self.modulations = pd.factorize(df["modulation"], sort=True)
+        # Missing target types get the code -1, which is given back as None
+        type_codes, self.target_types = pd.factorize(df["target_type"], sort=True)
+        relations = pd.DataFrame(
+            {
+                "source": codes[:n].astype(np.int32),
+                "target": codes[n:].astype(np.int32),
+                "modulation": modulation_codes.astype(np.int8),
+                "target_type": type_codes.astype(np.int8),
+            }
+        ).drop_duplicates(["source", "modulation", "target"])
+
+        self._source = _freeze(relations["source"].values.copy())
+        self._target = _freeze(relations["target"].values.copy())
+        self._modulation = _freeze(relations["modulation"].values.copy())
+        self._target_type = _freeze(relations["target_type"].values.copy())
+        self._by_source = _Adjacency.from_codes(self._source, len(self.curies))
+        self._by_target = _Adjacency.from_codes(self._target, len(self.curies))
+        self._chemicals = frozenset(self.curies[code] for code in np.unique(self._source))
+
+    @classmethod
+    def from_path(cls, path: str = RELATIONS_OUTPUT_PATH) -> "RelationIndex":
+        """Build an index from a relations TSV, like ``relations.tsv``."""
+        return cls(pd.read_csv(path, sep="\t", dtype=str))
+
+    def __len__(self) -> int:  # noqa:D105
+        return len(self._source)
+
+    def __contains__(self, curie: str) -> bool:  # noqa:D105
+        return normalize_curie_str(curie) in self._curie_to_code
+
+    def _get_code(self, curie: str) -> Optional[int]:
+        return self._curie_to_code.get(normalize_curie_str(curie))
+
+    def _filter(
+        self,
+        positions: np.ndarray,
+        modulation: Optional[str],
+        target_type: Optional[str],
+    ) -> np.ndarray:
+        for value, labels, codes in [
+            (modulation, self.modulations, self._modulation),
+            (target_type, self.target_types, self._target_type),
+        ]:
+            if value is None:
+                continue
+            i = labels.get_indexer([value])[0]
+            if i < 0:
+                return positions[:0]
+            positions = positions[codes[positions] == i]
+        return positions
+
+    def _get_relations(self, positions: np.ndarray) -> List[Relation]:
+        rv = []
+        for position in positions.tolist():
+            source, target = self._source[position], self._target[position]
+            source_db, source_id = self.curies[source].split(":", 1)
+            target_db, target_id = self.curies[target].split(":", 1)
+            type_code = self._target_type[position]
+            rv.append(
+                Relation(
+                    source_db,
+                    source_id,
+                    self.names[source],
+                    self.modulations[self._modulation[position]],
+                    self.target_types[type_code] if type_code >= 0 else None,
+                    target_db,
+                    target_id,
+                    self.names[target],
+                )
+            )
+        return rv
+
+    def get_targets(
+        self,
+        curie: str,
+        modulation: Optional[str] = None,
+        target_type: Optional[str] = None,
+    ) -> List[Relation]:
+        """Get the relations from a chemical (or role) to its targets.
+
+        :param curie: The CURIE of the chemical, e.g., ``chebi:15365``
+        :param modulation: If given, only get relations with this modulation, e.g., ``inhibitor``
+        :param target_type: If given, only get relations to targets of this type, e.g., ``protein``
+        :returns: The matching relations, ordered by target
+        """
+        code = self._get_code(curie)
+        if code is None:
+            return []
+        positions = self._filter(self._by_source.get(code), modulation, target_type)
+        return self._get_relations(positions)
+
+    def get_chemicals(
+        self,
+        curie: str,
+        modulation: Optional[str] = None,
+        target_type: Optional[str] = None,
+    ) -> List[Relation]:
+        """Get the relations to a target from the chemicals that modulate it.
+
+        :param curie: The CURIE of the target, e.g., ``hgnc:9604``
+        :param modulation: If given, only get relations with this modulation, e.g., ``inhibitor``
+        :param target_type: If given, only match if the target is of this type
+        :returns: The matching relations, ordered by chemical
+        """
+        code = self._get_code(curie)
+        if code is None:
+            return []
+        positions = self._filter(self._by_target.get(code), modulation, target_type)
+        return self._get_relations(positions)
+
+    def get_role_chemicals(
+        self,
+        curie: str,
+        modulation: Optional[str] = None,
+        target_type: Optional[str] = None,
+    ) -> List[str]:
+        """Get the chemicals in the index that have a role or any of its descendant roles.
+
+        :param curie: The CURIE of the ChEBI role, e.g., ``chebi:35222`` for inhibitor
+        :param modulation: If given, only get chemicals with relations with this modulation
+        :param target_type: If given, only get chemicals with relations to targets of this type
+        :returns: The sorted CURIEs of the matching chemicals
+        """
+        chemicals = get_role_chemicals(curie) & self._chemicals
+        if modulation is None and target_type is None:
+            return sorted(chemicals)
+        return sorted(
+            chemical
+            for chemical in chemicals
+            if self._filter(
+                self._by_source.get(self._curie_to_code[chemical]), modulation, target_type
+            ).size
+        )
+
+
+_index: Optional[RelationIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> RelationIndex:
+    """Get the index over the inferred relations, loading it on first use.
+
+    The relations are read from ``relations.tsv`` if it's been exported, and
+    are otherwise assembled with :func:`chemical_roles.export.utils.get_relations_df`.
+    Concurrent callers wait for the first one to finish loading, then all share the same index.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_index()
+    return _index
+
+
+def _load_index() -> RelationIndex:
+    return RelationIndex(load_relations_df())
+
+
+def load_relations_df(path: str = RELATIONS_OUTPUT_PATH) -> pd.DataFrame:
+    """Load the inferred relations from a snapshot, or assemble them if there's none.
+
+    :param path: The path to a relations TSV, like ``relations.tsv``
+    :returns: The inferred relations
+    """
+    if os.path.exists(path):
+        logger.info("loading relations from %s", path)
+        return pd.read_csv(path, sep="\t", dtype=str)
+
+    from .export.utils import get_relations_df
+
+    logger.info("assembling the inferred relations")
+    return get_relations_df()
+
+
+_role_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_role_to_children() -> Mapping[str, Set[Tuple[str, str]]]:
+    from .bundle import get_role_to_children
+
+    return get_role_to_children()
+
+
+@lru_cache(maxsize=1024)
+def _get_role_chemicals(role_id: str) -> frozenset:
+    import pyobo
+
+    from .bundle import get_descendants
+
+    role_ids = {role_id}
+    role_ids.update(pyobo.normalize_curie(curie)[1] for curie in get_descendants("chebi", role_id))
+    role_to_children = _get_role_to_children()
+    return frozenset(
+        ":".join(normalize_curie(prefix, identifier))
+        for sub_role_id in role_ids
+        for prefix, identifier in role_to_children.get(sub_role_id, [])
+    )
+
+
+def get_role_chemicals(curie: str) -> Set[str]:
+    """Get the chemicals that have a ChEBI role or any of its descendant roles.
+
+    The ChEBI role assertions and hierarchy are loaded with :mod:`pyobo` on first
+    use, and the closure for each role is cached.
+
+    :param curie: The CURIE of the ChEBI role, e.g., ``chebi:35222``
+    :returns: The CURIEs of the chemicals with the role
+    """
+    prefix, identifier = normalize_curie(*curie.split(":", 1))
+    if prefix != "chebi":
+        raise ValueError(f"roles are only available for ChEBI, not {curie}")
+    # lru_cache isn't safe against concurrent first calls doing the work twice
+    with _role_lock:
+        return _get_role_chemicals(identifier)
@@ -3,8 +3,10 @@
 """Chemical Roles resources."""
 
 import os
+from typing import TYPE_CHECKING
 
-import pandas as pd
+if TYPE_CHECKING:
+    import pandas as pd
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 
@@ -14,20 +16,28 @@ UNCURATED_MESH_PATH = os.path.join(HERE, "uncurated_mesh.tsv")
 XREFS_PATH = os.path.join(HERE, "xrefs.tsv")
 IRRELEVANT_ROLES_PATH = os.path.join(HERE, "irrelevant_roles.tsv")
 BLACKLIST_ROLES_PATH = os.path.join(HERE, "blacklist.tsv")
+WD_PROTEINS_PATH = os.path.join(HERE, "wd_proteins.tsv")
+WD_CHEMICALS_PATH = os.path.join(HERE, "wd_chemicals.tsv")
 
 
-def get_xrefs_df() -> pd.DataFrame:
+def get_xrefs_df() -> "pd.DataFrame":
     """Get xrefs.tsv."""
+    import pandas as pd
+
     return pd.read_csv(XREFS_PATH, sep="\t", comment="#", dtype=str)
 
 
-def get_irrelevant_roles_df() -> pd.DataFrame:
+def get_irrelevant_roles_df() -> "pd.DataFrame":
     """Get irrelevant roles."""
+    import pandas as pd
+
     return pd.read_csv(
         IRRELEVANT_ROLES_PATH, sep="\t", dtype=str, comment="#", skip_blank_lines=True
     )
 
 
-def get_blacklist_roles_df() -> pd.DataFrame:
+def get_blacklist_roles_df() -> "pd.DataFrame":
     """Get roles blacklisted (should not be curated)."""
+    import pandas as pd
+
     return pd.read_csv(BLACKLIST_ROLES_PATH, sep="\t", dtype=str)
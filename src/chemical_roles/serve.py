@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""Serve lookups over the relations as JSON over HTTP.
+
+The service is built on the standard library's threaded HTTP server and a
+:class:`chemical_roles.query.RelationIndex`. It has the following endpoints:
+
+- ``GET /chemical/<curie>`` gets the relations from a chemical to its targets
+- ``GET /target/<curie>`` gets the relations to a target from its chemicals
+- ``GET /role/<curie>`` gets the chemicals with a ChEBI role
+- ``POST /batch`` takes a JSON object like ``{"chemicals": [...], "targets": [...], "roles": [...]}``
+  and returns an object with the same keys, mapping each CURIE to its results
+
+Each of them takes optional ``modulation`` and ``target_type`` filters, as query
+parameters or as keys in the batch object. Responses for single CURIEs are kept in
+an LRU cache, which is dropped whenever the index is reloaded from a new snapshot.
+"""
+
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import click
+from more_click import verbose_option
+
+from .constants import RELATIONS_OUTPUT_PATH
+from .query import RelationIndex
+
+__all__ = [
+    "RelationService",
+    "make_server",
+    "serve",
+]
+
+logger = logging.getLogger(__name__)
+
+#: The kinds of lookups, by the keys used in batch queries
+BATCH_KEYS = {
+    "chemicals": "chemical",
+    "targets": "target",
+    "roles": "role",
+}
+
+
+class RelationService:
+    """Lookups over a relations index that's reloaded when its snapshot changes."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        cache_size: int = 4096,
+        reload_interval: float = 2.0,
+    ):
+        """Initialize the service.
+
+        :param path: The path to a relations snapshot, like ``relations.tsv``. If
+            none is given, the relations are assembled with
+            :func:`chemical_roles.export.utils.get_relations_df` and never reloaded.
+        :param cache_size: The number of responses kept in the LRU cache
+        :param reload_interval: The number of seconds between checks for a new snapshot
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self._stamp = self._get_stamp()
+        self._pending: Optional[Tuple[float, int]] = None
+        # The index and its cache are swapped together so requests never see a stale cache
+        self._state = self._load()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _get_stamp(self) -> Optional[Tuple[float, int]]:
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.path)
+        return stat.st_mtime, stat.st_size
+
+    def _load(self) -> Tuple[RelationIndex, Callable[..., bytes]]:
+        if self.path is None:
+            from .export.utils import get_relations_df
+
+            index = RelationIndex(get_relations_df())
+        else:
+            logger.info("loading relations from %s", self.path)
+            index = RelationIndex.from_path(self.path)
+        logger.info("loaded %d relations", len(index))
+
+        @lru_cache(maxsize=self.cache_size)
+        def _lookup(kind: str, curie: str, modulation, target_type) -> bytes:
+            return _dumps(_query(index, kind, curie, modulation, target_type))
+
+        return index, _lookup
+
+    @property
+    def index(self) -> RelationIndex:
+        """Get the current index."""
+        return self._state[0]
+
+    def lookup(
+        self,
+        kind: str,
+        curie: str,
+        modulation: Optional[str] = None,
+        target_type: Optional[str] = None,
+    ) -> bytes:
+        """Get the JSON-encoded results for a single lookup, from the cache if possible."""
+        _, _lookup = self._state
+        return _lookup(kind, curie, modulation, target_type)
+
+    def batch(self, query: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Get the results for many CURIEs at once, sharing one version of the index.
+
+        :raises ValueError: If the filters aren't strings or the CURIEs aren't lists of strings
+        """
+        for key in ("modulation", "target_type"):
+            if query.get(key) is not None and not isinstance(query[key], str):
+                raise ValueError(f"{key} should be a string")
+        for key in BATCH_KEYS:
+            curies = query.get(key, [])
+            if not isinstance(curies, list) or not all(isinstance(curie, str) for curie in curies):
+                raise ValueError(f"{key} should be a list of CURIEs")
+
+        index, _ = self._state
+        modulation, target_type = query.get("modulation"), query.get("target_type")
+        return {
+            key: {
+                curie: _query(index, kind, curie, modulation, target_type)
+                for curie in query.get(key, [])
+            }
+            for key, kind in BATCH_KEYS.items()
+            if key in query
+        }
+
+    def reload_if_changed(self) -> bool:
+        """Reload the index if the snapshot was rewritten and has since stopped changing.
+
+        A snapshot is only loaded once its modification time and size are the same
+        on two consecutive checks, so a file that's still being written is skipped.
+
+        :returns: If the index was reloaded
+        """
+        stamp = self._get_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        if stamp != self._pending:
+            self._pending = stamp
+            return False
+        try:
+            state = self._load()
+        except Exception:  # noqa:B902
+            logger.exception("could not reload %s, keeping the current index", self.path)
+            return False
+        self._state, self._stamp = state, stamp
+        return True
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.reload_interval):
+            self.reload_if_changed()
+
+    def start_watching(self) -> None:
+        """Start checking for new snapshots in a background thread."""
+        if self.path is None or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="snapshot-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        """Stop checking for new snapshots."""
+        self._stop.set()
+
+
+def _query(
+    index: RelationIndex,
+    kind: str,
+    curie: str,
+    modulation: Optional[str],
+    target_type: Optional[str],
+) -> Any:
+    if kind == "chemical":
+        return [r._asdict() for r in index.get_targets(curie, modulation, target_type)]
+    if kind == "target":
+        return [r._asdict() for r in index.get_chemicals(curie, modulation, target_type)]
+    if kind == "role":
+        return index.get_role_chemicals(curie, modulation, target_type)
+    raise KeyError(kind)
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _get_handler(service: RelationService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: HTTPStatus, body: bytes) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status: HTTPStatus, message: str) -> None:
+            self._send(status, _dumps({"error": message}))
+
+        def do_GET(self):  # noqa:N802
+            url = urlparse(self.path)
+            kind, _, curie = url.path.strip("/").partition("/")
+            if kind not in BATCH_KEYS.values() or not curie:
+                return self._error(HTTPStatus.NOT_FOUND, f"unknown path: {url.path}")
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                body = service.lookup(
+                    kind, unquote(curie), params.get("modulation"), params.get("target_type")
+                )
+            except ValueError as e:
+                return self._error(HTTPStatus.BAD_REQUEST, str(e))
+            self._send(HTTPStatus.OK, body)
+
+        def do_POST(self):  # noqa:N802
+            if urlparse(self.path).path.strip("/") != "batch":
+                return self._error(HTTPStatus.NOT_FOUND, f"unknown path: {self.path}")
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length < 0:
+                    raise ValueError(f"invalid Content-Length: {length}")
+                query = json.loads(self.rfile.read(length))
+                if not isinstance(query, dict):
+                    raise ValueError("batch query should be a JSON object")
+                result = service.batch(query)
+            except ValueError as e:
+                return self._error(HTTPStatus.BAD_REQUEST, str(e))
+            self._send(HTTPStatus.OK, _dumps(result))
+
+        def log_message(self, format, *args):  # noqa:A002
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def make_server(
+    service: RelationService, host: str = "127.0.0.1", port: int = 5000
+) -> ThreadingHTTPServer:
+    """Make a threaded HTTP server for the service."""
+    return ThreadingHTTPServer((host, port), _get_handler(service))
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=5000, show_default=True)
+@click.option(
+    "--snapshot",
+    type=click.Path(dir_okay=False),
+    default=RELATIONS_OUTPUT_PATH,
+    show_default=True,
+    help="A relations TSV that's reloaded when it's rewritten. If it doesn't exist, "
+    "the relations are assembled from scratch instead.",
+)
+@click.option("--cache-size", type=int, default=4096, show_default=True)
+@click.option("--reload-interval", type=float, default=2.0, show_default=True)
+@verbose_option
+def serve(host: str, port: int, snapshot: str, cache_size: int, reload_interval: float):
+    """Serve lookups over the relations as JSON."""
+    service = RelationService(
+        path=snapshot if os.path.exists(snapshot) else None,
+        cache_size=cache_size,
+        reload_interval=reload_interval,
+    )
+    service.start_watching()
+    server = make_server(service, host=host, port=port)
+    click.echo(f"Serving {len(service.index)} relations on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop_watching()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -2,6 +2,7 @@
 
 """Chemical relation curation utilities."""
 
+import hashlib
 import logging
 from collections import defaultdict
 from typing import Iterable, Mapping, Set, Tuple
@@ -42,6 +43,27 @@ SUFFIXES = [
 SUFFIXES.extend([f"{suffix}s" for suffix in SUFFIXES])
 
 
+def normalize_curie(prefix: str, identifier: str) -> Tuple[str, str]:
+    """Normalize a prefix and identifier pair.
+
+    The prefix is lowercased and redundant prefixes in the identifier, like
+    ``CHEBI:`` in ``CHEBI:133016``, are removed.
+    """
+    prefix = prefix.lower()
+    if identifier.lower().startswith(f"{prefix}:"):
+        identifier = identifier[len(prefix) + 1 :]
+    return prefix, identifier
+
+
+def hash_file(path: str) -> str:
+    """Calculate the SHA-256 hash of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def sort_xrefs_df() -> None:
     """Sort xrefs.tsv."""
     df = get_xrefs_df()